@@ -0,0 +1,286 @@
+"""离线批量评分
+
+用法：
+    python batch_score.py --sketches saved/ --reference db/easy/客机.jpg -o scores.csv
+    python batch_score.py --manifest pairs.csv -o scores.jsonl --workers 4 --threads 2
+
+--sketches 对目录中的每张草图与同一张参照图评分；--manifest 读取草图→参照图的配对清单，
+支持带 sketch,reference 表头的CSV或每行一个 {"sketch": ..., "reference": ...} 的JSONL，
+清单中的相对路径相对于清单所在目录。
+评分在进程池中进行，每个工作进程只加载一次模型；结果完成后立即写入输出文件，
+输出文件已存在时跳过其中已成功评分的配对，从中断处继续。
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from compare import BACKENDS, SSIM_MODES, calculate_sketch_similarity, decode_gray, get_model, load_ssim_gray
+from feature_store import IMAGE_EXTENSIONS, ReferenceFeatures
+
+
+FIELDS = ('sketch', 'reference', 'score', 'error')
+
+# 工作进程内的评分状态，由_init_worker初始化
+_worker = {}
+
+
+class _ReferenceCache:
+    """工作进程内的参照图特征缓存
+
+    与ReferenceFeatureStore的lookup接口一致，可直接传给calculate_sketch_similarity，
+    同一参照图在一个进程内只提取一次特征。不写磁盘索引，避免多个进程同时改写。
+    """
+
+    def __init__(self, model, capacity=64):
+        self.model = model
+        self.model_version = model.version
+        self.capacity = capacity
+        self.entries = OrderedDict()
+
+    def lookup(self, path):
+        features = self.entries.get(path)
+        if features is not None:
+            self.entries.move_to_end(path)
+            return features
+        gray = decode_gray(path)
+        ssim_gray = load_ssim_gray(gray)
+        features = ReferenceFeatures(path=path,
+                                     embedding=self.model.extract_features(gray),
+                                     gray=ssim_gray,
+                                     mean=float(ssim_gray.mean()),
+                                     var=float(ssim_gray.var()))
+        self.entries[path] = features
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+        return features
+
+
+def _init_worker(device, backend, ssim_mode, threads):
+    """工作进程初始化：设置算子内线程数并加载、预热模型"""
+    model = get_model(device=device, backend=backend, num_threads=threads)
+    _worker.update(device=device, backend=backend, ssim_mode=ssim_mode, references=_ReferenceCache(model))
+
+
+def _score_chunk(pairs):
+    """在工作进程中为一组(草图, 参照图, 草图路径, 参照图路径)评分，单张图失败不影响其余配对"""
+    results = []
+    for sketch, reference, sketch_path, reference_path in pairs:
+        row = {'sketch': sketch, 'reference': reference, 'score': '', 'error': ''}
+        try:
+            score = calculate_sketch_similarity(sketch_path, reference_path, device=_worker['device'],
+                                                store=_worker['references'], ssim_mode=_worker['ssim_mode'],
+                                                backend=_worker['backend'])
+            row['score'] = round(float(score), 6)
+        except Exception as e:
+            row['error'] = f"{type(e).__name__}: {e}"
+        results.append(row)
+    return results
+
+
+def pairs_from_directory(sketch_dir, reference):
+    """目录中的每张草图都与同一张参照图配对"""
+    pairs = []
+    for dirpath, dirnames, filenames in os.walk(sketch_dir):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+        for name in sorted(filenames):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                path = os.path.join(dirpath, name)
+                pairs.append((path, reference, path, reference))
+    return pairs
+
+
+def pairs_from_manifest(manifest_path):
+    """读取CSV或JSONL配对清单，返回(草图, 参照图, 草图路径, 参照图路径)列表"""
+    base = os.path.dirname(os.path.abspath(manifest_path))
+    with open(manifest_path, 'r', encoding='utf-8-sig', newline='') as f:
+        if manifest_path.lower().endswith(('.jsonl', '.json')):
+            records = [json.loads(line) for line in f if line.strip()]
+        else:
+            records = list(csv.DictReader(f))
+    pairs = []
+    for number, record in enumerate(records, 1):
+        try:
+            sketch, reference = record['sketch'], record['reference']
+        except KeyError:
+            raise ValueError(f"清单第{number}条缺少sketch或reference字段: {record}")
+        pairs.append((sketch, reference, os.path.join(base, sketch), os.path.join(base, reference)))
+    return pairs
+
+
+def _output_format(path, fmt=None):
+    """输出格式：显式指定或由扩展名推断"""
+    if fmt:
+        return fmt
+    return 'jsonl' if path.lower().endswith(('.jsonl', '.json')) else 'csv'
+
+
+def load_finished(output_path, fmt):
+    """读取已有输出文件中成功评分的配对
+
+    中断时可能留下写了一半的最后一行，先将文件截断到最后一个完整行。
+    """
+    if not os.path.exists(output_path):
+        return set()
+    with open(output_path, 'rb') as f:
+        data = f.read()
+    end = data.rfind(b'\n') + 1
+    if end < len(data):
+        with open(output_path, 'r+b') as f:
+            f.truncate(end)
+        data = data[:end]
+    text = data.decode('utf-8-sig')
+
+    if fmt == 'jsonl':
+        rows = []
+        for line in text.splitlines():
+            try:
+                rows.append(json.loads(line))
+            except ValueError:
+                continue
+    else:
+        rows = list(csv.DictReader(io.StringIO(text)))
+    return {(row.get('sketch'), row.get('reference')) for row in rows
+            if row.get('score') not in (None, '') and not row.get('error')}
+
+
+class ResultWriter:
+    """将评分结果逐条追加写入CSV或JSONL，每条写完即刷新"""
+
+    def __init__(self, path, fmt):
+        self.fmt = fmt
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, 'a', encoding='utf-8', newline='')
+        if fmt == 'csv':
+            self.writer = csv.DictWriter(self.file, fieldnames=FIELDS)
+            if new_file:
+                self.writer.writeheader()
+
+    def write(self, row):
+        if self.fmt == 'jsonl':
+            self.file.write(json.dumps(row, ensure_ascii=False) + '\n')
+        else:
+            self.writer.writerow(row)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class Progress:
+    """按固定间隔在stderr打印进度、吞吐量与预计剩余时间"""
+
+    def __init__(self, total, interval=2.0, stream=sys.stderr):
+        self.total = total
+        self.interval = interval
+        self.stream = stream
+        self.done = 0
+        self.failed = 0
+        self.start = time.perf_counter()
+        self._last = self.start
+
+    def update(self, count, failed=0, force=False):
+        self.done += count
+        self.failed += failed
+        now = time.perf_counter()
+        if not force and now - self._last < self.interval:
+            return
+        self._last = now
+        elapsed = now - self.start
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        eta = (self.total - self.done) / rate if rate > 0 else float('inf')
+        eta_text = time.strftime('%H:%M:%S', time.gmtime(eta)) if eta != float('inf') else '--:--:--'
+        print(f"{self.done}/{self.total}  {rate:.1f} 对/秒  失败 {self.failed}  剩余 {eta_text}",
+              file=self.stream, flush=True)
+
+
+def run(pairs, output_path, fmt=None, workers=None, threads=None, device='cpu', backend='eager',
+        ssim_mode='global', chunk_size=8, resume=True):
+    """批量评分并流式写出结果，返回本次评分的配对数"""
+    fmt = _output_format(output_path, fmt)
+    if resume:
+        finished = load_finished(output_path, fmt)
+    else:
+        finished = set()
+        if os.path.exists(output_path):
+            os.remove(output_path)
+    todo = [pair for pair in pairs if (pair[0], pair[1]) not in finished]
+    if finished:
+        print(f"已完成 {len(pairs) - len(todo)} 对，继续评分剩余 {len(todo)} 对", file=sys.stderr)
+    if not todo:
+        return 0
+
+    workers = workers or os.cpu_count() or 1
+    workers = min(workers, (len(todo) + chunk_size - 1) // chunk_size)
+    if threads is None:
+        # 默认将CPU核心平均分给各工作进程，避免算子内线程互相争抢
+        threads = max(1, (os.cpu_count() or 1) // workers)
+    chunks = [todo[i:i + chunk_size] for i in range(0, len(todo), chunk_size)]
+
+    writer = ResultWriter(output_path, fmt)
+    progress = Progress(len(todo))
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(device, backend, ssim_mode, threads)) as pool:
+            # 限制在途任务数，结果按完成顺序写出
+            pending = set()
+            chunks = iter(chunks)
+            while True:
+                for chunk in chunks:
+                    pending.add(pool.submit(_score_chunk, chunk))
+                    if len(pending) >= workers * 2:
+                        break
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    rows = future.result()
+                    for row in rows:
+                        writer.write(row)
+                    progress.update(len(rows), failed=sum(1 for row in rows if row['error']))
+    finally:
+        writer.close()
+    progress.update(0, force=True)
+    return progress.done
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='离线批量计算草图与参照图的相似度')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--sketches', help='草图目录，目录中的每张图都与--reference评分')
+    source.add_argument('--manifest', help='草图→参照图配对清单（CSV或JSONL）')
+    parser.add_argument('--reference', help='--sketches模式下的参照图')
+    parser.add_argument('-o', '--output', required=True, help='结果文件（.csv或.jsonl）')
+    parser.add_argument('--format', choices=('csv', 'jsonl'), default=None, help='输出格式，默认由扩展名推断')
+    parser.add_argument('--workers', type=int, default=None, help='工作进程数，默认为CPU核心数')
+    parser.add_argument('--threads', type=int, default=None, help='每个工作进程的算子内线程数')
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--backend', choices=BACKENDS, default='eager')
+    parser.add_argument('--ssim-mode', choices=SSIM_MODES, default='global')
+    parser.add_argument('--chunk-size', type=int, default=8, help='每次分派给工作进程的配对数')
+    parser.add_argument('--no-resume', action='store_true', help='忽略并覆盖已有的输出文件')
+    args = parser.parse_args(argv)
+
+    if args.sketches:
+        if not args.reference:
+            parser.error('--sketches 需要同时指定 --reference')
+        pairs = pairs_from_directory(args.sketches, args.reference)
+    else:
+        pairs = pairs_from_manifest(args.manifest)
+
+    start = time.perf_counter()
+    count = run(pairs, args.output, fmt=args.format, workers=args.workers, threads=args.threads,
+                device=args.device, backend=args.backend, ssim_mode=args.ssim_mode,
+                chunk_size=args.chunk_size, resume=not args.no_resume)
+    elapsed = time.perf_counter() - start
+    if count:
+        print(f"完成 {count} 对，用时 {elapsed:.1f} 秒，{count / elapsed:.1f} 对/秒", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
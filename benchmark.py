@@ -0,0 +1,1201 @@
+"""相似度比对流程的性能基准测试
+
+用法：
+    python benchmark.py ssim        对比全图SSIM与窗口化SSIM/MS-SSIM的耗时
+    python benchmark.py backends    对比各推理后端的速度与特征偏差
+    python benchmark.py preprocess  对比原PIL预处理链与ndarray预处理流程的分阶段耗时与内存
+    python benchmark.py pipeline    比对流程各阶段的延迟分位数、吞吐量与峰值内存，可保存为JSON
+    python benchmark.py compare     将保存的结果与基线对比，任一阶段退化超过阈值时以非零状态退出
+    python benchmark.py strokes     对比逐点字典与笔画数组两种操作记录的每点字节数与重绘耗时
+    python benchmark.py canvas      对比逐点圆与单条折线两种铅笔渲染方式的画布对象数与重绘耗时（需要图形界面）
+    python benchmark.py session     对比会话文件与PNG、PostScript的文件大小与保存、加载耗时
+    python benchmark.py simplify    铅笔笔画在线简化的压缩比与相对未简化重绘的像素差异
+    python benchmark.py erase       按位置裁剪的橡皮擦与背景色覆盖的操作记录条目数、会话文件大小与按位置查询耗时
+    python benchmark.py input       对比拖动事件逐个处理与按帧合并处理的耗时与输入延迟（需要图形界面）
+    python benchmark.py export      对比SVG、PDF导出与PNG、PostScript的文件大小、导出耗时与峰值内存
+    python benchmark.py import      对比导入图片的原方式、快速解码与缓存命中的耗时
+    python benchmark.py save        对比原保存方式与后台保存时主线程的耗时，以及各PNG压缩级别的编码耗时与文件大小
+
+基线回归检查示例：
+    python benchmark.py pipeline --output baseline.json
+    python benchmark.py pipeline --output current.json --baseline baseline.json --threshold 0.2
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import statistics
+import sys
+import threading
+import time
+
+import numpy as np
+
+
+def _time_call(fn, repeat):
+    """重复调用fn，返回每次耗时（毫秒）"""
+    fn()  # 预热
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def _print_table(title, rows):
+    """打印基准测试结果表"""
+    print(title)
+    print(f"{'名称':<28}{'中位数(ms)':>10}{'最小值(ms)':>10}{'相对耗时':>10}")
+    base = rows[0][1]
+    for name, median, minimum in rows:
+        print(f"{name:<30}{median:>12.3f}{minimum:>12.3f}{median / base:>13.1f}x")
+
+
+def bench_ssim(repeat=200, size=224, seed=0):
+    """对比各SSIM实现在size x size灰度图上的耗时"""
+    from compare import calculate_ssim, calculate_local_ssim, calculate_ms_ssim
+
+    rng = np.random.default_rng(seed)
+    img1 = rng.integers(0, 256, (size, size), dtype=np.uint8)
+    img2 = rng.integers(0, 256, (size, size), dtype=np.uint8)
+
+    cases = [
+        ('global (float64)', lambda: calculate_ssim(img1, img2)),
+        ('local box 7x7', lambda: calculate_local_ssim(img1, img2, win_size=7)),
+        ('local box 31x31', lambda: calculate_local_ssim(img1, img2, win_size=31)),
+        ('local gaussian 11x11', lambda: calculate_local_ssim(img1, img2, win_size=11, gaussian=True)),
+        ('ms-ssim 5 scales', lambda: calculate_ms_ssim(img1, img2)),
+    ]
+    results = {}
+    rows = []
+    for name, fn in cases:
+        timings = _time_call(fn, repeat)
+        results[name] = {'median_ms': statistics.median(timings), 'min_ms': min(timings)}
+        rows.append((name, results[name]['median_ms'], results[name]['min_ms']))
+    _print_table(f"SSIM ({size}x{size}, 重复{repeat}次)", rows)
+    return results
+
+
+def bench_backends(paths=None, threads=None, tolerance=1e-3, batch_size=8, repeat=3):
+    """对比各推理后端的吞吐量与相对eager fp32的特征偏差，并给出满足容差的最快后端"""
+    import torch
+    from compare import check_backend_parity
+
+    if threads is not None:
+        torch.set_num_threads(threads)
+    paths = paths or sorted(glob.glob('./db/*/*'))
+    report = check_backend_parity(paths * repeat, tolerance=tolerance, batch_size=batch_size)
+
+    print(f"推理后端 ({len(paths) * repeat}张图, 线程数{torch.get_num_threads()}, 批大小{batch_size})")
+    print(f"{'后端':<16}{'图/秒':>10}{'最大偏差':>14}{'平均偏差':>14}  {'是否达标'}")
+    for backend, stats in report.items():
+        print(f"{backend:<18}{stats['images_per_sec']:>10.1f}{stats['max_drift']:>16.2e}"
+              f"{stats['mean_drift']:>16.2e}  {'是' if stats['ok'] else '否'}")
+    passed = [b for b, stats in report.items() if stats['ok']]
+    if passed:
+        best = max(passed, key=lambda b: report[b]['images_per_sec'])
+        print(f"满足容差{tolerance:g}的最快后端: {best}")
+    return report
+
+
+def _nbytes(obj):
+    """估算图像对象占用的字节数"""
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if hasattr(obj, 'element_size'):
+        return obj.element_size() * obj.nelement()
+    if hasattr(obj, 'getbands'):
+        return obj.size[0] * obj.size[1] * len(obj.getbands())
+    return 0
+
+
+def _legacy_preprocess_stages(path):
+    """原PIL预处理链：锐化、边缘检测后转回3通道PIL，再经torchvision变换；SSIM分支重新打开图片"""
+    import cv2
+    import torchvision.transforms as transforms
+    from PIL import Image, ImageEnhance
+
+    resize = transforms.Resize((224, 224))
+    to_tensor = transforms.ToTensor()
+    normalize = transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+    kernel = np.ones((3, 3), np.uint8)
+
+    def decode(_):
+        img = Image.open(path)
+        img.load()
+        return img
+
+    def ssim_decode(_):
+        return Image.open(path).convert('L')
+
+    return [
+        ('解码', decode),
+        ('灰度转换', lambda img: img.convert('L')),
+        ('锐化', lambda img: ImageEnhance.Sharpness(img).enhance(2.5)),
+        ('转为ndarray', np.array),
+        ('Canny', lambda arr: cv2.Canny(arr, 50, 150)),
+        ('闭运算', lambda edges: cv2.morphologyEx(edges, cv2.MORPH_CLOSE, kernel)),
+        ('转为RGB图像', lambda edges: Image.fromarray(edges).convert('RGB')),
+        ('缩放', resize),
+        ('ToTensor', to_tensor),
+        ('Normalize', normalize),
+        ('SSIM重新解码', ssim_decode),
+        ('SSIM缩放', lambda img: np.array(img.resize((224, 224)))),
+    ]
+
+
+def _ndarray_preprocess_stages(path, resize_first=False):
+    """ndarray预处理流程：解码一次，模型输入与SSIM灰度图共用同一张灰度图
+
+    返回阶段列表与当前线程的预分配缓冲区
+    """
+    import cv2
+    from compare import SketchPreprocessor
+
+    pre = SketchPreprocessor(resize_first=resize_first)
+    decoded = {}
+
+    def decode(_):
+        decoded['gray'] = pre.decode(path)
+        return decoded['gray']
+
+    def canny(gray):
+        low, high = pre.canny_thresholds
+        return cv2.Canny(gray, low, high, edges=pre._buffer('edges', gray.shape))
+
+    def close(edges):
+        return cv2.morphologyEx(edges, cv2.MORPH_CLOSE, pre.close_kernel, dst=pre._buffer('closed', edges.shape))
+
+    stages = [('解码(灰度)', decode)]
+    if resize_first:
+        stages.append(('缩放', pre.resize))
+    stages += [('锐化', pre.sharpen), ('Canny', canny), ('闭运算', close)]
+    if not resize_first:
+        stages.append(('缩放', lambda edges: pre.resize(edges, name='edge_map')))
+    stages += [('归一化张量', pre.to_tensor),
+               ('SSIM缩放', lambda _: pre.ssim_gray(decoded['gray']))]
+    return stages, lambda: pre._local.buffers.values()
+
+
+def _run_stages(stages, repeat, buffers=None):
+    """逐阶段计时并统计内存
+
+    分配字节数为该阶段新分配的输出大小，输出写入buffers()中的预分配缓冲区时记为0；
+    峰值为各阶段输入与输出同时存活时的最大字节数。
+    """
+    timings = {name: [] for name, _ in stages}
+    allocated = {}
+    peak = 0
+    for iteration in range(repeat + 1):
+        value = None
+        for name, fn in stages:
+            start = time.perf_counter()
+            output = fn(value)
+            elapsed = (time.perf_counter() - start) * 1000
+            if iteration > 0:  # 第一轮为预热
+                timings[name].append(elapsed)
+                reused = buffers is not None and any(output is buffer for buffer in buffers())
+                allocated[name] = 0 if reused else _nbytes(output)
+                peak = max(peak, _nbytes(value) + _nbytes(output))
+            value = output
+    return {name: {'median_ms': statistics.median(times), 'allocated_bytes': allocated[name]}
+            for name, times in timings.items()}, peak
+
+
+def bench_preprocess(paths=None, repeat=20, resize_first=False):
+    """对比原PIL预处理链与ndarray预处理流程的分阶段耗时、分配字节数与峰值内存"""
+    paths = paths or sorted(glob.glob('./db/*/*'))[:1]
+    results = {}
+    for path in paths:
+        chains = [('原PIL预处理链', _legacy_preprocess_stages(path), None),
+                  ('ndarray预处理流程',) + _ndarray_preprocess_stages(path, resize_first=resize_first)]
+        print(f"预处理: {path} (resize_first={resize_first}, 重复{repeat}次)")
+        results[path] = {}
+        for title, stages, buffers in chains:
+            stats, peak = _run_stages(stages, repeat, buffers)
+            total_ms = sum(stat['median_ms'] for stat in stats.values())
+            total_bytes = sum(stat['allocated_bytes'] for stat in stats.values())
+            print(f"  {title}")
+            for name, stat in stats.items():
+                print(f"    {name:<14}{stat['median_ms']:>10.3f} ms{stat['allocated_bytes'] / 1024:>12.1f} KiB")
+            print(f"    {'合计':<14}{total_ms:>10.3f} ms{total_bytes / 1024:>12.1f} KiB  峰值 {peak / 1024:.1f} KiB")
+            results[path][title] = {'stages': stats, 'total_ms': total_ms,
+                                    'allocated_bytes': total_bytes, 'peak_bytes': peak}
+    return results
+
+
+PIPELINE_STAGES = ('model_build', 'decode', 'preprocess_sketch', 'transform', 'forward',
+                   'cosine_similarity', 'calculate_ssim', 'calculate_sketch_similarity')
+
+
+def _current_rss():
+    """当前进程的常驻内存字节数，无法获取时返回None"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class RssSampler:
+    """在后台线程中定时采样常驻内存，记录with块执行期间的峰值"""
+
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+
+    def _sample(self):
+        rss = _current_rss()
+        if rss is not None and (self.peak is None or rss > self.peak):
+            self.peak = rss
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self._sample()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+
+def synthetic_sketches(count=8, size=(800, 600), seed=0):
+    """生成固定随机种子的合成草图：白底上的随机黑色线条与圆"""
+    from PIL import Image, ImageDraw
+
+    rng = np.random.default_rng(seed)
+    width, height = size
+    sketches = []
+    for _ in range(count):
+        img = Image.new('RGB', size, 'white')
+        draw = ImageDraw.Draw(img)
+        for _ in range(12):
+            x1, x2 = rng.integers(0, width, 2)
+            y1, y2 = rng.integers(0, height, 2)
+            draw.line((int(x1), int(y1), int(x2), int(y2)), fill='black', width=int(rng.integers(2, 8)))
+        for _ in range(3):
+            x, y = int(rng.integers(0, width - 100)), int(rng.integers(0, height - 100))
+            r = int(rng.integers(20, 100))
+            draw.ellipse((x, y, x + r, y + r), outline='black', width=3)
+        sketches.append(img)
+    return sketches
+
+
+def _stage_stats(timings, peak_rss):
+    """由单次耗时列表计算延迟分位数与吞吐量"""
+    timings = np.asarray(timings)
+    mean = float(timings.mean())
+    return {
+        'samples': int(len(timings)),
+        'p50_ms': float(np.percentile(timings, 50)),
+        'p95_ms': float(np.percentile(timings, 95)),
+        'p99_ms': float(np.percentile(timings, 99)),
+        'mean_ms': mean,
+        'throughput_per_sec': 1000 / mean if mean > 0 else 0.0,
+        'peak_rss_mb': peak_rss / 2 ** 20 if peak_rss is not None else None,
+    }
+
+
+def _measure(fn, inputs, repeat):
+    """对每个输入重复调用fn，返回(单次耗时列表, 峰值常驻内存)"""
+    for item in inputs[:1]:
+        fn(item)  # 预热
+    timings = []
+    with RssSampler() as sampler:
+        for _ in range(repeat):
+            for item in inputs:
+                start = time.perf_counter()
+                fn(item)
+                timings.append((time.perf_counter() - start) * 1000)
+    return timings, sampler.peak
+
+
+def bench_pipeline(references=None, sketches=8, repeat=5, build_repeat=3, device='cpu', backend='eager',
+                   threads=None, seed=0):
+    """对比对流程的各阶段计时
+
+    参照图默认取db/easy与db/hard下的全部图片，草图为固定种子生成的合成草图；
+    每个阶段都在全部输入上重复repeat次，返回可保存为JSON的结果字典。
+    """
+    import torch
+    import compare
+    from sklearn.metrics.pairwise import cosine_similarity
+
+    if threads is not None:
+        torch.set_num_threads(threads)
+    torch.manual_seed(seed)
+    references = references or sorted(glob.glob('./db/easy/*') + glob.glob('./db/hard/*'))
+    sketch_images = [np.asarray(img) for img in synthetic_sketches(sketches, seed=seed)]
+    sources = list(references) + sketch_images
+
+    stages = {}
+    timings, peak = _measure(lambda _: compare.SketchSimilarityModel(device=device, backend=backend).warmup(),
+                             [None], build_repeat)
+    stages['model_build'] = _stage_stats(timings, peak)
+
+    model = compare.SketchSimilarityModel(device=device, backend=backend).warmup()
+    grays = [compare.decode_gray(source) for source in sources]
+    edges = [model._preprocess_sketch(gray) for gray in grays]
+    tensors = [torch.from_numpy(model.preprocessor.to_tensor(edge)).unsqueeze(0) for edge in edges]
+    features = [model._forward(tensor).cpu().numpy() for tensor in tensors]
+    ssim_grays = [compare.load_ssim_gray(gray) for gray in grays]
+    pairs = list(range(len(sources)))
+    # 每张图与下一张图组成一对，覆盖参照图与合成草图之间的比对
+    partner = {i: (i + 1) % len(sources) for i in pairs}
+
+    cases = [
+        ('decode', lambda source: compare.decode_gray(source), sources),
+        ('preprocess_sketch', model._preprocess_sketch, grays),
+        ('transform', lambda edge: torch.from_numpy(model.preprocessor.to_tensor(edge)).unsqueeze(0), edges),
+        ('forward', model._forward, tensors),
+        ('cosine_similarity', lambda i: cosine_similarity(features[i], features[partner[i]]), pairs),
+        ('calculate_ssim', lambda i: compare.calculate_ssim(ssim_grays[i], ssim_grays[partner[i]]), pairs),
+        ('calculate_sketch_similarity',
+         lambda i: compare.calculate_sketch_similarity(sources[i], sources[partner[i]], device=device,
+                                                       backend=backend), pairs),
+    ]
+    for name, fn, inputs in cases:
+        timings, peak = _measure(fn, inputs, repeat)
+        stages[name] = _stage_stats(timings, peak)
+
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'torch': torch.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'threads': torch.get_num_threads(),
+            'device': device,
+            'backend': backend,
+            'references': len(references),
+            'sketches': sketches,
+            'repeat': repeat,
+            'seed': seed,
+        },
+        'stages': stages,
+    }
+
+
+def print_pipeline(result):
+    """打印各阶段的延迟分位数、吞吐量与峰值内存"""
+    meta = result['meta']
+    print(f"比对流程 ({meta['references']}张参照图 + {meta['sketches']}张合成草图, 重复{meta['repeat']}次, "
+          f"后端{meta['backend']}, 线程数{meta['threads']})")
+    print(f"{'阶段':<28}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'次/秒':>10}{'峰值RSS(MB)':>14}")
+    for name, stats in result['stages'].items():
+        rss = f"{stats['peak_rss_mb']:.1f}" if stats['peak_rss_mb'] is not None else '-'
+        print(f"{name:<30}{stats['p50_ms']:>10.3f}{stats['p95_ms']:>10.3f}{stats['p99_ms']:>10.3f}"
+              f"{stats['throughput_per_sec']:>11.1f}{rss:>14}")
+
+
+def compare_to_baseline(result, baseline, threshold=0.2, stage_thresholds=None, metric='p50_ms'):
+    """与基线逐阶段对比，返回退化超过阈值的阶段列表
+
+    阶段耗时超过基线的(1 + 阈值)倍即视为退化，stage_thresholds可为单个阶段指定阈值。
+    """
+    stage_thresholds = stage_thresholds or {}
+    regressions = []
+    print(f"与基线对比 ({metric})")
+    print(f"{'阶段':<28}{'基线':>10}{'当前':>10}{'变化':>10}  {'阈值':>6}")
+    for name, stats in result['stages'].items():
+        base = baseline['stages'].get(name)
+        if base is None:
+            print(f"{name:<30}{'-':>10}{stats[metric]:>10.3f}{'新增':>10}")
+            continue
+        limit = stage_thresholds.get(name, threshold)
+        change = stats[metric] / base[metric] - 1 if base[metric] > 0 else 0.0
+        regressed = change > limit
+        if regressed:
+            regressions.append(name)
+        print(f"{name:<30}{base[metric]:>10.3f}{stats[metric]:>10.3f}{change:>+10.1%}  {limit:>6.0%}"
+              f"{'  退化' if regressed else ''}")
+    return regressions
+
+
+def _parse_stage_thresholds(items):
+    """解析 阶段=阈值 形式的参数"""
+    thresholds = {}
+    for item in items or []:
+        name, _, value = item.partition('=')
+        if name not in PIPELINE_STAGES or not value:
+            raise argparse.ArgumentTypeError(f"无效的阶段阈值: {item}")
+        thresholds[name] = float(value)
+    return thresholds
+
+
+def _load_json(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _save_json(result, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+def _add_threshold_arguments(parser):
+    parser.add_argument('--threshold', type=float, default=0.2, help='允许的相对退化比例，默认0.2即20%%')
+    parser.add_argument('--stage-threshold', action='append', metavar='STAGE=RATIO',
+                        help='为单个阶段指定阈值，可重复，例如 forward=0.1')
+    parser.add_argument('--metric', choices=('p50_ms', 'p95_ms', 'p99_ms', 'mean_ms'), default='p50_ms')
+
+
+def synthetic_strokes(count=200, points=400, size=(1200, 800), seed=0):
+    """生成固定随机种子的随机游走笔画，返回每笔的点列表"""
+    rng = np.random.default_rng(seed)
+    width, height = size
+    strokes = []
+    for _ in range(count):
+        start = rng.uniform((0, 0), (width, height))
+        steps = rng.normal(0, 3, (points, 2)).cumsum(axis=0)
+        xy = np.clip(start + steps, 0, (width - 1, height - 1))
+        strokes.append([(float(x), float(y)) for x, y in xy])
+    return strokes
+
+
+def _legacy_operations(strokes, pen_size=5, color='#000000'):
+    """原操作记录格式：每个采样点一个字典"""
+    return [{'type': 'pencil', 'x': x, 'y': y, 'size': pen_size, 'fill': color}
+            for points in strokes for x, y in points]
+
+
+def _render_legacy(operations, size, back_color):
+    """按原格式逐点重绘"""
+    from PIL import Image, ImageDraw
+
+    img = Image.new('RGB', size, back_color)
+    draw = ImageDraw.Draw(img)
+    for op in operations:
+        half = op['size'] // 2
+        draw.ellipse([op['x'] - half, op['y'] - half, op['x'] + half, op['y'] + half],
+                     fill=op['fill'], outline=op['fill'])
+    return img
+
+
+def _stroke_log(strokes, pen_size=5, color='#000000'):
+    from strokes import OperationLog
+
+    log = OperationLog()
+    for points in strokes:
+        stroke = log.begin_stroke('pencil', color, pen_size)
+        for x, y in points:
+            stroke.append(x, y)
+        log.end_stroke()
+    return log
+
+
+def _traced_size(build):
+    """用tracemalloc统计build()返回的对象分配的字节数"""
+    import tracemalloc
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    allocated = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return result, allocated
+
+
+def bench_strokes(count=200, points=400, repeat=3, size=(1200, 800)):
+    """对比逐点字典与笔画数组两种操作记录的内存占用与重绘耗时"""
+    from raster import render_operations
+
+    strokes = synthetic_strokes(count, points, size)
+    total = count * points
+    legacy, legacy_bytes = _traced_size(lambda: _legacy_operations(strokes))
+    log, log_bytes = _traced_size(lambda: _stroke_log(strokes))
+
+    legacy_ms = statistics.median(_time_call(lambda: _render_legacy(legacy, size, '#FFFFFF'), repeat))
+    log_ms = statistics.median(_time_call(lambda: render_operations(log, size, '#FFFFFF'), repeat))
+    # 铅笔笔画按折线重绘，逐点字典按点画圆，两者只在相邻点之间的空隙处不同
+    diff_pixels = int((np.asarray(_render_legacy(legacy, size, '#FFFFFF'))
+                       != np.asarray(render_operations(log, size, '#FFFFFF'))).any(axis=2).sum())
+
+    print(f"操作记录 ({count}笔 x {points}点 = {total}点)")
+    print(f"{'格式':<16}{'总字节数':>14}{'每点字节数':>12}{'重绘(ms)':>12}")
+    print(f"{'逐点字典':<16}{legacy_bytes:>16}{legacy_bytes / total:>14.1f}{legacy_ms:>14.1f}")
+    print(f"{'笔画数组':<16}{log_bytes:>16}{log_bytes / total:>14.1f}{log_ms:>14.1f}")
+    print(f"重绘差异像素 {diff_pixels}（笔画数组按折线连接相邻点）")
+    return {'points': total,
+            'legacy': {'bytes': legacy_bytes, 'bytes_per_point': legacy_bytes / total, 'replay_ms': legacy_ms},
+            'strokes': {'bytes': log_bytes, 'bytes_per_point': log_bytes / total, 'replay_ms': log_ms},
+            'diff_pixels': diff_pixels}
+
+
+def synthetic_motion(count=50, size=(1200, 800), seed=0):
+    """生成固定随机种子的平滑曲线，按鼠标移动事件的间隔采样为整数坐标，返回每笔的事件点列表"""
+    rng = np.random.default_rng(seed)
+    width, height = size
+    strokes = []
+    for _ in range(count):
+        start = rng.uniform((100, 100), (width - 100, height - 100))
+        heading = rng.uniform(0, 2 * np.pi)
+        turn = rng.normal(0, 0.05)
+        x, y = start
+        points = [(int(round(x)), int(round(y)))]
+        for _ in range(int(rng.integers(40, 200))):
+            turn = 0.9 * turn + rng.normal(0, 0.03)
+            heading += turn
+            step = rng.uniform(1, 8)  # 相邻两个鼠标事件之间移动的像素数
+            x = min(max(x + step * np.cos(heading), 0), width - 1)
+            y = min(max(y + step * np.sin(heading), 0), height - 1)
+            point = (int(round(x)), int(round(y)))
+            if point != points[-1]:
+                points.append(point)
+        strokes.append(points)
+    return strokes
+
+
+def _interpolated_count(points, pen_size):
+    """原铅笔工具保存的点数：每个鼠标事件一个点，相距较远时每隔半个画笔大小补一个点"""
+    count = 1
+    for (x0, y0), (x1, y1) in zip(points, points[1:]):
+        distance = ((x1 - x0) ** 2 + (y1 - y0) ** 2) ** 0.5
+        if distance > pen_size / 3:
+            count += int(distance // (pen_size / 2))
+        count += 1
+    return count
+
+
+def _ink_mask(operations, size):
+    """重绘到白色背景上，返回着色像素的布尔掩码"""
+    from raster import render_operations
+
+    return np.asarray(render_operations(operations, size, '#FFFFFF').convert('L')) < 128
+
+
+def bench_simplify(count=50, pen_sizes=(2, 5, 10, 20), ratio=0.1, limit=0.4, size=(1200, 800)):
+    """铅笔笔画在线简化：每种画笔大小下的保存点数、压缩比、简化耗时与相对未简化重绘的像素差异
+
+    差异像素为两次重绘中着色不同的像素；明显差异像素为距离另一次重绘的笔迹超过一个像素的部分。
+    """
+    from PIL import Image, ImageFilter
+    from strokes import OperationLog, StrokeSimplifier, simplify_tolerance
+
+    strokes = synthetic_motion(count, size)
+    events = sum(len(points) for points in strokes)
+    results = {}
+    for pen_size in pen_sizes:
+        raw = _stroke_log(strokes, pen_size=pen_size)
+        simplified = OperationLog()
+        start = time.perf_counter()
+        for points in strokes:
+            simplifier = StrokeSimplifier(simplified.begin_stroke('pencil', '#000000', pen_size),
+                                          simplify_tolerance(pen_size, ratio, limit))
+            for x, y in points:
+                simplifier.add(x, y)
+            simplifier.finish()
+            simplified.end_stroke()
+        simplify_us = (time.perf_counter() - start) * 1e6 / events
+
+        expected = _ink_mask(raw, size)
+        actual = _ink_mask(simplified, size)
+        diff = int((expected != actual).sum())
+
+        def grow(mask):
+            return np.asarray(Image.fromarray(mask.astype(np.uint8) * 255).filter(ImageFilter.MaxFilter(3))) > 0
+
+        visible = int((expected & ~grow(actual)).sum() + (actual & ~grow(expected)).sum())
+        legacy = sum(_interpolated_count(points, pen_size) for points in strokes)
+        kept = simplified.point_count()
+        results[pen_size] = {'legacy_points': legacy, 'event_points': events, 'simplified_points': kept,
+                             'ratio': legacy / kept, 'event_ratio': events / kept, 'simplify_us': simplify_us,
+                             'diff_pixels': diff, 'diff_fraction': diff / max(int(expected.sum()), 1),
+                             'visible_pixels': visible}
+
+    print(f"笔画在线简化 ({count}笔, {events}个鼠标事件, 容差为画笔大小的{ratio}倍且不超过{limit}像素)")
+    print(f"{'画笔大小':<8}{'原保存点数':>10}{'简化后点数':>10}{'压缩比':>8}{'相对事件数':>10}"
+          f"{'每事件(us)':>12}{'差异像素':>10}{'差异比例':>10}{'明显差异像素':>12}")
+    for pen_size, stats in results.items():
+        print(f"{pen_size:<12}{stats['legacy_points']:>12}{stats['simplified_points']:>13}{stats['ratio']:>10.1f}x"
+              f"{stats['event_ratio']:>13.1f}x{stats['simplify_us']:>12.2f}{stats['diff_pixels']:>12}"
+              f"{stats['diff_fraction']:>13.2%}{stats['visible_pixels']:>16}")
+    return results
+
+
+def _draw_ovals(canvas, points, pen_size, color):
+    """原铅笔渲染方式：每个采样点一个圆"""
+    half = pen_size // 2
+    for x, y in points:
+        canvas.create_oval(x - half, y - half, x + half, y + half, fill=color, outline=color)
+
+
+def _draw_polyline(canvas, points, pen_size, color):
+    """折线渲染方式：与DrawBoard一致，先创建折线再逐点追加"""
+    import tkinter as tk
+
+    (x0, y0), (x1, y1) = points[0], points[1]
+    item = canvas.create_line(x0, y0, x1, y1, fill=color, width=pen_size, capstyle=tk.ROUND, joinstyle=tk.ROUND)
+    for x, y in points[2:]:
+        canvas.insert(item, 'end', (x, y))
+
+
+def bench_canvas(count=100, points=300, pen_size=5, repeat=5, size=(1200, 800)):
+    """对比两种铅笔渲染方式的每笔画布对象数、绘制耗时、整屏重绘耗时与清屏耗时"""
+    import tkinter as tk
+
+    strokes = synthetic_strokes(count, points, size)
+    root = tk.Tk()
+    width, height = size
+    canvas = tk.Canvas(root, width=width, height=height, bg='white')
+    canvas.pack()
+    root.update()
+
+    def redraw():
+        # 滚动一个像素再滚回，强制整块画布重绘
+        canvas.xview_scroll(1, 'units')
+        canvas.update()
+        canvas.xview_scroll(-1, 'units')
+        canvas.update()
+
+    results = {}
+    for name, draw_stroke in (('逐点圆', _draw_ovals), ('单条折线', _draw_polyline)):
+        start = time.perf_counter()
+        for stroke in strokes:
+            draw_stroke(canvas, stroke, pen_size, '#000000')
+        canvas.update()
+        draw_ms = (time.perf_counter() - start) * 1000
+        items = len(canvas.find_all())
+        redraw_ms = statistics.median(_time_call(redraw, repeat))
+        start = time.perf_counter()
+        canvas.delete('all')
+        canvas.update()
+        clear_ms = (time.perf_counter() - start) * 1000
+        results[name] = {'items': items, 'items_per_stroke': items / count, 'draw_ms': draw_ms,
+                         'redraw_ms': redraw_ms, 'clear_ms': clear_ms}
+    root.destroy()
+
+    print(f"铅笔渲染 ({count}笔 x {points}点, 画笔大小{pen_size})")
+    print(f"{'方式':<12}{'对象数':>10}{'每笔对象数':>12}{'绘制(ms)':>12}{'重绘(ms)':>12}{'清屏(ms)':>12}")
+    for name, stats in results.items():
+        print(f"{name:<12}{stats['items']:>12}{stats['items_per_stroke']:>14.1f}{stats['draw_ms']:>12.1f}"
+              f"{stats['redraw_ms']:>12.1f}{stats['clear_ms']:>12.1f}")
+    return results
+
+
+def bench_input(count=20, points=200, event_rate=1000, frame_rates=(0, 60, 120), pen_size=5, size=(1200, 800)):
+    """按event_rate每秒的频率向画板发送拖动事件，对比逐事件处理与按帧合并处理的
+    处理耗时、输入延迟与每次处理的事件数"""
+    import tkinter as tk
+    from types import SimpleNamespace
+
+    from draw import DrawBoard
+
+    strokes = synthetic_strokes(count, points, size)
+    results = {}
+    for frame_rate in frame_rates:
+        root = tk.Tk()
+        board = DrawBoard(root, *size, frame_rate=frame_rate)
+        board.size = pen_size
+        root.update()
+        apply = board.motion.callback
+        busy = [0.0]
+
+        def timed(samples):
+            tick = time.perf_counter()
+            apply(samples)
+            busy[0] += time.perf_counter() - tick
+
+        board.motion.callback = timed
+        for stroke in strokes:
+            x, y = stroke[0]
+            board.onLeftButtonDown(SimpleNamespace(x=int(x), y=int(y)))
+            due = time.perf_counter()
+            for x, y in stroke[1:]:
+                # 按固定频率产生事件，空闲时让Tk处理定时器与重绘
+                due += 1 / event_rate
+                while time.perf_counter() < due:
+                    root.update()
+                board.onLeftButtonMove(SimpleNamespace(x=int(x), y=int(y)))
+            board.onLeftButtonUp(SimpleNamespace(x=int(x), y=int(y)))
+            root.update()
+        report = board.motion.report()
+        board.scorer.shutdown()
+        root.destroy()
+        results[frame_rate] = dict(report, apply_ms=busy[0] * 1000,
+                                   apply_us_per_event=busy[0] * 1e6 / (count * (points - 1)))
+
+    print(f"拖动输入 ({count}笔 x {points}点, 每秒{event_rate}个事件, 画笔大小{pen_size})")
+    print(f"{'处理频率':<10}{'处理次数':>10}{'每次事件数':>10}{'延迟p50(ms)':>14}{'延迟p95(ms)':>14}"
+          f"{'处理耗时(ms)':>14}{'每事件(us)':>12}")
+    for frame_rate, stats in results.items():
+        name = '逐事件' if not frame_rate else f"{frame_rate} Hz"
+        print(f"{name:<12}{stats['flushes']:>12}{stats['events_per_flush']:>14.1f}{stats['latency_p50_ms']:>14.2f}"
+              f"{stats['latency_p95_ms']:>14.2f}{stats['apply_ms']:>16.1f}{stats['apply_us_per_event']:>14.1f}")
+    print("延迟为事件到达到画布修改完成的时间，按帧处理时最多多出一帧；处理耗时不含Tk重绘窗口的时间")
+    return results
+
+
+def _postscript(strokes, pen_size, size):
+    """用Tk画布导出PostScript，返回(字节数, 耗时ms)；没有图形界面时返回None"""
+    import tkinter as tk
+
+    try:
+        root = tk.Tk()
+    except tk.TclError:
+        return None
+    width, height = size
+    canvas = tk.Canvas(root, width=width, height=height, bg='white')
+    canvas.pack()
+    for points in strokes:
+        canvas.create_line(*[v for point in points for v in point], fill='#000000', width=pen_size,
+                           capstyle=tk.ROUND, joinstyle=tk.ROUND)
+    root.update()
+    start = time.perf_counter()
+    data = canvas.postscript(width=width, height=height)
+    elapsed = (time.perf_counter() - start) * 1000
+    root.destroy()
+    return len(data.encode('utf-8')), elapsed
+
+
+def bench_session(count=200, points=400, pen_size=5, repeat=5, size=(1200, 800)):
+    """对比会话文件、PNG与PostScript的文件大小与保存、加载耗时"""
+    import io
+    import tempfile
+
+    from PIL import Image
+    from raster import render_operations
+    from session import load_session, save_session
+
+    strokes = synthetic_strokes(count, points, size)
+    log = _stroke_log(strokes, pen_size=pen_size)
+    img = render_operations(log, size, '#FFFFFF')
+    results = {}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.sks')
+        save_ms = statistics.median(_time_call(lambda: save_session(path, log, size, '#FFFFFF'), repeat))
+        load_ms = statistics.median(_time_call(lambda: load_session(path), repeat))
+        replay_ms = statistics.median(_time_call(lambda: render_operations(load_session(path)[0], size, '#FFFFFF'),
+                                                 repeat))
+        results['会话文件'] = {'bytes': os.path.getsize(path), 'save_ms': save_ms, 'load_ms': load_ms,
+                           'load_render_ms': replay_ms}
+
+    def encode_png():
+        buffer = io.BytesIO()
+        img.save(buffer, 'PNG')
+        return buffer.getvalue()
+
+    png = encode_png()
+
+    def decode_png():
+        Image.open(io.BytesIO(png)).load()
+
+    results['PNG'] = {'bytes': len(png), 'save_ms': statistics.median(_time_call(encode_png, repeat)),
+                      'load_ms': statistics.median(_time_call(decode_png, repeat)), 'load_render_ms': None}
+
+    postscript = _postscript(strokes, pen_size, size)
+    if postscript is not None:
+        results['PostScript'] = {'bytes': postscript[0], 'save_ms': postscript[1], 'load_ms': None,
+                                 'load_render_ms': None}
+    reference_ps = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'canvas_output.ps')
+
+    def cell(value, width):
+        return f"{'-':>{width}}" if value is None else f"{value:>{width}.1f}"
+
+    print(f"会话文件 ({count}笔 x {points}点 = {count * points}点, 画布{size[0]}x{size[1]})")
+    print(f"{'格式':<12}{'字节数':>12}{'每点字节数':>12}{'保存(ms)':>12}{'加载(ms)':>12}{'加载并重绘(ms)':>16}")
+    for name, stats in results.items():
+        print(f"{name:<12}{stats['bytes']:>14}{stats['bytes'] / (count * points):>14.2f}"
+              f"{cell(stats['save_ms'], 12)}{cell(stats['load_ms'], 12)}{cell(stats['load_render_ms'], 16)}")
+    if postscript is None:
+        print("没有图形界面，跳过PostScript导出")
+    if os.path.exists(reference_ps):
+        print(f"参考：仓库中的canvas_output.ps为 {os.path.getsize(reference_ps)} 字节")
+    return results
+
+
+def bench_erase(count=200, points=400, drags=30, drag_points=40, radius=15, pen_size=5, size=(1200, 800), seed=0):
+    """对比用背景色覆盖与按位置裁剪两种橡皮擦的条目数、画布对象数、保存点数与会话文件大小，
+    以及网格索引与逐条目扫描的查询耗时"""
+    import tempfile
+
+    from eraser import Eraser
+    from raster import render_operations
+    from session import save_session
+
+    strokes = synthetic_strokes(count, points, size)
+    rng = np.random.default_rng(seed + 1)
+    paths = []
+    for _ in range(drags):
+        start = rng.uniform((0, 0), size)
+        steps = rng.normal(0, radius / 2, (drag_points, 2)).cumsum(axis=0)
+        paths.append([(float(x), float(y)) for x, y in np.clip(start + steps, 0, (size[0] - 1, size[1] - 1))])
+
+    # 原方式：每次拖动追加一笔橡皮擦轨迹，画布上每个轨迹点一个圆
+    painted = _stroke_log(strokes, pen_size=pen_size)
+    for path in paths:
+        stroke = painted.begin_stroke('erase', '#FFFFFF', radius * 2)
+        for x, y in path:
+            stroke.append(x, y)
+        painted.end_stroke()
+
+    trimmed = _stroke_log(strokes, pen_size=pen_size)
+    original_entries = len(trimmed)
+    queries = []
+    start = time.perf_counter()
+    for path in paths:
+        eraser = Eraser(trimmed, radius)
+        for x, y in path:
+            eraser.erase_to(x, y)
+        queries.extend((x - radius, y - radius, x + radius, y + radius) for x, y in path)
+    erase_ms = (time.perf_counter() - start) * 1e3
+
+    # 逐条目扫描使用预先算好的包围盒，只比较查询本身的耗时
+    bounds = [(entry, trimmed.bounds(entry)) for entry in trimmed.entries]
+
+    def linear(box):
+        x1, y1, x2, y2 = box
+        return [entry for entry, (bx1, by1, bx2, by2) in bounds
+                if bx1 <= x2 and x1 <= bx2 and by1 <= y2 and y1 <= by2]
+
+    grid_us = statistics.median(_time_call(lambda: [trimmed.query(box) for box in queries], 3)) * 1e3 / len(queries)
+    linear_us = statistics.median(_time_call(lambda: [linear(box) for box in queries], 3)) * 1e3 / len(queries)
+
+    expected = np.asarray(render_operations(painted, size, '#FFFFFF').convert('L')) < 128
+    actual = np.asarray(render_operations(trimmed, size, '#FFFFFF').convert('L')) < 128
+    diff = int((expected != actual).sum())
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, log, items in (('背景色覆盖', painted, count + sum(len(path) for path in paths)),
+                                 ('按位置裁剪', trimmed, len(trimmed))):
+            path = os.path.join(tmp, 'bench.sks')
+            save_session(path, log, size, '#FFFFFF')
+            results[name] = {'entries': len(log), 'canvas_items': items, 'points': log.point_count(),
+                             'nbytes': log.nbytes, 'session_bytes': os.path.getsize(path)}
+
+    print(f"橡皮擦 ({count}笔 x {points}点, {drags}次拖动 x {drag_points}点, 半径{radius})")
+    print(f"{'方式':<10}{'条目数':>8}{'画布对象数':>10}{'保存点数':>10}{'内存字节数':>12}{'会话文件字节数':>14}")
+    for name, stats in results.items():
+        print(f"{name:<10}{stats['entries']:>11}{stats['canvas_items']:>15}{stats['points']:>14}"
+              f"{stats['nbytes']:>17}{stats['session_bytes']:>21}")
+    print(f"裁剪耗时 {erase_ms:.1f} ms（每个轨迹点 {erase_ms * 1e3 / (drags * drag_points):.1f} us），"
+          f"原有{original_entries}笔")
+    print(f"每次查询：网格索引 {grid_us:.1f} us，逐条目扫描 {linear_us:.1f} us，加速 {linear_us / grid_us:.1f}x")
+    print(f"两种方式重绘结果的差异像素：{diff}（裁剪沿拖动路径连续擦除，原方式只在鼠标事件点处画圆）")
+    results['erase_ms'] = erase_ms
+    results['query_us'] = {'grid': grid_us, 'linear': linear_us}
+    results['diff_pixels'] = diff
+    return results
+
+
+def bench_export(count=200, points=400, pen_size=5, repeat=3, size=(1200, 800)):
+    """对比由操作记录导出SVG、PDF与PNG、Tk PostScript的文件大小、导出耗时与峰值内存
+
+    峰值内存用tracemalloc统计，同时给出笔画数为4倍时的结果，矢量导出的峰值内存不应随之增长。
+    """
+    import tempfile
+    import tracemalloc
+
+    from raster import render_operations
+    from vector import export_pdf, export_svg
+
+    strokes = synthetic_strokes(count, points, size)
+    log = _stroke_log(strokes, pen_size=pen_size)
+    large = _stroke_log(synthetic_strokes(count * 4, points, size, seed=1), pen_size=pen_size)
+
+    def export_png(path, operations):
+        render_operations(operations, size, '#FFFFFF').save(path)
+
+    def peak(export, path, operations):
+        tracemalloc.start()
+        export(path, operations)
+        result = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return result
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, export in (('SVG', lambda path, ops: export_svg(path, ops, size, '#FFFFFF')),
+                             ('PDF', lambda path, ops: export_pdf(path, ops, size, '#FFFFFF')),
+                             ('PNG', export_png)):
+            path = os.path.join(tmp, 'bench.' + name.lower())
+            export_ms = statistics.median(_time_call(lambda: export(path, log), repeat))
+            results[name] = {'bytes': os.path.getsize(path), 'export_ms': export_ms,
+                             'peak_kb': peak(export, path, log) / 1024,
+                             'peak_4x_kb': peak(export, path, large) / 1024}
+
+    postscript = _postscript(strokes, pen_size, size)
+    if postscript is not None:
+        results['PostScript'] = {'bytes': postscript[0], 'export_ms': postscript[1], 'peak_kb': None,
+                                 'peak_4x_kb': None}
+
+    def cell(value, width):
+        return f"{'-':>{width}}" if value is None else f"{value:>{width}.1f}"
+
+    print(f"导出 ({count}笔 x {points}点, 画布{size[0]}x{size[1]})")
+    print(f"{'格式':<12}{'字节数':>12}{'导出(ms)':>12}{'峰值内存(KB)':>14}{'4倍笔画峰值内存(KB)':>20}")
+    for name, stats in results.items():
+        print(f"{name:<12}{stats['bytes']:>14}{cell(stats['export_ms'], 12)}{cell(stats['peak_kb'], 16)}"
+              f"{cell(stats['peak_4x_kb'], 24)}")
+    if postscript is None:
+        print("没有图形界面，跳过PostScript导出")
+    reference_ps = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'canvas_output.ps')
+    if os.path.exists(reference_ps):
+        print(f"参考：仓库中的canvas_output.ps为 {os.path.getsize(reference_ps)} 字节")
+    return results
+
+
+def _synthetic_photo(path, size, seed=0):
+    """生成一张带平滑渐变与噪声的大图片，用于测试大照片的导入"""
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    width, height = size
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = np.stack([x / width, y / height, (x + y) / (width + height)], axis=2) * 200
+    noise = rng.normal(0, 12, (height // 8, width // 8, 3)).repeat(8, axis=0).repeat(8, axis=1)
+    Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8)).save(path, quality=90)
+
+
+def bench_import(paths=None, repeat=3, size=(1200, 800), photo_size=(4800, 3200)):
+    """对比导入图片的原方式（完整解码后LANCZOS缩放）、快速解码与缓存命中的耗时，
+    以及原重绘方式（完整解码后默认缩放）与屏幕显示的差异"""
+    import tempfile
+
+    from PIL import Image
+    from imagecache import ImageCache, decode_image
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if not paths:
+            paths = sorted(glob.glob('./db/easy/*'))[:2]
+            for ext in ('jpg', 'png'):
+                path = os.path.join(tmp, f"photo_{photo_size[0]}x{photo_size[1]}.{ext}")
+                _synthetic_photo(path, photo_size)
+                paths.append(path)
+
+        rows = []
+        for path in paths:
+            def legacy_open():
+                return Image.open(path).resize(size, Image.Resampling.LANCZOS)
+
+            def legacy_replay():
+                return Image.open(path).resize(size)
+
+            cache = ImageCache()
+            image_id = cache.register(path)
+            screen = legacy_open()
+            fast = decode_image(path, size)
+            cache.get(image_id, size)
+            rows.append({
+                'path': os.path.basename(path),
+                'source': '%dx%d' % Image.open(path).size,
+                'legacy_ms': statistics.median(_time_call(legacy_open, repeat)),
+                'fast_ms': statistics.median(_time_call(lambda: decode_image(path, size), repeat)),
+                'hit_us': statistics.median(_time_call(lambda: cache.get(image_id, size), repeat)) * 1e3,
+                # 与原导入方式显示在屏幕上的图像相比的平均像素差
+                'fast_diff': float(np.abs(np.asarray(fast.convert('RGB'), dtype=np.int16)
+                                          - np.asarray(screen.convert('RGB'), dtype=np.int16)).mean()),
+                'replay_diff': float(np.abs(np.asarray(legacy_replay().convert('RGB'), dtype=np.int16)
+                                            - np.asarray(screen.convert('RGB'), dtype=np.int16)).mean()),
+            })
+
+    print(f"图片导入 (缩放到{size[0]}x{size[1]})")
+    print(f"{'图片':<24}{'原尺寸':>12}{'原方式(ms)':>12}{'快速解码(ms)':>14}{'缓存命中(us)':>14}"
+          f"{'快速解码差异':>12}{'原重绘差异':>12}")
+    for row in rows:
+        print(f"{row['path']:<24}{row['source']:>14}{row['legacy_ms']:>14.1f}{row['fast_ms']:>16.1f}"
+              f"{row['hit_us']:>18.1f}{row['fast_diff']:>18.2f}{row['replay_diff']:>17.2f}")
+    print("差异为与原导入方式在屏幕上显示的图像相比的平均像素差（0~255）；原重绘方式没有使用LANCZOS")
+    return rows
+
+
+def bench_save(count=200, points=400, pen_size=5, levels=(1, 6, 9), repeat=3, size=(1200, 800)):
+    """对比原保存方式（主线程重放操作记录并编码PNG）与后台保存时主线程的耗时，
+    以及后台编码在不同PNG压缩级别与optimize下的耗时与文件大小"""
+    import tempfile
+
+    from raster import CanvasRaster, render_operations
+
+    log = _stroke_log(synthetic_strokes(count, points, size), pen_size=pen_size)
+    raster = CanvasRaster(size, '#FFFFFF')
+    raster.sync(log)
+
+    def take_snapshot():
+        raster._snapshot = None  # 模拟画布修改后的第一次快照
+        return raster.snapshot()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.png')
+        legacy_ms = statistics.median(_time_call(
+            lambda: render_operations(log, size, '#FFFFFF').save(path), repeat))
+        snapshot_ms = statistics.median(_time_call(take_snapshot, repeat))
+        img = take_snapshot()
+        rows = []
+        for level in levels:
+            for optimize in (False, True):
+                encode_ms = statistics.median(_time_call(
+                    lambda: img.save(path, 'PNG', compress_level=level, optimize=optimize), repeat))
+                rows.append({'compress_level': level, 'optimize': optimize, 'encode_ms': encode_ms,
+                             'bytes': os.path.getsize(path)})
+
+    print(f"保存PNG ({count}笔 x {points}点, {size[0]}x{size[1]})")
+    print(f"主线程耗时: 原方式 {legacy_ms:.1f} ms, 后台保存 {snapshot_ms:.2f} ms（只取快照）")
+    print(f"{'压缩级别':<8}{'optimize':>10}{'后台编码(ms)':>14}{'文件大小(KB)':>14}")
+    for row in rows:
+        print(f"{row['compress_level']:<12}{str(row['optimize']):>10}{row['encode_ms']:>16.1f}"
+              f"{row['bytes'] / 1024:>16.1f}")
+    return {'legacy_ms': legacy_ms, 'snapshot_ms': snapshot_ms, 'encode': rows}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='相似度比对性能基准测试')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    ssim_parser = subparsers.add_parser('ssim', help='SSIM实现耗时对比')
+    ssim_parser.add_argument('--repeat', type=int, default=200)
+    ssim_parser.add_argument('--size', type=int, default=224)
+
+    backend_parser = subparsers.add_parser('backends', help='推理后端速度与特征偏差对比')
+    backend_parser.add_argument('images', nargs='*', help='用于测试的图片，默认使用db目录下的参照图')
+    backend_parser.add_argument('--threads', type=int, default=None, help='算子内并行线程数')
+    backend_parser.add_argument('--tolerance', type=float, default=1e-3, help='允许的最大余弦偏差')
+    backend_parser.add_argument('--batch-size', type=int, default=8)
+    backend_parser.add_argument('--repeat', type=int, default=3)
+
+    preprocess_parser = subparsers.add_parser('preprocess', help='预处理流程分阶段耗时与内存对比')
+    preprocess_parser.add_argument('images', nargs='*', help='用于测试的图片，默认使用db目录下的第一张参照图')
+    preprocess_parser.add_argument('--repeat', type=int, default=20)
+    preprocess_parser.add_argument('--resize-first', action='store_true', help='先缩放再检测边缘')
+
+    pipeline_parser = subparsers.add_parser('pipeline', help='比对流程各阶段的延迟分位数、吞吐量与峰值内存')
+    pipeline_parser.add_argument('images', nargs='*', help='参照图，默认使用db/easy与db/hard下的全部图片')
+    pipeline_parser.add_argument('--sketches', type=int, default=8, help='合成草图数量')
+    pipeline_parser.add_argument('--repeat', type=int, default=5)
+    pipeline_parser.add_argument('--build-repeat', type=int, default=3, help='模型构建的重复次数')
+    pipeline_parser.add_argument('--device', default='cpu')
+    pipeline_parser.add_argument('--backend', default='eager')
+    pipeline_parser.add_argument('--threads', type=int, default=None, help='算子内并行线程数')
+    pipeline_parser.add_argument('--seed', type=int, default=0)
+    pipeline_parser.add_argument('--output', help='保存结果的JSON文件')
+    pipeline_parser.add_argument('--baseline', help='基线JSON文件，给出时在测试后与其对比')
+    _add_threshold_arguments(pipeline_parser)
+
+    compare_parser = subparsers.add_parser('compare', help='将保存的结果与基线对比')
+    compare_parser.add_argument('result', help='当前结果JSON文件')
+    compare_parser.add_argument('baseline', help='基线JSON文件')
+    _add_threshold_arguments(compare_parser)
+
+    input_parser = subparsers.add_parser('input', help='拖动事件逐个处理与按帧合并处理的耗时与延迟')
+    input_parser.add_argument('--strokes', type=int, default=20, help='笔画数')
+    input_parser.add_argument('--points', type=int, default=200, help='每笔的点数')
+    input_parser.add_argument('--event-rate', type=int, default=1000, help='每秒产生的拖动事件数')
+    input_parser.add_argument('--frame-rates', type=int, nargs='+', default=[0, 60, 120], help='0表示逐事件处理')
+
+    strokes_parser = subparsers.add_parser('strokes', help='操作记录的每点字节数与重绘耗时')
+    strokes_parser.add_argument('--strokes', type=int, default=200, help='笔画数')
+    strokes_parser.add_argument('--points', type=int, default=400, help='每笔的点数')
+    strokes_parser.add_argument('--repeat', type=int, default=3)
+
+    canvas_parser = subparsers.add_parser('canvas', help='铅笔渲染方式的画布对象数与重绘耗时')
+    canvas_parser.add_argument('--strokes', type=int, default=100, help='笔画数')
+    canvas_parser.add_argument('--points', type=int, default=300, help='每笔的点数')
+    canvas_parser.add_argument('--pen-size', type=int, default=5)
+    canvas_parser.add_argument('--repeat', type=int, default=5)
+
+    session_parser = subparsers.add_parser('session', help='会话文件与PNG、PostScript的大小与加载耗时')
+    session_parser.add_argument('--strokes', type=int, default=200, help='笔画数')
+    session_parser.add_argument('--points', type=int, default=400, help='每笔的点数')
+    session_parser.add_argument('--pen-size', type=int, default=5)
+    session_parser.add_argument('--repeat', type=int, default=5)
+
+    export_parser = subparsers.add_parser('export', help='SVG、PDF导出与PNG、PostScript的大小、耗时与峰值内存')
+    export_parser.add_argument('--strokes', type=int, default=200, help='笔画数')
+    export_parser.add_argument('--points', type=int, default=400, help='每笔的点数')
+    export_parser.add_argument('--pen-size', type=int, default=5)
+    export_parser.add_argument('--repeat', type=int, default=3)
+
+    import_parser = subparsers.add_parser('import', help='导入图片的快速解码与缓存耗时')
+    import_parser.add_argument('images', nargs='*', help='用于测试的图片，默认使用两张参照图与生成的大照片')
+    import_parser.add_argument('--repeat', type=int, default=3)
+
+    save_parser = subparsers.add_parser('save', help='后台保存PNG时主线程的耗时与各压缩级别的编码耗时、文件大小')
+    save_parser.add_argument('--strokes', type=int, default=200, help='笔画数')
+    save_parser.add_argument('--points', type=int, default=400, help='每笔的点数')
+    save_parser.add_argument('--pen-size', type=int, default=5)
+    save_parser.add_argument('--levels', type=int, nargs='+', default=[1, 6, 9], help='PNG压缩级别')
+    save_parser.add_argument('--repeat', type=int, default=3)
+
+    simplify_parser = subparsers.add_parser('simplify', help='笔画在线简化的压缩比与像素差异')
+    simplify_parser.add_argument('--strokes', type=int, default=50, help='笔画数')
+    simplify_parser.add_argument('--pen-sizes', type=int, nargs='+', default=[2, 5, 10, 20])
+    simplify_parser.add_argument('--ratio', type=float, default=0.1, help='容差占画笔大小的比例')
+    simplify_parser.add_argument('--limit', type=float, default=0.4, help='容差上限（像素）')
+
+    erase_parser = subparsers.add_parser('erase', help='按位置裁剪的橡皮擦与背景色覆盖的条目数、文件大小与查询耗时')
+    erase_parser.add_argument('--strokes', type=int, default=200, help='笔画数')
+    erase_parser.add_argument('--points', type=int, default=400, help='每笔的点数')
+    erase_parser.add_argument('--drags', type=int, default=30, help='橡皮擦拖动次数')
+    erase_parser.add_argument('--drag-points', type=int, default=40, help='每次拖动的轨迹点数')
+    erase_parser.add_argument('--radius', type=int, default=15, help='橡皮擦半径')
+
+    args = parser.parse_args()
+    if args.command == 'ssim':
+        bench_ssim(repeat=args.repeat, size=args.size)
+    elif args.command == 'backends':
+        bench_backends(args.images, threads=args.threads, tolerance=args.tolerance,
+                       batch_size=args.batch_size, repeat=args.repeat)
+    elif args.command == 'preprocess':
+        bench_preprocess(args.images, repeat=args.repeat, resize_first=args.resize_first)
+    elif args.command == 'canvas':
+        bench_canvas(args.strokes, args.points, pen_size=args.pen_size, repeat=args.repeat)
+    elif args.command == 'input':
+        bench_input(args.strokes, args.points, event_rate=args.event_rate, frame_rates=args.frame_rates)
+    elif args.command == 'strokes':
+        bench_strokes(args.strokes, args.points, repeat=args.repeat)
+    elif args.command == 'simplify':
+        results = bench_simplify(args.strokes, pen_sizes=args.pen_sizes, ratio=args.ratio, limit=args.limit)
+        visible = [pen_size for pen_size, stats in results.items() if stats['visible_pixels']]
+        if visible:
+            print(f"以下画笔大小的简化结果有明显差异: {', '.join(map(str, visible))}")
+            sys.exit(1)
+    elif args.command == 'export':
+        bench_export(args.strokes, args.points, pen_size=args.pen_size, repeat=args.repeat)
+    elif args.command == 'import':
+        bench_import(args.images, repeat=args.repeat)
+    elif args.command == 'save':
+        bench_save(args.strokes, args.points, pen_size=args.pen_size, levels=args.levels, repeat=args.repeat)
+    elif args.command == 'session':
+        bench_session(args.strokes, args.points, pen_size=args.pen_size, repeat=args.repeat)
+    elif args.command == 'erase':
+        bench_erase(args.strokes, args.points, drags=args.drags, drag_points=args.drag_points, radius=args.radius)
+    elif args.command in ('pipeline', 'compare'):
+        try:
+            stage_thresholds = _parse_stage_thresholds(args.stage_threshold)
+        except argparse.ArgumentTypeError as e:
+            parser.error(str(e))
+        if args.command == 'pipeline':
+            result = bench_pipeline(args.images, sketches=args.sketches, repeat=args.repeat,
+                                    build_repeat=args.build_repeat, device=args.device, backend=args.backend,
+                                    threads=args.threads, seed=args.seed)
+            print_pipeline(result)
+            if args.output:
+                _save_json(result, args.output)
+            baseline = _load_json(args.baseline) if args.baseline else None
+        else:
+            result, baseline = _load_json(args.result), _load_json(args.baseline)
+        if baseline is not None:
+            regressions = compare_to_baseline(result, baseline, threshold=args.threshold,
+                                              stage_thresholds=stage_thresholds, metric=args.metric)
+            if regressions:
+                print(f"以下阶段超过阈值: {', '.join(regressions)}")
+                sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
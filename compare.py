@@ -2,86 +2,460 @@ import torch
 import math
 import torch.nn as nn
 import torchvision.models as models
-import torchvision.transforms as transforms
 from torchvision.models import ResNet18_Weights
+from torchvision.models.quantization import ResNet18_QuantizedWeights
 from sklearn.metrics.pairwise import cosine_similarity
 import numpy as np
 import cv2
 import os
-from PIL import Image, ImageEnhance
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from PIL import Image
+from tracing import span
+
+
+# 进程级模型注册表：按 (设备, 权重, 推理后端) 缓存已预热的模型，避免每次比对重建ResNet18
+_model_registry = {}
+_registry_lock = threading.Lock()
+
+# 特征提取流程版本号，修改预处理或模型结构后需递增，以使磁盘上的参照特征库失效
+FEATURE_VERSION = 2
+SSIM_SIZE = (224, 224)
+SSIM_MODES = ('global', 'local', 'ms')
+# 可选的推理后端：eager为原始fp32模型，torchscript为跟踪并冻结的图，
+# int8为静态量化模型（仅CPU），channels_last为NHWC内存布局配合inference_mode
+BACKENDS = ('eager', 'torchscript', 'int8', 'channels_last')
+# 检索结果：参照图路径、综合相似度、余弦相似度与结构相似度
+Match = namedtuple('Match', ['path', 'score', 'cos_sim', 'ssim'])
+
+# MS-SSIM各尺度的权重（Wang et al. 2003），尺度数较少时取前几项并归一化
+MS_SSIM_WEIGHTS = (0.0448, 0.2856, 0.3001, 0.2363, 0.1333)
+
+
+class SketchPreprocessor:
+    """基于ndarray的草图预处理流程
+
+    解码一次得到灰度图后依次执行：缩放、锐化、Canny边缘检测、形态学闭运算，
+    最后直接由单通道边缘图生成归一化的3通道模型输入；同一张灰度图还用于生成SSIM分支的输入。
+    resize_first为True时先缩放到目标尺寸再检测边缘（JPEG还会用draft模式直接解码为小图），
+    速度更快；为False时在原始分辨率上检测边缘后再缩放，与原PIL流程一致。
+    中间结果写入按线程预分配的缓冲区，重复处理同尺寸图像时不再分配内存。
+    """
+
+    MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32).reshape(3, 1, 1)
+    STD = np.array([0.229, 0.224, 0.225], dtype=np.float32).reshape(3, 1, 1)
+
+    def __init__(self, size=(224, 224), resize_first=False, sharpness=2.5, canny_thresholds=(50, 150)):
+        self.size = size
+        self.resize_first = resize_first
+        self.canny_thresholds = canny_thresholds
+
+        # 与PIL的ImageEnhance.Sharpness等价的卷积核：原图与SMOOTH滤波结果按系数外插
+        smooth = np.array([[1, 1, 1], [1, 5, 1], [1, 1, 1]], dtype=np.float32) / 13
+        identity = np.zeros((3, 3), dtype=np.float32)
+        identity[1, 1] = 1
+        self.sharpen_kernel = sharpness * identity + (1 - sharpness) * smooth
+        self.close_kernel = np.ones((3, 3), np.uint8)
+
+        # ToTensor与Normalize合并为一次乘加：(x / 255 - mean) / std
+        self.scale = 1 / (255 * self.STD)
+        self.offset = -self.MEAN / self.STD
+        self._local = threading.local()
+
+    def _buffer(self, name, shape, dtype=np.uint8):
+        """获取当前线程的预分配缓冲区，尺寸变化时重新分配"""
+        buffers = self._local.__dict__.setdefault('buffers', {})
+        buffer = buffers.get(name)
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = np.empty(shape, dtype=dtype)
+            buffers[name] = buffer
+        return buffer
+
+    def decode(self, source):
+        """解码为uint8灰度图；二维uint8数组视为已解码的灰度图直接返回"""
+        if isinstance(source, np.ndarray):
+            if source.ndim == 2:
+                return source if source.dtype == np.uint8 else source.astype(np.uint8)
+            if source.shape[2] == 4:
+                return cv2.cvtColor(source, cv2.COLOR_RGBA2GRAY)
+            return cv2.cvtColor(source, cv2.COLOR_RGB2GRAY)
+        img = source if isinstance(source, Image.Image) else Image.open(source)
+        if self.resize_first and img.format == 'JPEG':
+            # 让JPEG解码器直接按1/2、1/4、1/8缩小并输出灰度
+            img.draft('L', self.size)
+        return np.asarray(img.convert('L'))
+
+    def resize(self, gray, name='resized'):
+        """缩放到目标尺寸，缩小用INTER_AREA抗锯齿"""
+        width, height = self.size
+        interpolation = cv2.INTER_AREA if gray.shape[1] >= width else cv2.INTER_LINEAR
+        return cv2.resize(gray, self.size, dst=self._buffer(name, (height, width)), interpolation=interpolation)
+
+    def sharpen(self, gray):
+        """锐化增强线条"""
+        return cv2.filter2D(gray, -1, self.sharpen_kernel, dst=self._buffer('sharpened', gray.shape),
+                            borderType=cv2.BORDER_REPLICATE)
+
+    def detect_edges(self, gray):
+        """Canny边缘检测后做形态学闭运算，连接断开的线条"""
+        low, high = self.canny_thresholds
+        edges = cv2.Canny(gray, low, high, edges=self._buffer('edges', gray.shape))
+        return cv2.morphologyEx(edges, cv2.MORPH_CLOSE, self.close_kernel, dst=self._buffer('closed', gray.shape))
+
+    def edge_map(self, gray):
+        """由灰度图生成目标尺寸的边缘图（结果位于线程缓冲区中，下次调用时会被覆盖）"""
+        if self.resize_first:
+            return self.detect_edges(self.sharpen(self.resize(gray)))
+        return self.resize(self.detect_edges(self.sharpen(gray)), name='edge_map')
+
+    def to_tensor(self, edges):
+        """由单通道边缘图直接生成归一化的 3 x H x W float32 数组"""
+        out = np.empty((3,) + edges.shape, dtype=np.float32)
+        np.multiply(edges, self.scale, out=out)
+        np.add(out, self.offset, out=out)
+        return out
+
+    def ssim_gray(self, gray):
+        """生成SSIM分支使用的目标尺寸灰度图"""
+        return self.resize(gray, name='ssim').copy()
+
+    def __call__(self, source):
+        """完整流程：解码并生成模型输入"""
+        return self.to_tensor(self.edge_map(self.decode(source)))
+
+
+# 模块级预处理器，供不依赖模型的SSIM分支使用
+_preprocessor = SketchPreprocessor(size=SSIM_SIZE)
 
 
 class SketchSimilarityModel:
-    def __init__(self, device='cpu'):
+    def __init__(self, device='cpu', weights=ResNet18_Weights.DEFAULT, backend='eager', num_threads=None,
+                 resize_first=False):
+        if backend not in BACKENDS:
+            raise ValueError(f"未知的推理后端: {backend}")
         self.device = torch.device(device)
-        self.model = self._load_pretrained_model().to(self.device)
-        self.transform = transforms.Compose([
-            transforms.Lambda(self._preprocess_sketch),
-            transforms.Resize((224, 224)),  # 调整为224x224以匹配ResNet输入
-            transforms.ToTensor(),
-            transforms.Normalize(mean=[0.485, 0.456, 0.406],
-                                 std=[0.229, 0.224, 0.225])
-        ])
+        if backend == 'int8' and self.device.type != 'cpu':
+            raise ValueError("int8量化模型仅支持CPU")
+        if num_threads is not None:
+            # 算子内并行线程数是进程级设置，会影响同进程中的所有模型
+            torch.set_num_threads(num_threads)
+        self.weights = weights
+        self.backend = backend
+        self.model = self._load_pretrained_model()
+        # 调整为224x224以匹配ResNet输入
+        self.preprocessor = SketchPreprocessor(size=(224, 224), resize_first=resize_first)
 
     def _load_pretrained_model(self):
-        """加载预训练的ResNet18模型并移除最后一层"""
-        model = models.resnet18(weights=ResNet18_Weights.DEFAULT)
+        """加载预训练的ResNet18模型并移除最后一层，按推理后端转换"""
+        if self.backend == 'int8':
+            return self._load_quantized_model()
+
+        model = models.resnet18(weights=self.weights)
         # 保留除最后一层外的所有层
         model = torch.nn.Sequential(*list(model.children())[:-1])
         model.eval()
+        model = model.to(self.device)
+
+        if self.backend == 'channels_last':
+            model = model.to(memory_format=torch.channels_last)
+        elif self.backend == 'torchscript':
+            example = torch.zeros(1, 3, 224, 224, device=self.device)
+            with torch.no_grad():
+                model = torch.jit.freeze(torch.jit.trace(model, example))
         return model
 
-    def _preprocess_sketch(self, img):
-        """强化预处理流程，突出草图线条特征"""
-        # 转换为灰度图
-        img = img.convert('L')
+    def _load_quantized_model(self):
+        """加载torchvision提供的静态int8量化ResNet18，并把最后的全连接层替换为恒等映射"""
+        weights = ResNet18_QuantizedWeights.DEFAULT if self.weights is not None else None
+        model = models.quantization.resnet18(weights=weights, quantize=True)
+        model.fc = nn.Identity()
+        model.eval()
+        return model
 
-        # 锐化处理增强线条
-        enhancer = ImageEnhance.Sharpness(img)
-        img = enhancer.enhance(2.5)
+    @property
+    def version(self):
+        """模型版本标识，用于判断缓存的特征是否仍然有效"""
+        return f"{self.weights}|{self.backend}|v{FEATURE_VERSION}"
 
-        # 转换为numpy数组进行形态学操作
-        img_array = np.array(img)
+    def _forward(self, batch):
+        """对一批输入做前向传播，返回 N x 512 的特征"""
+        batch = batch.to(self.device)
+        if self.backend == 'eager':
+            with torch.no_grad():
+                return self.model(batch).flatten(1)
+        if self.backend == 'channels_last':
+            batch = batch.contiguous(memory_format=torch.channels_last)
+        with torch.inference_mode():
+            return self.model(batch).flatten(1)
 
-        # 使用Canny边缘检测
-        edges = cv2.Canny(img_array, 50, 150)
+    def warmup(self):
+        """用空输入做一次前向传播，提前完成内存分配与算子初始化"""
+        self._forward(torch.zeros(1, 3, 224, 224))
+        return self
 
-        # 形态学闭运算，连接断开的线条
-        kernel = np.ones((3, 3), np.uint8)
-        closed_edges = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, kernel)
+    def _preprocess_sketch(self, img):
+        """强化预处理流程，突出草图线条特征，返回224x224的边缘图"""
+        return self.preprocessor.edge_map(self.preprocessor.decode(img)).copy()
 
-        # 转换回PIL图像并扩展为3通道
-        processed_img = Image.fromarray(closed_edges).convert('RGB')
-        return processed_img
+    def _prepare(self, source):
+        """加载并预处理单张图像，返回模型输入张量"""
+        return torch.from_numpy(self.preprocessor(source))
 
     def extract_features(self, img_path):
-        """提取图像特征"""
-        img = Image.open(img_path)
-        img = self.transform(img).unsqueeze(0).to(self.device)
-        with torch.no_grad():
-            features = self.model(img)
+        """提取图像特征，img_path可以是路径、PIL图像、ndarray或已解码的二维灰度数组"""
+        with span('preprocess'):
+            tensor = self._prepare(img_path).unsqueeze(0)
+        with span('forward', backend=self.backend):
+            features = self._forward(tensor)
         # 展平特征向量
-        return features.squeeze().cpu().numpy().flatten()
+        return features.cpu().numpy().flatten()
+
+    def extract_features_batch(self, inputs, batch_size=16, num_workers=4, stats=None):
+        """批量提取特征，按输入顺序逐个产出特征向量
+
+        inputs可以是路径、PIL图像或ndarray组成的任意可迭代对象。预处理在线程池中并行执行，
+        每个小批次只做一次前向传播；当前批次推理时下一批次已在预处理，内存占用只与批大小有关。
+        传入stats字典时会实时更新已处理数量、耗时与每秒处理图像数。
+        """
+        start = time.perf_counter()
+        count = 0
+        iterator = iter(inputs)
+        with ThreadPoolExecutor(max_workers=num_workers) as pool:
+            pending = [pool.submit(self._prepare, src) for src in islice(iterator, batch_size)]
+            while pending:
+                tensors = [future.result() for future in pending]
+                # 提交下一批预处理后再做当前批次的前向传播
+                pending = [pool.submit(self._prepare, src) for src in islice(iterator, batch_size)]
+                features = self._forward(torch.stack(tensors)).cpu().numpy()
+
+                count += len(tensors)
+                if stats is not None:
+                    elapsed = time.perf_counter() - start
+                    stats['images'] = count
+                    stats['seconds'] = elapsed
+                    stats['images_per_sec'] = count / elapsed if elapsed > 0 else 0.0
+                yield from features
+
+    def search(self, sketch, embeddings, k=5, chunk_size=4096):
+        """在特征矩阵中检索与草图余弦相似度最高的k行，返回(行号数组, 相似度数组)"""
+        return cosine_top_k(self.extract_features(sketch), embeddings, k=k, chunk_size=chunk_size)
+
+
+def cosine_top_k(query, embeddings, k=5, chunk_size=4096):
+    """分块矩阵乘法检索余弦相似度最高的k行
+
+    embeddings可以是内存映射的N x D矩阵，每次只读入chunk_size行，
+    内存占用与参照图总数无关。返回按相似度降序排列的(行号数组, 相似度数组)。
+    """
+    query = np.asarray(query, dtype=np.float32).ravel()
+    query = query / max(float(np.linalg.norm(query)), 1e-12)
+    best_rows = np.empty(0, dtype=np.int64)
+    best_sims = np.empty(0, dtype=np.float32)
+    for start in range(0, len(embeddings), chunk_size):
+        chunk = np.asarray(embeddings[start:start + chunk_size], dtype=np.float32)
+        norms = np.linalg.norm(chunk, axis=1)
+        sims = (chunk @ query) / np.maximum(norms, 1e-12)
+
+        # 与之前的最优结果合并后只保留前k个
+        rows = np.concatenate([best_rows, np.arange(start, start + len(chunk))])
+        sims = np.concatenate([best_sims, sims])
+        if len(sims) > k:
+            keep = np.argpartition(-sims, k - 1)[:k]
+            rows, sims = rows[keep], sims[keep]
+        best_rows, best_sims = rows, sims
+
+    order = np.argsort(-best_sims, kind='stable')
+    return best_rows[order], best_sims[order]
+
+
+def _check_store(store, model):
+    """特征库的特征必须由与草图相同的模型提取，否则余弦相似度没有意义"""
+    if store.model_version != model.version:
+        raise ValueError(f"参照图特征库的模型版本 {store.model_version} 与推理模型 {model.version} 不一致")
+
+
+def find_similar_references(sketch, store, k=5, device='cpu', ssim_mode='global', rerank_factor=4,
+                            backend='eager'):
+    """在参照图特征库中检索与草图最相似的k张参照图
+
+    先用余弦相似度在整个特征矩阵上粗筛出k*rerank_factor个候选，
+    再结合结构相似度计算综合相似度重新排序，返回按综合相似度降序排列的Match列表。
+    """
+    if ssim_mode not in SSIM_MODES:
+        raise ValueError(f"未知的SSIM模式: {ssim_mode}")
+    with span('model'):
+        model = get_model(device=device, backend=backend)
+    _check_store(store, model)
+    with span('reference index'):
+        paths, embeddings, grays = store.index()
+    if not paths:
+        return []
+
+    with span('decode'):
+        img = decode_gray(sketch)
+    with span('search', references=len(paths)):
+        rows, cos_sims = model.search(img, embeddings, k=max(k * rerank_factor, k))
+
+    with span('rerank', candidates=len(rows)):
+        gray = load_ssim_gray(img)
+        matches = []
+        for row, cos_sim in zip(rows, cos_sims):
+            ssim_score = structural_similarity(gray, grays[row], mode=ssim_mode)
+            matches.append(Match(path=paths[row],
+                                 score=float(combine_scores(float(cos_sim), ssim_score)),
+                                 cos_sim=float(cos_sim),
+                                 ssim=float(ssim_score)))
+    matches.sort(key=lambda match: match.score, reverse=True)
+    return matches[:k]
+
 
+def default_device():
+    """有可用的CUDA时使用GPU，否则使用CPU"""
+    return 'cuda' if torch.cuda.is_available() else 'cpu'
 
-def calculate_sketch_similarity(img_path1, img_path2, device='cpu'):
-    """计算两张草图的相似度"""
-    model = SketchSimilarityModel(device=device)
+
+def _registry_key(device, weights, backend):
+    """生成模型注册表的键"""
+    return str(torch.device(device)), (str(weights) if weights is not None else None), backend
+
+
+def get_model(device='cpu', weights=ResNet18_Weights.DEFAULT, backend='eager', num_threads=None):
+    """获取进程内共享的模型，首次调用时构建并预热"""
+    # 线程数是进程级设置，只在变化时修改，避免每次比对都重设线程池
+    if num_threads is not None and num_threads != torch.get_num_threads():
+        torch.set_num_threads(num_threads)
+    key = _registry_key(device, weights, backend)
+    model = _model_registry.get(key)
+    if model is not None:
+        return model
+    with _registry_lock:
+        # 双重检查，防止多个线程同时构建同一个模型
+        model = _model_registry.get(key)
+        if model is None:
+            with span('model build', backend=backend):
+                model = SketchSimilarityModel(device=device, weights=weights, backend=backend).warmup()
+            _model_registry[key] = model
+    return model
+
+
+def preload_model(device='cpu', weights=ResNet18_Weights.DEFAULT, backend='eager', num_threads=None):
+    """在程序启动时预加载模型，使第一次比对与后续比对一样快"""
+    return get_model(device=device, weights=weights, backend=backend, num_threads=num_threads)
+
+
+def check_backend_parity(images, backends=BACKENDS, device='cpu', weights=ResNet18_Weights.DEFAULT,
+                         tolerance=1e-3, batch_size=8):
+    """对比各推理后端与eager fp32模型的特征偏差与速度
+
+    images为路径、PIL图像或ndarray列表。返回 后端 -> 统计字典，其中drift为
+    1 - 与eager特征的余弦相似度，ok表示最大偏差不超过tolerance。
+    """
+    images = [load_image(img) for img in images]
+    reference = None
+    report = {}
+    for backend in ('eager',) + tuple(b for b in backends if b != 'eager'):
+        if backend == 'int8' and torch.device(device).type != 'cpu':
+            continue
+        model = get_model(device=device, weights=weights, backend=backend)
+        stats = {}
+        features = np.stack(list(model.extract_features_batch(images, batch_size=batch_size, stats=stats)))
+        if reference is None:
+            reference = features
+        cos = np.sum(features * reference, axis=1) / np.maximum(
+            np.linalg.norm(features, axis=1) * np.linalg.norm(reference, axis=1), 1e-12)
+        drift = 1.0 - cos
+        report[backend] = {
+            'max_drift': float(drift.max()),
+            'mean_drift': float(drift.mean()),
+            'images_per_sec': stats['images_per_sec'],
+            'ok': bool(drift.max() <= tolerance),
+        }
+    return report
+
+
+def shutdown_models():
+    """释放注册表中的所有模型"""
+    with _registry_lock:
+        devices = {model.device for model in _model_registry.values()}
+        _model_registry.clear()
+    if any(d.type == 'cuda' for d in devices):
+        torch.cuda.empty_cache()
+
+
+def load_image(source):
+    """将路径、PIL图像或ndarray统一转换为PIL图像"""
+    if isinstance(source, Image.Image):
+        return source
+    if isinstance(source, np.ndarray):
+        return Image.fromarray(source)
+    return Image.open(source)
+
+
+def decode_gray(source):
+    """将路径、PIL图像或ndarray解码为uint8灰度图"""
+    return _preprocessor.decode(source)
+
+
+def load_ssim_gray(img_path):
+    """加载用于计算结构相似度的224x224灰度图，img_path可以是路径、PIL图像或ndarray"""
+    return _preprocessor.ssim_gray(_preprocessor.decode(img_path))
+
+
+def calculate_sketch_similarity(img_path1, img_path2, device='cpu', store=None, ssim_mode='global',
+                                backend='eager'):
+    """计算两张草图的相似度
+
+    两个输入都可以是路径、PIL图像或ndarray，每个输入只解码一次，由特征提取与SSIM共用。
+    img_path2为参照图，提供特征库时直接复用其缓存特征。
+    ssim_mode选择结构相似度算法：global为全图SSIM，local为窗口化SSIM，ms为多尺度SSIM。
+    backend选择推理后端，见BACKENDS。
+    """
+    if ssim_mode not in SSIM_MODES:
+        raise ValueError(f"未知的SSIM模式: {ssim_mode}")
+    with span('model'):
+        model = get_model(device=device, backend=backend)
+    if store is not None:
+        _check_store(store, model)
+    reference = None
+    if store is not None and isinstance(img_path2, (str, os.PathLike)):
+        with span('reference lookup') as lookup_span:
+            reference = store.lookup(img_path2)
+            lookup_span.set(cached=reference is not None)
+
+    # 每个输入只解码一次，得到的灰度图同时供CNN与SSIM分支使用
+    with span('decode'):
+        img1 = decode_gray(img_path1)
+        img2 = decode_gray(img_path2) if reference is None else None
 
     # 提取特征
-    features1 = model.extract_features(img_path1)
-    features2 = model.extract_features(img_path2)
+    with span('features'):
+        features1 = model.extract_features(img1)
+        if reference is not None:
+            features2 = reference.embedding
+        else:
+            features2 = model.extract_features(img2)
 
     # 计算余弦相似度
-    cos_sim = cosine_similarity([features1], [features2])[0][0]
+    with span('cosine'):
+        cos_sim = cosine_similarity([features1], [features2])[0][0]
+
+    # 计算结构相似度(SSIM)
+    with span('ssim', mode=ssim_mode):
+        gray1 = load_ssim_gray(img1)
+        if reference is not None:
+            gray2, stats2 = reference.gray, (reference.mean, reference.var)
+        else:
+            gray2, stats2 = load_ssim_gray(img2), None
+        ssim_score = structural_similarity(gray1, gray2, mode=ssim_mode, stats2=stats2)
 
-    # 加载原始图像计算结构相似度(SSIM)
-    img1 = Image.open(img_path1).convert('L')
-    img2 = Image.open(img_path2).convert('L')
-    img1 = img1.resize((224, 224))
-    img2 = img2.resize((224, 224))
-    ssim_score = calculate_ssim(np.array(img1), np.array(img2))
+    return combine_scores(cos_sim, ssim_score)
 
+
+def combine_scores(cos_sim, ssim_score):
+    """将余弦相似度与结构相似度合成为0~1之间的综合相似度"""
     # 综合相似度（给予结构相似度更高权重）
     combined_similarity = 0.6 * cos_sim + 0.4 * ssim_score
     if combined_similarity<=0.5:
@@ -95,19 +469,31 @@ def calculate_sketch_similarity(img_path1, img_path2, device='cpu'):
     return combined_similarity
 
 
-def calculate_ssim(img1, img2):
-    """计算两张图像的结构相似度"""
+def structural_similarity(gray1, gray2, mode='global', stats2=None):
+    """按ssim模式计算两张灰度图的结构相似度"""
+    if mode == 'local':
+        return calculate_local_ssim(gray1, gray2)
+    if mode == 'ms':
+        return calculate_ms_ssim(gray1, gray2)
+    return calculate_ssim(gray1, gray2, stats2=stats2)
+
+
+def calculate_ssim(img1, img2, stats2=None):
+    """计算两张图像的结构相似度，stats2为img2预先计算好的(均值, 方差)"""
     # 确保图像值在0-255范围内
     img1 = img1.astype(np.float64)
     img2 = img2.astype(np.float64)
 
     # 计算均值
     mu1 = img1.mean()
-    mu2 = img2.mean()
+    sigma1_sq = ((img1 - mu1) ** 2).mean()
 
     # 计算方差
-    sigma1_sq = ((img1 - mu1) ** 2).mean()
-    sigma2_sq = ((img2 - mu2) ** 2).mean()
+    if stats2 is not None:
+        mu2, sigma2_sq = stats2
+    else:
+        mu2 = img2.mean()
+        sigma2_sq = ((img2 - mu2) ** 2).mean()
     sigma12 = ((img1 - mu1) * (img2 - mu2)).mean()
 
     # SSIM参数
@@ -118,4 +504,66 @@ def calculate_ssim(img1, img2):
     numerator = (2 * mu1 * mu2 + C1) * (2 * sigma12 + C2)
     denominator = (mu1 ** 2 + mu2 ** 2 + C1) * (sigma1_sq + sigma2_sq + C2)
 
-    return numerator / denominator
\ No newline at end of file
+    return numerator / denominator
+
+
+def _window_filter(img, win_size, gaussian, sigma):
+    """计算局部窗口均值：盒式滤波基于积分累加，每像素耗时与窗口大小无关；高斯滤波为可分离卷积"""
+    if gaussian:
+        return cv2.GaussianBlur(img, (win_size, win_size), sigma, borderType=cv2.BORDER_REFLECT)
+    return cv2.boxFilter(img, -1, (win_size, win_size), normalize=True, borderType=cv2.BORDER_REFLECT)
+
+
+def calculate_ssim_map(img1, img2, win_size=7, gaussian=False, sigma=1.5):
+    """计算窗口化SSIM图，返回(SSIM图, 对比度-结构图)
+
+    所有局部均值、方差与协方差都通过对整幅数组做滤波一次算出，全程使用float32。
+    """
+    C1 = (0.01 * 255) ** 2
+    C2 = (0.03 * 255) ** 2
+
+    x = np.asarray(img1, dtype=np.float32)
+    y = np.asarray(img2, dtype=np.float32)
+
+    mu1 = _window_filter(x, win_size, gaussian, sigma)
+    mu2 = _window_filter(y, win_size, gaussian, sigma)
+    mu1_sq = mu1 * mu1
+    mu2_sq = mu2 * mu2
+    mu1_mu2 = mu1 * mu2
+
+    # E[x^2] - E[x]^2 形式的局部方差与协方差
+    sigma1_sq = _window_filter(x * x, win_size, gaussian, sigma) - mu1_sq
+    sigma2_sq = _window_filter(y * y, win_size, gaussian, sigma) - mu2_sq
+    sigma12 = _window_filter(x * y, win_size, gaussian, sigma) - mu1_mu2
+
+    cs_map = (2 * sigma12 + C2) / (sigma1_sq + sigma2_sq + C2)
+    ssim_map = (2 * mu1_mu2 + C1) / (mu1_sq + mu2_sq + C1) * cs_map
+    return ssim_map, cs_map
+
+
+def calculate_local_ssim(img1, img2, win_size=7, gaussian=False, sigma=1.5):
+    """计算窗口化SSIM的平均值"""
+    ssim_map, _ = calculate_ssim_map(img1, img2, win_size, gaussian, sigma)
+    return float(ssim_map.mean())
+
+
+def calculate_ms_ssim(img1, img2, scales=5, win_size=7, gaussian=False, sigma=1.5):
+    """计算多尺度SSIM(MS-SSIM)，在逐级减半的图像金字塔上组合各尺度的对比度-结构项"""
+    weights = np.array(MS_SSIM_WEIGHTS[:scales], dtype=np.float64)
+    weights /= weights.sum()
+
+    x = np.asarray(img1, dtype=np.float32)
+    y = np.asarray(img2, dtype=np.float32)
+    score = 1.0
+    for level, weight in enumerate(weights):
+        ssim_map, cs_map = calculate_ssim_map(x, y, win_size, gaussian, sigma)
+        if level == len(weights) - 1:
+            # 最粗尺度使用完整SSIM（含亮度项）
+            value = ssim_map.mean()
+        else:
+            value = cs_map.mean()
+            x = cv2.resize(x, (x.shape[1] // 2, x.shape[0] // 2), interpolation=cv2.INTER_AREA)
+            y = cv2.resize(y, (y.shape[1] // 2, y.shape[0] // 2), interpolation=cv2.INTER_AREA)
+        # 负值截断为0，避免小数次幂出现NaN
+        score *= max(float(value), 0.0) ** weight
+    return score
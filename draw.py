@@ -1,29 +1,120 @@
 import tkinter as tk
 from tkinter import colorchooser, simpledialog, filedialog, messagebox
-from PIL import Image, ImageDraw, ImageTk, ImageGrab
+from PIL import Image, ImageTk
+import hashlib
 import os
 import tempfile
+import time
+import tracing
+from eraser import Eraser
+from history import Command, History
+from imagecache import get_image_cache
+from motion import MotionBuffer
+from raster import CanvasRaster
+from scoring import BackgroundExecutor
+from session import EXTENSION as SESSION_EXTENSION, SessionWriter, load_session
+from strokes import OperationLog, Stroke, StrokeSimplifier, simplify_tolerance
+from vector import export_vector
+
+
+def _score_snapshot(job, img, compare_path, device):
+    """后台任务：计算画布快照与参照图的相似度，返回(快照, 相似度)"""
+    from compare import calculate_sketch_similarity, default_device
+    from feature_store import get_reference_store
+
+    device = device or default_device()
+    job.report("正在计算相似度...")
+    score = calculate_sketch_similarity(img, compare_path, device=device, store=get_reference_store(device))
+    return img, score
+
+
+def _decode_import(job, image_id, size):
+    """后台任务：把导入的图片解码为画布大小并放入共享缓存"""
+    return get_image_cache().get(image_id, size)
+
+
+def _write_image(job, img, path, compress_level, optimize, quality):
+    """后台任务：按扩展名编码图片，先写入临时文件再替换目标文件，返回目标路径"""
+    image_format = Image.registered_extensions().get(os.path.splitext(path)[1].lower(), 'PNG')
+    if image_format == 'PNG':
+        options = {'compress_level': compress_level, 'optimize': optimize}
+    elif image_format == 'JPEG':
+        options = {'quality': quality, 'optimize': optimize}
+    else:
+        options = {}
+    tmp_path = path + '.tmp'
+    try:
+        img.save(tmp_path, image_format, **options)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
+
+
+def _retrieve_snapshot(job, img, k, device):
+    """后台任务：在参照图库中检索与画布快照最相似的k张参照图"""
+    from compare import find_similar_references, default_device
+    from feature_store import get_reference_store
+
+    device = device or default_device()
+    return find_similar_references(img, get_reference_store(device), k=k, device=device)
 
 
 class DrawBoard:
-    def __init__(self, app, x, y):
+    def __init__(self, app, x, y, device=None, history_depth=100, frame_rate=60):
         self.app = app
         self.x = x
         self.y = y
-        self.yesno = tk.IntVar(value=0)
-        self.what = tk.IntVar(value=1)
-        self.X = tk.IntVar(value=0)
-        self.Y = tk.IntVar(value=0)
+        self.device = device  # 相似度模型所在设备，None表示自动选择
+        self.yesno = 0  # 鼠标左键是否按下
+        self.what = 1  # 当前工具：1铅笔 2直线 3矩形 4文本 5橡皮擦 6圆形
+        self.X = 0  # 上一次处理的鼠标位置
+        self.Y = 0
         self.foreColor = '#000000'
         self.backColor = '#FFFFFF'
         self.erase_size = 20
-        self.lastDraw = 0
-        self.end = [0]
+        self.lastDraw = None  # 直线、矩形、圆形工具拖动时的预览对象
         self.text = ""
         self.image = None
         self.erase_cursor = None
+        self.stroke_item = None  # 正在绘制的铅笔折线
+        self.simplifier = None  # 正在绘制的铅笔笔画的在线简化
+        self.simplify_ratio = 0.1  # 笔画简化的容差占画笔大小的比例，0表示只去掉重复点
         self.size = 5  # 画笔大小初始值
-        self.draw_operations = []
+        self.draw_operations = OperationLog()  # 绘制操作记录：每一笔一个Stroke，形状与文本在记录表中
+        self.raster = None  # 增量维护的离屏栅格，导出与评分直接使用
+        self.history = History(max_depth=history_depth)  # 撤销/重做历史
+        self.action_items = []  # 当前操作已在画布上创建的对象
+        self.entry_items = {}  # 操作记录条目 -> 画布对象id列表
+        self.eraser = None  # 正在进行的橡皮擦拖动
+        self._action_start = 0  # 当前操作开始时操作记录的条目数
+        self.session = None  # 当前会话文件，提交的操作随时追加写入
+        self.session_photos = []  # 打开会话时导入图片的PhotoImage，需要保持引用
+        self.motion = MotionBuffer(self.app, self._apply_motion, frame_rate)  # 按帧合并的拖动事件
+        self.revision = 0  # 画布内容版本号，每次修改后递增
+        self.scorer = BackgroundExecutor(self.app, name='scoring')  # 后台相似度评分
+        self.loader = BackgroundExecutor(self.app, name='loader')  # 后台解码导入的图片
+        self.writer = BackgroundExecutor(self.app, name='writer')  # 后台编码并写入图片文件
+        self.png_compress_level = 6  # PNG压缩级别0-9，越大文件越小、编码越慢
+        self.save_optimize = False  # PNG/JPEG编码时是否额外优化以减小文件
+        self.jpeg_quality = 90
+
+        # 定时自动保存
+        self.autosave_path = None  # None表示不自动保存
+        self.autosave_interval = 60  # 自动保存的间隔秒数
+        self.autosave_callback = None
+        self._autosave_after = None
+        self._autosave_revision = 0  # 上次自动保存时的画布版本号
+
+        # 实时相似度
+        self.current_reference = None  # 当前选中的参照图
+        self.live_enabled = False
+        self.live_interval = 400  # 笔画结束后等待多少毫秒再重新评分
+        self.live_callback = None
+        self._live_after = None
+        self._live_key = None  # 上次评分输入的摘要
 
         self.frame = tk.Frame(self.app)
         self.frame.pack(fill=tk.BOTH, expand=True)
@@ -51,23 +142,25 @@ class DrawBoard:
         self.canvas.bind('<Motion>', self.onMouseMove)  # 处理鼠标移动事件
 
         self.temp_canvas_path = os.path.join(tempfile.gettempdir(), "canvas_temp.png")  # 画布临时保存路径
-        self.temp_pil_path = os.path.join(tempfile.gettempdir(), "canvas_pil_temp.png")  # PIL重绘临时保存路径
 
     def update_erase_cursor(self, x, y):
         """更新橡皮擦光标显示"""
         # 如果坐标超出画布范围，不更新光标
         if x < 0 or y < 0 or x > self.canvas.winfo_width() or y > self.canvas.winfo_height():
             return
-            
+
+        half = self.erase_size // 2
         if self.erase_cursor:
-            self.canvas.delete(self.erase_cursor)
+            # 移动已有的光标，不重新创建
+            self.canvas.coords(self.erase_cursor, x - half, y - half, x + half, y + half)
+            return
 
         # 根据鼠标坐标创建橡皮擦光标并添加特殊标签
         self.erase_cursor = self.canvas.create_oval(
-            x - self.erase_size // 2,
-            y - self.erase_size // 2,
-            x + self.erase_size // 2,
-            y + self.erase_size // 2,
+            x - half,
+            y - half,
+            x + half,
+            y + half,
             outline='#888888',
             dash=(2, 2),
             width=1,
@@ -80,174 +173,142 @@ class DrawBoard:
 
     def onMouseMove(self, event):
         """处理鼠标移动事件，更新橡皮擦光标位置"""
-        if self.what.get() == 5:  # 仅在使用橡皮擦工具时更新光标
+        if self.what == 5:  # 仅在使用橡皮擦工具时更新光标
             self.update_erase_cursor(event.x, event.y)
 
     def onLeftButtonMove(self, event):
-        """鼠标左键移动事件"""
-        if self.yesno.get() == 0:
-            return
-
-        if self.what.get() == 1:  # 铅笔工具
-            # 记录铅笔绘制操作
-            self.draw_operations.append({
-                'type': 'pencil',
-                'x': event.x,
-                'y': event.y,
-                'size': self.size,
-                'fill': self.foreColor
-            })
-
-            self.lastDraw = self.canvas.create_oval(
-                event.x - self.size // 2,
-                event.y - self.size // 2,
-                event.x + self.size // 2,
-                event.y + self.size // 2,
-                fill=self.foreColor,
-                outline=self.foreColor)
-
-            if self.X.get() != event.x or self.Y.get() != event.y:
-                dx = event.x - self.X.get()
-                dy = event.y - self.Y.get()
-                distance = (dx ** 2 + dy ** 2) ** 0.5
-
-                if distance > self.size / 3:
-                    steps = int(distance // (self.size / 2)) + 1
-                    for i in range(1, steps):
-                        ratio = i / steps
-                        x = self.X.get() + dx * ratio
-                        y = self.Y.get() + dy * ratio
-
-                        # 记录铅笔连续绘制操作
-                        self.draw_operations.append({
-                            'type': 'pencil',
-                            'x': x,
-                            'y': y,
-                            'size': self.size,
-                            'fill': self.foreColor
-                        })
-
-                        self.canvas.create_oval(
-                            x - self.size // 2,
-                            y - self.size // 2,
-                            x + self.size // 2,
-                            y + self.size // 2,
-                            fill=self.foreColor,
-                            outline=self.foreColor)
-
-            self.X.set(event.x)
-            self.Y.set(event.y)
-
-        elif self.what.get() == 2:  # 直线工具
-            try:
-                self.canvas.delete(self.lastDraw)
-            except:
-                pass
-            self.lastDraw = self.canvas.create_line(self.X.get(), self.Y.get(), event.x, event.y,
-                                                    fill=self.foreColor, width=self.size)
-
-        elif self.what.get() == 3:  # 矩形工具
-            try:
-                self.canvas.delete(self.lastDraw)
-            except:
-                pass
-            self.lastDraw = self.canvas.create_rectangle(self.X.get(), self.Y.get(), event.x, event.y,
-                                                         outline=self.foreColor, width=self.size)
-
-        elif self.what.get() == 5:  # 橡皮擦工具
-            # 记录橡皮擦操作
-            self.draw_operations.append({
-                'type': 'erase',
-                'x': event.x,
-                'y': event.y,
-                'size': self.erase_size,
-                'fill': self.backColor
-            })
-
-            # 执行擦除操作
-            self.lastDraw = self.canvas.create_oval(
-                event.x - self.erase_size // 2,
-                event.y - self.erase_size // 2,
-                event.x + self.erase_size // 2,
-                event.y + self.erase_size // 2,
-                fill=self.backColor,
-                outline=self.backColor)
-            
-            # 在鼠标按下移动时更新光标位置
-            self.update_erase_cursor(event.x, event.y)
+        """鼠标左键移动事件：采样点先放入缓冲区，每帧统一处理一次"""
+        if self.yesno:
+            self.motion.add(event.x, event.y)
+
+    def _apply_motion(self, samples):
+        """处理一帧内缓冲的拖动采样点[(x, y), ...]"""
+        x, y = samples[-1]
+        if self.what == 1:  # 铅笔工具
+            # 记录铅笔绘制操作，笔画从按下鼠标的位置开始，经在线简化后保存
+            stroke = self.current_stroke('pencil', self.foreColor, self.size)
+            if self.simplifier is None or self.simplifier.stroke is not stroke:
+                self.simplifier = StrokeSimplifier(stroke, simplify_tolerance(self.size, self.simplify_ratio))
+                self.simplifier.add(self.X, self.Y)
+            for sx, sy in samples:
+                self.simplifier.add(sx, sy)
+
+            # 画布上每一笔只有一条圆端点、圆拐角的折线，本帧的点一次追加到折线末尾
+            coords = [v for point in samples for v in point]
+            if self.stroke_item is None:
+                self.stroke_item = self.canvas.create_line(
+                    self.X, self.Y, *coords,
+                    fill=self.foreColor,
+                    width=self.size,
+                    capstyle=tk.ROUND,
+                    joinstyle=tk.ROUND)
+                self.action_items.append(self.stroke_item)
+            else:
+                self.canvas.insert(self.stroke_item, 'end', coords)
+
+            self.X = x
+            self.Y = y
+
+        elif self.what in (2, 3, 6):  # 直线、矩形、圆形工具：预览只需要本帧最后一个点
+            if self.lastDraw is not None:
+                self.canvas.coords(self.lastDraw, self.X, self.Y, x, y)
+            elif self.what == 2:
+                self.lastDraw = self.canvas.create_line(self.X, self.Y, x, y, fill=self.foreColor, width=self.size)
+            elif self.what == 3:
+                self.lastDraw = self.canvas.create_rectangle(self.X, self.Y, x, y,
+                                                             outline=self.foreColor, width=self.size)
+            else:
+                self.lastDraw = self.canvas.create_oval(self.X, self.Y, x, y, outline=self.foreColor, width=self.size)
+
+        elif self.what == 5:  # 橡皮擦工具
+            # 删除或裁剪橡皮擦经过的笔迹
+            edits, paint = [], []
+            if self.eraser is None:
+                # 第一次移动时先擦除按下的位置
+                self.eraser = Eraser(self.draw_operations, self.erase_size / 2)
+                edits, paint = self.eraser.erase_to(self.X, self.Y)
+            for sx, sy in samples:
+                more_edits, more_paint = self.eraser.erase_to(sx, sy)
+                edits += more_edits
+                paint += more_paint
+            for index, removed, added in edits:
+                self._action_start += len(added) - len(removed)
+                self._replace_items(index, removed, added)
+            self._repaint_edits(edits)
+
+            # 无法裁剪的内容（图片、文本与部分边框）仍用背景色覆盖
+            for px, py in paint:
+                self.current_stroke('erase', self.backColor, self.erase_size).append(px, py)
+                self.action_items.append(self.canvas.create_oval(
+                    px - self.erase_size // 2,
+                    py - self.erase_size // 2,
+                    px + self.erase_size // 2,
+                    py + self.erase_size // 2,
+                    fill=self.backColor,
+                    outline=self.backColor))
 
-        elif self.what.get() == 6:  # 圆形工具
-            try:
-                self.canvas.delete(self.lastDraw)
-            except:
-                pass
-            self.lastDraw = self.canvas.create_oval(self.X.get(), self.Y.get(), event.x, event.y,
-                                                    outline=self.foreColor, width=self.size)
+            # 在鼠标按下移动时更新光标位置，并保持在新创建的对象之上
+            self.update_erase_cursor(x, y)
+            if self.erase_cursor and (edits or paint):
+                self.canvas.tag_raise('_erase_cursor_')
 
     def onLeftButtonDown(self, event):
         """鼠标左键按下事件"""
-        self.yesno.set(1)
-        self.X.set(event.x)
-        self.Y.set(event.y)
+        self.touch()
+        self.yesno = 1
+        self.stroke_item = None
+        self.lastDraw = None
+        self.action_items = []
+        self.eraser = None
+        self._action_start = len(self.draw_operations)
+        self.X = event.x
+        self.Y = event.y
 
         # 记录文本绘制操作
-        if self.what.get() == 4:
-            self.draw_operations.append({
-                'type': 'text',
-                'x': event.x,
-                'y': event.y,
-                'text': self.text,
-                'font': ("等线", int(self.size)),
-                'fill': self.foreColor
-            })
-            self.canvas.create_text(event.x, event.y,
-                                  font=("等线", int(self.size)),
-                                  text=self.text,
-                                  fill=self.foreColor)
-            self.what.set(1)
+        if self.what == 4:
+            self.draw_operations.add_text(event.x, event.y, self.text, ("等线", int(self.size)), self.foreColor)
+            self.action_items.append(self.canvas.create_text(event.x, event.y,
+                                                             font=("等线", int(self.size)),
+                                                             text=self.text,
+                                                             fill=self.foreColor))
+            self.what = 1
 
     def onLeftButtonUp(self, event):
         """鼠标左键释放事件"""
-        if self.what.get() == 2:  # 直线
-            self.draw_operations.append({
-                'type': 'line',
-                'x1': self.X.get(),
-                'y1': self.Y.get(),
-                'x2': event.x,
-                'y2': event.y,
-                'fill': self.foreColor,
-                'width': self.size
-            })
-            self.lastDraw = self.canvas.create_line(self.X.get(), self.Y.get(), event.x, event.y,
-                                                    fill=self.foreColor, width=self.size)
-
-        elif self.what.get() == 3:  # 矩形
-            self.draw_operations.append({
-                'type': 'rectangle',
-                'x1': self.X.get(),
-                'y1': self.Y.get(),
-                'x2': event.x,
-                'y2': event.y,
-                'outline': self.foreColor,
-                'width': self.size
-            })
-            self.lastDraw = self.canvas.create_rectangle(self.X.get(), self.Y.get(), event.x, event.y,
-                                                         outline=self.foreColor, width=self.size)
-
-        elif self.what.get() == 6:  # 圆形
-            self.draw_operations.append({
-                'type': 'oval',
-                'x1': self.X.get(),
-                'y1': self.Y.get(),
-                'x2': event.x,
-                'y2': event.y,
-                'outline': self.foreColor,
-                'width': self.size
-            })
-            self.lastDraw = self.canvas.create_oval(self.X.get(), self.Y.get(), event.x, event.y,
-                                                    outline=self.foreColor, width=self.size)
-        self.yesno.set(0)
-        self.end.append(self.lastDraw)
+        self.motion.flush()
+        if self.what in (2, 3, 6) and self.lastDraw is not None:
+            # 删除拖动时的预览，换成最终的图形
+            self.canvas.delete(self.lastDraw)
+            self.lastDraw = None
+
+        if self.what == 2:  # 直线
+            self.draw_operations.add_shape('line', self.X, self.Y, event.x, event.y,
+                                           self.foreColor, self.size)
+            self.action_items.append(self.canvas.create_line(self.X, self.Y, event.x, event.y,
+                                                       fill=self.foreColor, width=self.size))
+
+        elif self.what == 3:  # 矩形
+            self.draw_operations.add_shape('rectangle', self.X, self.Y, event.x, event.y,
+                                           self.foreColor, self.size)
+            self.action_items.append(self.canvas.create_rectangle(self.X, self.Y, event.x, event.y,
+                                                            outline=self.foreColor, width=self.size))
+
+        elif self.what == 6:  # 圆形
+            self.draw_operations.add_shape('oval', self.X, self.Y, event.x, event.y,
+                                           self.foreColor, self.size)
+            self.action_items.append(self.canvas.create_oval(self.X, self.Y, event.x, event.y,
+                                                       outline=self.foreColor, width=self.size))
+        self.yesno = 0
+        if self.simplifier is not None:
+            self.simplifier.finish()
+            if self.stroke_item is not None:
+                # 画布上的折线也换成简化后的点
+                self.canvas.coords(self.stroke_item, *self._polyline_coords(self.simplifier.stroke))
+            self.simplifier = None
+        self.stroke_item = None
+        self.draw_operations.end_stroke()
+        self.commit_action()
+        self.schedule_live_score()
 
     def onRightButtonUp(self, event):
         """鼠标右键释放事件"""
@@ -259,21 +320,26 @@ class DrawBoard:
             title='导入图片',
             filetypes=[('图片文件', '*.jpg *.png *.gif *jpeg *.bmp')])
         if filename:
-            try:
-                img = Image.open(filename)
-                img = img.resize((self.x, self.y), Image.Resampling.LANCZOS)
-                self.image = ImageTk.PhotoImage(img)
-                self.canvas.create_image(self.x // 2, self.y // 2, image=self.image)
-
-                # 记录导入的图片
-                self.draw_operations.append({
-                    'type': 'image',
-                    'path': filename,
-                    'width': self.x,
-                    'height': self.y
-                })
-            except Exception as e:
-                tk.messagebox.showerror("错误", f"无法打开图片: {e}")
+            # 在后台解码，大图片不会卡住窗口
+            image_id = get_image_cache().register(filename)
+            self.loader.submit(image_id, 0, _decode_import, image_id, (self.x, self.y),
+                               on_done=lambda img: self.place_image(image_id, img),
+                               on_error=lambda e: tk.messagebox.showerror("错误", f"无法打开图片: {e}"))
+
+    def place_image(self, image_id, img):
+        """把解码完成的导入图片放到画布上并记入操作记录"""
+        if self.yesno:
+            # 正在拖动时等这一笔结束再放入
+            self.app.after(50, lambda: self.place_image(image_id, img))
+            return
+        self.image = ImageTk.PhotoImage(img)
+        self._action_start = len(self.draw_operations)
+        self.action_items = [self.canvas.create_image(self.x // 2, self.y // 2, image=self.image)]
+
+        # 记录导入的图片
+        self.draw_operations.add_image(image_id, self.x, self.y)
+        self.commit_action(photo=self.image)
+        self.touch()
 
     def Save(self):
         """保存画布内容"""
@@ -283,49 +349,190 @@ class DrawBoard:
         """清空画布"""
         for item in self.canvas.find_all():
             self.canvas.delete(item)
-        self.end = [0]
-        self.lastDraw = 0
-        self.draw_operations = []  # 清空绘制操作记录
+        self.lastDraw = None
+        self.action_items = []
+        self.entry_items = {}
+        self.eraser = None
+        self.draw_operations.clear()  # 清空绘制操作记录
+        self.history.clear()
+        self.raster = None
+        self.session_photos = []
+        if self.session is not None:
+            self.session.reset(self.session.size, self.backColor)
+        self.touch()
         if self.erase_cursor:
             self.canvas.delete(self.erase_cursor)
             self.erase_cursor = None
 
+    def commit_action(self, photo=None):
+        """把本次操作追加或替换的条目记为一个可撤销的操作，并更新离屏栅格"""
+        operations = self.draw_operations
+        count = len(operations) - self._action_start
+        edits = self.eraser.edits if self.eraser is not None else None
+        if count > 0 or edits:
+            entry = operations.entries[-1] if count > 0 else None
+            if self.eraser is not None:
+                kind = 'erase'
+            elif isinstance(entry, Stroke):
+                kind = 'stroke'
+            else:
+                kind = operations.shapes.kind(entry)
+            if entry is not None:
+                self.entry_items[entry] = self.action_items
+            self.history.record(Command(kind, count, photo=photo, edits=edits or None))
+        self.action_items = []
+        self.update_raster().merge(self.history.base)
+        self.eraser = None
+        self.sync_session()
+
     def Back(self):
         """撤销上一步操作"""
-        try:
-            for i in range(self.end[-2], self.end[-1] + 1):
-                self.canvas.delete(i)
-            self.end.pop()
-
-            # 移除最后一次操作的记录
-            if self.draw_operations:
-                # 找到最后一个非临时操作
-                for i in reversed(range(len(self.draw_operations))):
-                    op = self.draw_operations[i]
-                    if op['type'] != 'pencil' and op['type'] != 'erase':
-                        self.draw_operations = self.draw_operations[:i]
-                        break
-        except:
-            self.end = [0]
-            self.draw_operations = []
+        if self.yesno == 1 or not self.history.can_undo():
+            return
+        command = self.history.pop_undo()
+        operations = self.draw_operations
+        for entry in operations.entries[len(operations) - command.count:]:
+            for item in self.entry_items.pop(entry, ()):
+                self.canvas.delete(item)
+        command.entries = [operations.pop() for _ in range(command.count)][::-1]
+        if self.raster is not None:
+            self.raster.truncate(operations)
+        self.sync_session()  # 先写入截断记录，再写入放回的条目
+        if command.edits:
+            # 按相反顺序放回被橡皮擦替换的条目
+            for edit in reversed(command.edits):
+                index, removed, added = edit
+                edit[2] = operations.splice(index, len(added), removed)
+                self._replace_items(index, edit[2], removed)
+            self._repaint_edits(command.edits)
+        self.sync_session()
+        self.touch()
+
+    def Redo(self):
+        """重做上一步撤销的操作"""
+        if self.yesno == 1 or not self.history.can_redo():
+            return
+        command = self.history.pop_redo()
+        operations = self.draw_operations
+        if command.edits:
+            for edit in command.edits:
+                index, removed, added = edit
+                edit[1] = operations.splice(index, len(removed), added)
+                self._replace_items(index, edit[1], added)
+        for detached in command.entries:
+            operations.push(detached)
+            entry = operations.entries[-1]
+            self.entry_items[entry] = self._draw_entry(entry, photo=command.photo)
+        command.entries = None
+        if self.erase_cursor:
+            self.canvas.tag_raise('_erase_cursor_')
+        self.update_raster()
+        if command.edits:
+            self._repaint_edits(command.edits)
+        self.sync_session()
+        self.touch()
+
+    def _replace_items(self, index, removed, added):
+        """操作记录第index个位置的removed已替换为added：同步画布对象、离屏栅格、会话文件与撤销历史"""
+        for entry in removed:
+            for item in self.entry_items.pop(entry, ()):
+                self.canvas.delete(item)
+        items = []
+        for entry in added:
+            self.entry_items[entry] = self._draw_entry(entry)
+            items.extend(self.entry_items[entry])
+        self._stack_before(items, index + len(added))
+
+        if self.raster is not None:
+            self.raster.shift(index, len(removed), len(added))
+        if index < self.history.base:
+            self.history.base = max(index, self.history.base + len(added) - len(removed))
+        if self.session is not None:
+            try:
+                self.session.replace(self.draw_operations, index, len(removed), added)
+            except OSError as e:
+                self.session = None
+                tk.messagebox.showerror("错误", f"写入会话文件失败，已停止自动保存: {e}")
+
+    def _stack_before(self, items, index):
+        """把画布对象放到操作记录第index个及之后条目的对象之下，使叠放顺序与操作记录一致"""
+        for entry in self.draw_operations.entries[index:]:
+            above = self.entry_items.get(entry)
+            if above:
+                break
+        else:
+            above = self.action_items  # 之后只有本次操作正在创建的对象
+        if above:
+            for item in items:
+                self.canvas.tag_lower(item, above[0])
+
+    def _repaint_edits(self, edits):
+        """标记离屏栅格中被橡皮擦修改过的范围，下次同步时重绘"""
+        if self.raster is None:
+            return
+        box = None
+        operations = self.draw_operations
+        for index, removed, added in edits:
+            for entry in removed + added:
+                bounds = operations.bounds(entry)
+                if bounds is not None:
+                    box = bounds if box is None else (min(box[0], bounds[0]), min(box[1], bounds[1]),
+                                                      max(box[2], bounds[2]), max(box[3], bounds[3]))
+        if box is not None:
+            self.raster.invalidate(box)
+
+    @staticmethod
+    def _polyline_coords(stroke):
+        """笔画的折线坐标，只有一个点时重复该点"""
+        coords = list(stroke.points)
+        return coords * 2 if len(coords) == 2 else coords
+
+    def _draw_entry(self, entry, photo=None):
+        """在画布上重新创建一个操作对应的对象，返回对象id列表"""
+        operations = self.draw_operations
+        if isinstance(entry, Stroke):
+            half = entry.size // 2
+            if entry.kind == 'erase':
+                return [self.canvas.create_oval(x - half, y - half, x + half, y + half,
+                                                fill=self.backColor, outline=self.backColor)
+                        for x, y in entry.xy()]
+            return [self.canvas.create_line(*self._polyline_coords(entry), fill=operations.palette[entry.color],
+                                            width=entry.size, capstyle=tk.ROUND, joinstyle=tk.ROUND)]
+
+        shapes = operations.shapes
+        record = shapes[entry]
+        kind = shapes.kind(entry)
+        x1, y1, x2, y2 = float(record['x1']), float(record['y1']), float(record['x2']), float(record['y2'])
+        color = operations.palette[record['color']]
+        width = int(record['width'])
+        if kind == 'line':
+            return [self.canvas.create_line(x1, y1, x2, y2, fill=color, width=width)]
+        if kind == 'rectangle':
+            return [self.canvas.create_rectangle(x1, y1, x2, y2, outline=color, width=width)]
+        if kind == 'oval':
+            return [self.canvas.create_oval(x1, y1, x2, y2, outline=color, width=width)]
+        if kind == 'text':
+            text, font = shapes.extra(entry)
+            return [self.canvas.create_text(x1, y1, font=font, text=text, fill=color)]
+        return [self.canvas.create_image(self.x // 2, self.y // 2, image=photo)]
 
     def drawCurve(self):
         """选择铅笔工具"""
-        self.what.set(1)
+        self.what = 1
         if self.erase_cursor:
             self.canvas.delete(self.erase_cursor)
             self.erase_cursor = None
 
     def drawLine(self):
         """选择直线工具"""
-        self.what.set(2)
+        self.what = 2
         if self.erase_cursor:
             self.canvas.delete(self.erase_cursor)
             self.erase_cursor = None
 
     def drawRectangle(self):
         """选择矩形工具"""
-        self.what.set(3)
+        self.what = 3
         if self.erase_cursor:
             self.canvas.delete(self.erase_cursor)
             self.erase_cursor = None
@@ -337,14 +544,14 @@ class DrawBoard:
             new_size = simpledialog.askinteger('输入字号', prompt='', initialvalue=self.size)
             if new_size is not None:
                 self.size = new_size
-        self.what.set(4)
+        self.what = 4
         if self.erase_cursor:
             self.canvas.delete(self.erase_cursor)
             self.erase_cursor = None
 
     def onErase(self):
         """选择橡皮擦工具"""
-        self.what.set(5)
+        self.what = 5
 
         erase_window = tk.Toplevel(self.app)
         erase_window.title("橡皮擦大小调节")
@@ -374,7 +581,7 @@ class DrawBoard:
         """设置橡皮擦大小"""
         self.erase_size = new_size
         # 如果当前正在使用橡皮擦，更新光标大小
-        if self.what.get() == 5:
+        if self.what == 5:
             # 获取当前鼠标位置
             x, y = self.canvas.winfo_pointerx() - self.canvas.winfo_rootx(), self.canvas.winfo_pointery() - self.canvas.winfo_rooty()
             self.update_erase_cursor(x, y)
@@ -411,7 +618,7 @@ class DrawBoard:
 
     def drawCircle(self):
         """选择圆形工具"""
-        self.what.set(6)
+        self.what = 6
         if self.erase_cursor:
             self.canvas.delete(self.erase_cursor)
             self.erase_cursor = None
@@ -428,190 +635,303 @@ class DrawBoard:
         if color[1]:
             self.backColor = color[1]
             self.canvas.config(bg=self.backColor)
+            self.raster = None  # 背景色变化后橡皮擦轨迹的颜色也随之变化，需要整体重绘
+            if self.session is not None:
+                self.session.set_back_color(self.backColor)
+            self.touch()
 
     def getter(self):
-        """保存画布内容为图片"""
-        x = self.canvas.winfo_rootx()
-        y = self.canvas.winfo_rooty()
-        width = self.canvas.winfo_width()
-        height = self.canvas.winfo_height()
-
+        """保存画布内容为图片，SVG与PDF直接由操作记录导出矢量图"""
         filename = filedialog.asksaveasfilename(
             defaultextension=".png",
-            filetypes=[("PNG files", "*.png"), ("JPEG files", "*.jpg")]
+            filetypes=[("PNG files", "*.png"), ("JPEG files", "*.jpg"), ("SVG files", "*.svg"), ("PDF files", "*.pdf")]
         )
 
         if filename:
+            if os.path.splitext(filename)[1].lower() not in ('.svg', '.pdf'):
+                self.save_by_path(filename)
+                return
             try:
-                ImageGrab.grab(bbox=(x, y, x + width, y + height)).save(filename)
+                self.export_vector(filename)
                 tk.messagebox.showinfo("成功", f"图片已保存至: {filename}")
             except Exception as e:
                 tk.messagebox.showerror("错误", f"保存失败: {str(e)}")
 
     def save_canvas_to_temp(self):
         """保存画布内容到临时文件"""
-        x = self.canvas.winfo_rootx()
-        y = self.canvas.winfo_rooty()
-        width = self.canvas.winfo_width()
-        height = self.canvas.winfo_height()
-
         try:
-            ImageGrab.grab(bbox=(x, y, x + width, y + height)).save(self.temp_canvas_path)
+            self.snapshot().save(self.temp_canvas_path)
             return True
         except Exception as e:
             tk.messagebox.showerror("错误", f"保存画布失败: {str(e)}")
             return False
 
+    def export_vector(self, filename):
+        """把操作记录导出为SVG或PDF，不需要截取屏幕"""
+        size = (self.canvas.winfo_width(), self.canvas.winfo_height())
+        export_vector(filename, self.draw_operations, size, self.backColor)
+
+    def save_vector(self):
+        """导出矢量图"""
+        filename = filedialog.asksaveasfilename(
+            defaultextension=".svg",
+            filetypes=[("SVG files", "*.svg"), ("PDF files", "*.pdf")]
+        )
+        if filename:
+            try:
+                self.export_vector(filename)
+                self.messagebox.showinfo("成功", f"矢量图已保存至: {filename}")
+            except Exception as e:
+                self.messagebox.showerror("错误", f"导出失败: {str(e)}")
+
     def save_by_pil(self):
-        """通过创建PIL.Image对象并绘制Canvas内容来保存"""
+        """保存画布图片，编码与写入文件在后台进行"""
         filename = filedialog.asksaveasfilename(
             defaultextension=".png",
             filetypes=[("PNG files", "*.png"), ("JPEG files", "*.jpg")]
         )
 
         if filename:
-            try:
-                # 创建与Canvas大小相同的空白PIL图像
-                img = Image.new('RGB', (self.canvas.winfo_width(), self.canvas.winfo_height()), self.backColor)
-                draw = ImageDraw.Draw(img)
-
-                # 重绘所有操作到PIL图像
-                for op in self.draw_operations:
-                    if op['type'] == 'pencil':
-                        draw.ellipse(
-                            [
-                                op['x'] - op['size'] // 2,
-                                op['y'] - op['size'] // 2,
-                                op['x'] + op['size'] // 2,
-                                op['y'] + op['size'] // 2
-                            ],
-                            fill=op['fill'],
-                            outline=op['fill']
-                        )
-                    elif op['type'] == 'line':
-                        draw.line(
-                            [op['x1'], op['y1'], op['x2'], op['y2']],
-                            fill=op['fill'],
-                            width=op['width']
-                        )
-                    elif op['type'] == 'rectangle':
-                        draw.rectangle(
-                            [op['x1'], op['y1'], op['x2'], op['y2']],
-                            outline=op['outline'],
-                            width=op['width']
-                        )
-                    elif op['type'] == 'oval':
-                        draw.ellipse(
-                            [op['x1'], op['y1'], op['x2'], op['y2']],
-                            outline=op['outline'],
-                            width=op['width']
-                        )
-                    elif op['type'] == 'text':
-                        draw.text(
-                            (op['x'], op['y']),
-                            op['text'],
-                            fill=op['fill'],
-                            font=op['font']
-                        )
-                    elif op['type'] == 'erase':
-                        draw.ellipse(
-                            [
-                                op['x'] - op['size'] // 2,
-                                op['y'] - op['size'] // 2,
-                                op['x'] + op['size'] // 2,
-                                op['y'] + op['size'] // 2
-                            ],
-                            fill=self.backColor,
-                            outline=self.backColor
-                        )
-                    elif op['type'] == 'image':
-                        try:
-                            # 尝试加载并绘制导入的图片
-                            img_obj = Image.open(op['path']).resize((op['width'], op['height']))
-                            img.paste(img_obj, (0, 0))
-                        except:
-                            # 如果图片无法加载，绘制一个占位符
-                            draw.rectangle([0, 0, op['width'], op['height']], fill="#CCCCCC")
-                            draw.text((op['width'] // 2, op['height'] // 2), "图片加载失败", fill="red")
-
-                # 保存图像
-                img.save(filename)
-                self.messagebox.showinfo("成功", f"图片已保存至: {filename}")
-
-            except Exception as e:
+            self.save_by_path(filename)
+
+    def save_by_path(self, filename, on_done=None, on_error=None):
+        """在主线程中只取画布快照，交给后台编码并原子写入filename
+
+        完成后在主线程中调用on_done(filename)或on_error(e)，未指定时弹出提示框。
+        """
+        if on_done is None:
+            def on_done(path):
+                self.messagebox.showinfo("成功", f"图片已保存至: {path}")
+        if on_error is None:
+            def on_error(e):
                 self.messagebox.showerror("错误", f"保存失败: {str(e)}")
 
-    def calculate_similarity(self, compare_path, device='cpu'):
-        """计算画布内容与选题图片的相似度"""
-        # 通过PIL重绘画布
-        img = Image.new('RGB', (self.canvas.winfo_width(), self.canvas.winfo_height()), self.backColor)
-        draw = ImageDraw.Draw(img)
-
-        # 重绘所有操作到PIL图像
-        for op in self.draw_operations:
-            if op['type'] == 'pencil':
-                draw.ellipse(
-                    [
-                        op['x'] - op['size'] // 2,
-                        op['y'] - op['size'] // 2,
-                        op['x'] + op['size'] // 2,
-                        op['y'] + op['size'] // 2
-                    ],
-                    fill=op['fill'],
-                    outline=op['fill']
-                )
-            elif op['type'] == 'line':
-                draw.line(
-                    [op['x1'], op['y1'], op['x2'], op['y2']],
-                    fill=op['fill'],
-                    width=op['width']
-                )
-            elif op['type'] == 'rectangle':
-                draw.rectangle(
-                    [op['x1'], op['y1'], op['x2'], op['y2']],
-                    outline=op['outline'],
-                    width=op['width']
-                )
-            elif op['type'] == 'oval':
-                draw.ellipse(
-                    [op['x1'], op['y1'], op['x2'], op['y2']],
-                    outline=op['outline'],
-                    width=op['width']
-                )
-            elif op['type'] == 'text':
-                draw.text(
-                    (op['x'], op['y']),
-                    op['text'],
-                    fill=op['fill'],
-                    font=op['font']
-                )
-            elif op['type'] == 'erase':
-                draw.ellipse(
-                    [
-                        op['x'] - op['size'] // 2,
-                        op['y'] - op['size'] // 2,
-                        op['x'] + op['size'] // 2,
-                        op['y'] + op['size'] // 2
-                    ],
-                    fill=self.backColor,
-                    outline=self.backColor
-                )
-            elif op['type'] == 'image':
+        try:
+            img = self.snapshot()
+        except Exception as e:
+            on_error(e)
+            return None
+        # 同一文件的新保存取代尚未开始的旧保存
+        return self.writer.submit(os.path.abspath(filename), self.revision, _write_image, img, filename,
+                                  self.png_compress_level, self.save_optimize, self.jpeg_quality,
+                                  on_done=on_done, on_error=on_error)
+
+    def set_autosave(self, path, interval=None, callback=None):
+        """开启或关闭（path为None）定时自动保存，只在画布自上次自动保存后有变化时写入
+
+        callback(message)在主线程中接收保存结果。
+        """
+        if self._autosave_after is not None:
+            self.app.after_cancel(self._autosave_after)
+            self._autosave_after = None
+        self.autosave_path = path
+        if interval is not None:
+            self.autosave_interval = interval
+        if callback is not None:
+            self.autosave_callback = callback
+        if path is not None:
+            self._autosave_revision = None  # 开启后第一次一定写入
+            self._autosave_after = self.app.after(int(self.autosave_interval * 1000), self._autosave)
+
+    def _notify_autosave(self, message):
+        if self.autosave_callback:
+            self.autosave_callback(message)
+
+    def _autosave(self):
+        """定时检查画布版本号，有变化时在后台保存"""
+        self._autosave_after = self.app.after(int(self.autosave_interval * 1000), self._autosave)
+        # 正在绘制时跳过，等下一次再保存
+        if self.yesno == 1 or self.revision == self._autosave_revision:
+            return
+        revision = self.revision
+
+        def on_done(path):
+            self._autosave_revision = revision
+            self._notify_autosave(f"已自动保存 {time.strftime('%H:%M:%S')}")
+
+        self.save_by_path(self.autosave_path, on_done=on_done,
+                          on_error=lambda e: self._notify_autosave(f"自动保存失败: {e}"))
+
+    def save_session(self):
+        """保存为会话文件，之后的每个操作都追加写入该文件"""
+        filename = filedialog.asksaveasfilename(
+            defaultextension=SESSION_EXTENSION,
+            filetypes=[("画板会话", "*" + SESSION_EXTENSION)]
+        )
+        if filename:
+            try:
+                if self.session is not None:
+                    self.session.close()
+                size = (self.canvas.winfo_width(), self.canvas.winfo_height())
+                self.session = SessionWriter(filename, size, self.backColor, self.draw_operations)
+            except Exception as e:
+                self.session = None
+                tk.messagebox.showerror("错误", f"保存会话失败: {e}")
+
+    def open_session(self):
+        """打开会话文件并继续在其中追加绘制"""
+        filename = filedialog.askopenfilename(
+            title='打开会话',
+            filetypes=[("画板会话", "*" + SESSION_EXTENSION)])
+        if filename:
+            try:
+                self.load_session(filename)
+            except Exception as e:
+                tk.messagebox.showerror("错误", f"无法打开会话: {e}")
+
+    def load_session(self, filename):
+        """从会话文件恢复画布：直接按操作记录创建画布对象，离屏栅格一次性重绘"""
+        operations, size, back_color = load_session(filename)
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+        self.Clear()
+        self.backColor = back_color
+        self.canvas.config(bg=back_color)
+        self.draw_operations = operations
+        for entry in operations.entries:
+            photo = None
+            if not isinstance(entry, Stroke) and operations.shapes.kind(entry) == 'image':
                 try:
-                    # 尝试加载并绘制导入的图片
-                    img_obj = Image.open(op['path']).resize((op['width'], op['height']))
-                    img.paste(img_obj, (0, 0))
-                except:
-                    # 如果图片无法加载，绘制一个占位符
-                    draw.rectangle([0, 0, op['width'], op['height']], fill="#CCCCCC")
-                    draw.text((op['width'] // 2, op['height'] // 2), "图片加载失败", fill="red")
+                    photo = ImageTk.PhotoImage(get_image_cache().get(operations.shapes.extra(entry), (self.x, self.y)))
+                except Exception:
+                    continue  # 图片已不存在时只在离屏栅格中显示占位
+                self.session_photos.append(photo)
+            self.entry_items[entry] = self._draw_entry(entry, photo=photo)
+        # 会话中已有的操作不可撤销
+        self.history.base = len(operations)
+        self.update_raster()
+        # 重写文件，去掉已撤销的操作
+        self.session = SessionWriter(filename, size, back_color, operations)
+        self.touch()
+
+    def sync_session(self):
+        """把新提交或撤销的操作追加到会话文件"""
+        if self.session is None:
+            return
+        try:
+            self.session.sync(self.draw_operations)
+        except OSError as e:
+            self.session = None
+            tk.messagebox.showerror("错误", f"写入会话文件失败，已停止自动保存: {e}")
+
+    def update_raster(self):
+        """把新提交的操作绘制到离屏栅格上，首次使用或画布尺寸变化时重建"""
+        size = (self.canvas.winfo_width(), self.canvas.winfo_height())
+        if self.raster is None or self.raster.size != size:
+            self.raster = CanvasRaster(size, self.backColor)
+            self.raster.merge(self.history.base)
+        self.raster.sync(self.draw_operations)
+        return self.raster
+
+    def snapshot(self):
+        """获取当前画布的只读快照图像，可直接交给后台线程使用"""
+        return self.update_raster().snapshot()
+
+    def current_stroke(self, kind, color, size):
+        """返回正在绘制的笔画，按下鼠标后第一次移动时开始新的一笔"""
+        stroke = self.draw_operations.open_stroke
+        if stroke is None or stroke.kind != kind:
+            stroke = self.draw_operations.begin_stroke(kind, color, size)
+        return stroke
+
+    def touch(self):
+        """画布内容发生变化：更新版本号并取消基于旧画布的后台任务"""
+        self.revision += 1
+        self.scorer.cancel_stale(self.revision)
+        self.schedule_live_score()
+
+    def set_live_scoring(self, enabled, callback=None):
+        """开启或关闭实时相似度，callback(score, message)在主线程中接收结果"""
+        self.live_enabled = enabled
+        if callback is not None:
+            self.live_callback = callback
+        if enabled:
+            self._live_key = None
+            self.schedule_live_score(0)
+        else:
+            if self._live_after is not None:
+                self.app.after_cancel(self._live_after)
+                self._live_after = None
+            self.scorer.cancel('_live_')
+
+    def schedule_live_score(self, delay=None):
+        """防抖：在最后一次修改后等待live_interval毫秒再评分"""
+        if not self.live_enabled:
+            return
+        if self._live_after is not None:
+            self.app.after_cancel(self._live_after)
+        self._live_after = self.app.after(self.live_interval if delay is None else delay, self._live_score)
+
+    def _notify_live(self, score, message=""):
+        if self.live_callback:
+            self.live_callback(score, message)
+
+    def _live_score(self):
+        """实时评分：输入未变化时跳过，否则提交后台任务"""
+        self._live_after = None
+        if not self.live_enabled or self.yesno == 1:
+            # 正在绘制时不评分，笔画结束后会重新调度
+            return
+        if self.current_reference is None:
+            self._notify_live(None, "请先选择参照图")
+            return
+
+        trace = tracing.start_trace('live compare', reference=self.current_reference)
+        with tracing.activate(trace):
+            with tracing.span('raster sync'):
+                raster = self.snapshot()
+            # 以下采样后的模型输入做摘要，画布实际未变化时不重新评分
+            with tracing.span('input hash'):
+                thumb = raster.convert('L').resize((224, 224))
+                key = (self.current_reference, hashlib.blake2b(thumb.tobytes(), digest_size=16).digest())
+        if key == self._live_key:
+            # 未提交后台任务，由这里结束计时，否则trace不会被记录
+            tracing.finish_trace(trace, status='skipped')
+            return
+
+        def on_done(result):
+            self._live_key = key
+            self._notify_live(result[1])
 
-        # 保存重绘后的图像到临时文件
-        img.save(self.temp_pil_path)
+        self._notify_live(None, "计算中...")
+        # 新的输入取代仍在进行中的旧评分
+        self.scorer.cancel('_live_')
+        self.scorer.submit('_live_', self.revision, _score_snapshot, raster, self.current_reference,
+                           self.device, on_done=on_done,
+                           on_error=lambda e: self._notify_live(None, "计算失败"), trace=trace)
 
+    def calculate_similarity(self, compare_path, device=None, indicator=None):
+        """在后台计算画布内容与选题图片的相似度，indicator为显示进度的Label"""
+        device = device or self.device
+
+        def set_indicator(text):
+            if indicator is not None and indicator.winfo_exists():
+                indicator.config(text=text)
+
+        trace = tracing.start_trace('compare', reference=compare_path)
+
+        def on_done(result):
+            set_indicator("")
+            img, similarity_score = result
+            self.show_similarity_result(compare_path, img, similarity_score, trace=trace)
+
+        def on_error(e):
+            set_indicator("")
+            tk.messagebox.showerror("错误", f"相似度计算失败: {str(e)}")
+
+        with tracing.activate(trace):
+            with tracing.span('snapshot'):
+                snapshot = self.snapshot()
+        self.scorer.submit(compare_path, self.revision, _score_snapshot, snapshot, compare_path, device,
+                           on_done=on_done, on_error=on_error,
+                           on_cancel=lambda: set_indicator("画布已修改，比对已取消"),
+                           on_progress=set_indicator, trace=trace)
+        set_indicator("正在计算相似度...")
+
+    def show_similarity_result(self, compare_path, img, similarity_score, trace=None):
+        """显示相似度结果窗口，提供trace时可展开各阶段耗时"""
         try:
-            from compare import calculate_sketch_similarity
-            similarity_score = calculate_sketch_similarity(self.temp_pil_path, compare_path, device=device)
             similarity_per = similarity_score * 100
 
             # 显示结果
@@ -626,9 +946,9 @@ class DrawBoard:
             preview_frame.pack(fill=tk.X, padx=10, pady=10)
 
             # 原图预览
-            img = Image.open(compare_path)
-            img = img.resize((180, 120), Image.Resampling.LANCZOS)
-            original_photo = ImageTk.PhotoImage(img)
+            original_img = Image.open(compare_path)
+            original_img = original_img.resize((180, 120), Image.Resampling.LANCZOS)
+            original_photo = ImageTk.PhotoImage(original_img)
 
             original_frame = tk.Frame(preview_frame)
             original_frame.pack(side=tk.LEFT, padx=5)
@@ -637,8 +957,7 @@ class DrawBoard:
             original_frame.image = original_photo
 
             # 画布预览
-            canvas_img = Image.open(self.temp_pil_path)
-            canvas_img = canvas_img.resize((180, 120), Image.Resampling.LANCZOS)
+            canvas_img = img.resize((180, 120), Image.Resampling.LANCZOS)
             canvas_photo = ImageTk.PhotoImage(canvas_img)
 
             canvas_frame = tk.Frame(preview_frame)
@@ -694,13 +1013,70 @@ class DrawBoard:
             tk.Label(similarity_frame, text="特征匹配度 (60%)                         结构相似度 (40%)",
                      font=("SimHei", 9)).pack(anchor=tk.W)
 
+            if trace is not None:
+                self._add_timing_panel(result_window, trace)
+
         except Exception as e:
-            tk.messagebox.showerror("错误", f"相似度计算失败: {str(e)}")
+            tk.messagebox.showerror("错误", f"相似度显示失败: {str(e)}")
+
+    def _add_timing_panel(self, window, trace):
+        """在结果窗口底部添加可展开的耗时详情"""
+        lines = tracing.format_spans(trace)
+        height = lines.count('\n') + 1
+        details = tk.Text(window, height=height, width=44, font=("Courier New", 9),
+                          bg="#f7f7f7", relief=tk.FLAT)
+        details.insert('1.0', lines)
+        details.config(state=tk.DISABLED)
+
+        def toggle():
+            if details.winfo_manager():
+                details.pack_forget()
+                button.config(text="耗时详情 ▸")
+                window.geometry("400x500")
+            else:
+                details.pack(fill=tk.X, padx=10, pady=5)
+                button.config(text="耗时详情 ▾")
+                window.geometry(f"400x{500 + 16 * (height + 2)}")
+
+        button = tk.Button(window, text="耗时详情 ▸", font=("SimHei", 9), relief=tk.FLAT, command=toggle)
+        button.pack(anchor=tk.W, padx=10)
+
+    def find_best_match(self, k=5, device=None):
+        """在后台检索与当前画布最相似的k张参照图"""
+        device = device or self.device
+        trace = tracing.start_trace('retrieval', k=k)
+        self.scorer.submit('_retrieval_', self.revision, _retrieve_snapshot, self.snapshot(), k, device,
+                           on_done=self.show_matches,
+                           on_error=lambda e: tk.messagebox.showerror("错误", f"检索失败: {str(e)}"), trace=trace)
+
+    def show_matches(self, matches):
+        """显示检索结果窗口"""
+        if not matches:
+            tk.messagebox.showinfo("提示", "参照图库为空")
+            return
+
+        result_window = tk.Toplevel(self.app)
+        result_window.title("最相似的参照图")
+
+        tk.Label(result_window, text="与当前画布最相似的参照图", font=("SimHei", 14, "bold")).pack(pady=10)
+
+        for rank, match in enumerate(matches, start=1):
+            row = tk.Frame(result_window)
+            row.pack(fill=tk.X, padx=15, pady=3)
+
+            name = os.path.splitext(os.path.basename(match.path))[0]
+            tk.Label(row, text=f"{rank}. {name}", font=("SimHei", 11), width=12, anchor=tk.W).pack(side=tk.LEFT)
+            tk.Label(row, text=f"{match.score * 100:.2f}%", font=("SimHei", 11, "bold"),
+                     fg="#008000").pack(side=tk.LEFT, padx=10)
+            tk.Button(row, text="查看", font=("SimHei", 9),
+                      command=lambda path=match.path, title=name: self.show_image(path, title)).pack(side=tk.RIGHT)
 
     def show_image(self, image_path, title=None):
         """显示图片并记录当前图片路径"""
         try:
             img = Image.open(image_path)
+            self.current_reference = image_path
+            self.schedule_live_score(0)
             img_width, img_height = img.size
 
             # 调整图片大小以适应窗口
@@ -723,9 +1099,12 @@ class DrawBoard:
             label.pack(pady=10)
 
             # 添加比对按钮
-            compare_btn = tk.Button(frame, text="与当前画布比对", command=lambda: self.calculate_similarity(image_path),
-                                   font=("SimHei", 10), bg="#4CAF50", fg="white", padx=10, pady=5)
+            status_label = tk.Label(frame, text="", font=("SimHei", 9), fg="#666666")
+            compare_btn = tk.Button(frame, text="与当前画布比对",
+                                    command=lambda: self.calculate_similarity(image_path, indicator=status_label),
+                                    font=("SimHei", 10), bg="#4CAF50", fg="white", padx=10, pady=5)
             compare_btn.pack(pady=10)
+            status_label.pack()
 
         except Exception as e:
             tk.messagebox.showerror("错误", f"无法打开图片: {str(e)}")
@@ -0,0 +1,165 @@
+"""按位置删除与裁剪笔迹的橡皮擦
+
+橡皮擦沿拖动路径每隔半个半径放置一个圆，通过操作记录的网格索引找到与圆相交的条目：
+铅笔笔画与直线在圆内的部分被裁掉，剩余部分拆成新的条目；被圆完全覆盖的矩形与圆形直接删除。
+无法裁剪的内容（矩形与圆形的部分边框、文本、导入的图片）仍按原方式用背景色覆盖。
+"""
+import math
+from array import array
+
+from strokes import Stroke
+
+
+def clip_polyline(points, cx, cy, radius):
+    """从折线中裁掉以(cx, cy)为圆心、radius为半径的圆内部分
+
+    points为x, y交替的坐标序列。折线与圆不相交时返回None，否则返回剩余各段的坐标列表；
+    新产生的端点取整到像素，与会话文件中笔画的整数坐标一致。
+    """
+    import numpy as np
+
+    xy = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    r2 = radius * radius
+    if len(xy) == 1:
+        return [] if (xy[0, 0] - cx) ** 2 + (xy[0, 1] - cy) ** 2 < r2 else None
+
+    # 各线段到圆心的最近距离
+    start = xy[:-1]
+    d = xy[1:] - start
+    f = start - (cx, cy)
+    dd = (d * d).sum(axis=1)
+    fd = (f * d).sum(axis=1)
+    ff = (f * f).sum(axis=1)
+    t = np.clip(-fd / np.where(dd > 0, dd, 1), 0, 1)
+    hit = ((f + t[:, None] * d) ** 2).sum(axis=1) < r2
+    if not hit.any():
+        return None
+
+    pieces = []
+    current = [] if ff[0] < r2 else [tuple(xy[0])]
+
+    def close():
+        if len(current) >= 2 and any(point != current[0] for point in current[1:]):
+            pieces.append([v for point in current for v in point])
+
+    for i in range(len(start)):
+        if not hit[i]:
+            current.append(tuple(xy[i + 1]))
+            continue
+        # 线段与圆的两个交点参数t0 <= t1，[t0, t1]内的部分被擦除
+        if dd[i] == 0:
+            t0, t1 = 0.0, 1.0
+        else:
+            root = math.sqrt(max(fd[i] * fd[i] - dd[i] * (ff[i] - r2), 0.0))
+            t0, t1 = (-fd[i] - root) / dd[i], (-fd[i] + root) / dd[i]
+        if t0 > 0:
+            current.append(tuple(np.rint(start[i] + t0 * d[i])))
+        close()
+        current = []
+        if t1 < 1:
+            current = [tuple(np.rint(start[i] + t1 * d[i])), tuple(xy[i + 1])]
+    close()
+    return pieces
+
+
+class Eraser:
+    """一次橡皮擦拖动
+
+    erase_to()直接修改操作记录，返回本次产生的修改[位置, 被替换的条目, 新条目]，
+    以及需要用背景色覆盖的圆心；edits保存整次拖动的全部修改。
+    """
+
+    def __init__(self, operations, radius):
+        self.operations = operations
+        self.radius = radius
+        self.last = None
+        self.edits = []
+
+    def erase_to(self, x, y):
+        """橡皮擦从上一个位置移动到(x, y)"""
+        centers = [(x, y)]
+        if self.last is not None:
+            lx, ly = self.last
+            steps = max(1, math.ceil(math.hypot(x - lx, y - ly) / max(self.radius / 2, 1)))
+            centers = [(round(lx + (x - lx) * i / steps), round(ly + (y - ly) * i / steps))
+                       for i in range(1, steps + 1)]
+        self.last = (x, y)
+        edits = []
+        paint = []
+        for cx, cy in centers:
+            if self._erase_disk(cx, cy, edits):
+                paint.append((cx, cy))
+        return edits, paint
+
+    def _erase_disk(self, cx, cy, edits):
+        """擦除一个圆内的内容，返回是否需要用背景色覆盖"""
+        operations = self.operations
+        shapes = operations.shapes
+        r = self.radius
+        paint = False
+        for entry in operations.query((cx - r, cy - r, cx + r, cy + r)):
+            if isinstance(entry, Stroke):
+                if entry.kind != 'pencil':
+                    continue  # 旧的橡皮擦轨迹本身就是背景色
+                pieces = clip_polyline(entry.points, cx, cy, r + entry.size / 2)
+                if pieces is None:
+                    continue
+                added = [Stroke('pencil', entry.color, entry.size, array('f', piece)) for piece in pieces]
+            else:
+                record = shapes[entry]
+                kind = shapes.kind(entry)
+                x1, y1, x2, y2 = float(record['x1']), float(record['y1']), float(record['x2']), float(record['y2'])
+                width = int(record['width'])
+                if kind == 'line':
+                    pieces = clip_polyline((x1, y1, x2, y2), cx, cy, r + width / 2)
+                    if pieces is None:
+                        continue
+                    added = [shapes.add('line', *piece, color=record['color'], width=width) for piece in pieces]
+                elif kind in ('rectangle', 'oval'):
+                    touch = _touch_outline(kind, x1, y1, x2, y2, width, cx, cy, r)
+                    if touch != 'covered':
+                        paint = paint or touch
+                        continue
+                    added = []
+                elif kind == 'text':
+                    paint = paint or _touch_text(shapes.extra(entry), x1, y1, cx, cy, r)
+                    continue
+                else:
+                    paint = paint or (-r <= cx <= x2 + r and -r <= cy <= y2 + r)
+                    continue
+            index = operations.position(entry)
+            removed = operations.splice(index, 1, added)
+            edit = [index, removed, added]
+            self.edits.append(edit)
+            edits.append(edit)
+        return paint
+
+
+def _touch_outline(kind, x1, y1, x2, y2, width, cx, cy, r):
+    """圆与矩形或圆形边框的关系：'covered'表示整个图形都在圆内，True表示与边框相交"""
+    left, right = min(x1, x2), max(x1, x2)
+    top, bottom = min(y1, y2), max(y1, y2)
+    half = width / 2
+    corners = ((left - half, top - half), (right + half, top - half),
+               (left - half, bottom + half), (right + half, bottom + half))
+    if all((x - cx) ** 2 + (y - cy) ** 2 < r * r for x, y in corners):
+        return 'covered'
+    if cx + r < left - half or cx - r > right + half or cy + r < top - half or cy - r > bottom + half:
+        return False
+    if kind == 'rectangle':
+        # 圆完全在边框内侧
+        inside = (cx - r > left + half and cx + r < right - half
+                  and cy - r > top + half and cy + r < bottom - half)
+    else:
+        a, b = (right - left) / 2 - half - r, (bottom - top) / 2 - half - r
+        inside = (a > 0 and b > 0
+                  and ((cx - (left + right) / 2) / a) ** 2 + ((cy - (top + bottom) / 2) / b) ** 2 < 1)
+    return not inside
+
+
+def _touch_text(extra, x, y, cx, cy, r):
+    """按字号粗略估计文本的范围，判断是否与圆相交"""
+    text, font = extra
+    size = abs(int(font[1])) * 2 if isinstance(font, (tuple, list)) and len(font) > 1 else 24
+    half_width = max(len(text), 1) * size / 2
+    return x - half_width - r <= cx <= x + half_width + r and y - size - r <= cy <= y + size + r
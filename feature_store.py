@@ -0,0 +1,291 @@
+import hashlib
+import json
+import os
+import threading
+import uuid
+from collections import namedtuple
+
+import numpy as np
+
+from compare import get_model, decode_gray, load_ssim_gray, SSIM_SIZE
+
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp')
+DEFAULT_ROOTS = ('./db/easy', './db/hard')
+DEFAULT_INDEX_DIR = './db/.index'
+MANIFEST_NAME = 'manifest.json'
+EMBEDDING_DIM = 512
+
+# 单张参照图的缓存特征：ResNet特征向量、SSIM灰度图及其均值/方差
+ReferenceFeatures = namedtuple('ReferenceFeatures', ['path', 'embedding', 'gray', 'mean', 'var'])
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def _file_sha1(path):
+    """计算文件内容的SHA1摘要"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _mtime(path):
+    """目录的修改时间，不存在时为None"""
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+class ReferenceFeatureStore:
+    """参照图特征库
+
+    每张参照图的特征只计算一次，保存为磁盘索引：
+    embeddings.*.npy 为 N x 512 的特征矩阵，grays.*.npy 为 N x 224 x 224 的灰度图，
+    均可内存映射读取；manifest.json 记录每个文件的内容摘要、修改时间、所在行号与模型版本。
+    lookup()遇到新增或修改过的文件时增量更新；index()只在参照图目录的修改时间变化时重新扫描，
+    原地修改已有图片后需调用refresh()同步。
+    特征由backend指定的推理后端提取，非eager后端默认使用各自的索引目录，只能与同一后端的草图特征比较。
+    """
+
+    def __init__(self, roots=DEFAULT_ROOTS, index_dir=None, device='cpu', backend='eager'):
+        if index_dir is None:
+            index_dir = DEFAULT_INDEX_DIR if backend == 'eager' else f'{DEFAULT_INDEX_DIR}-{backend}'
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.index_dir = os.path.abspath(index_dir)
+        self.base_dir = os.path.dirname(self.index_dir)
+        self.device = device
+        self.backend = backend
+        self.lock = threading.RLock()
+        self.entries = {}  # 相对路径 -> manifest条目
+        self.embeddings = None
+        self.grays = None
+        self._files = {}
+        self._loaded = False
+        self._dir_mtimes = None  # 上次扫描时各目录的修改时间
+        self._paths = None
+
+    @property
+    def model_version(self):
+        """提取特征所用模型的版本，与草图特征比较前需一致"""
+        return get_model(device=self.device, backend=self.backend).version
+
+    def _key(self, path):
+        """参照图在manifest中的键：相对于索引所在目录的路径"""
+        return os.path.relpath(os.path.abspath(path), self.base_dir).replace(os.sep, '/')
+
+    def _scan(self):
+        """扫描参照图目录，返回(键 -> 绝对路径, 目录 -> 修改时间)"""
+        found = {}
+        dirs = {}
+        for root in self.roots:
+            dirs[root] = _mtime(root)
+            if not os.path.isdir(root):
+                continue
+            for dirpath, dirnames, filenames in os.walk(root):
+                dirs[dirpath] = _mtime(dirpath)
+                dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+                for name in sorted(filenames):
+                    if name.lower().endswith(IMAGE_EXTENSIONS):
+                        path = os.path.join(dirpath, name)
+                        found[self._key(path)] = path
+        return found, dirs
+
+    def _dirs_changed(self):
+        """自上次扫描后是否有目录增删过文件或子目录"""
+        if self._dir_mtimes is None:
+            return True
+        return any(_mtime(path) != mtime for path, mtime in self._dir_mtimes.items())
+
+    def _load_index(self, version):
+        """读取磁盘索引，模型版本不一致时视为空索引"""
+        manifest_path = os.path.join(self.index_dir, MANIFEST_NAME)
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return
+        if manifest.get('model_version') != version:
+            return
+        try:
+            embeddings = self._load_matrix(manifest['embeddings'])
+            grays = self._load_matrix(manifest['grays'])
+        except (OSError, ValueError, KeyError):
+            return
+        if len(embeddings) != len(manifest['entries']) or len(grays) != len(embeddings):
+            return
+        self.entries = manifest['entries']
+        self._files = {'embeddings': manifest['embeddings'], 'grays': manifest['grays']}
+        self._paths = None
+        self.embeddings = embeddings
+        self.grays = grays
+
+    def _load_matrix(self, name):
+        """以内存映射方式加载矩阵文件"""
+        path = os.path.join(self.index_dir, name)
+        try:
+            return np.load(path, mmap_mode='r')
+        except ValueError:
+            # 空矩阵无法映射，直接读取
+            return np.load(path)
+
+    def refresh(self):
+        """同步磁盘索引与参照图目录，返回重新计算的图片数量"""
+        with self.lock:
+            model = get_model(device=self.device, backend=self.backend)
+            if not self._loaded:
+                self._load_index(model.version)
+                self._loaded = True
+
+            found, dirs = self._scan()
+            entries = {}
+            stale = set()
+            for key, path in found.items():
+                stat = os.stat(path)
+                entry = self.entries.get(key)
+                if entry is not None and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size:
+                    entries[key] = dict(entry)
+                    continue
+                sha1 = _file_sha1(path)
+                if entry is not None and entry['sha1'] == sha1:
+                    # 仅修改时间变化，内容未变
+                    entries[key] = dict(entry, mtime=stat.st_mtime, size=stat.st_size)
+                    continue
+                entries[key] = {'sha1': sha1, 'mtime': stat.st_mtime, 'size': stat.st_size}
+                stale.add(key)
+
+            if not stale and entries.keys() == self.entries.keys():
+                if entries != self.entries:
+                    self._write_manifest(model.version, entries, self._files)
+                    self.entries = entries
+                self._dir_mtimes = dirs
+                return 0
+
+            keys = sorted(entries)
+            rows = {key: row for row, key in enumerate(keys)}
+            embeddings = np.zeros((len(keys), EMBEDDING_DIM), dtype=np.float32)
+            grays = np.zeros((len(keys), SSIM_SIZE[1], SSIM_SIZE[0]), dtype=np.uint8)
+
+            stale_keys = [key for key in keys if key in stale]
+
+            def decoded():
+                # 每张图只解码一次，SSIM灰度图在送入批量特征提取前顺带生成
+                for key in stale_keys:
+                    gray = decode_gray(found[key])
+                    grays[rows[key]] = load_ssim_gray(gray)
+                    yield gray
+
+            for key, features in zip(stale_keys, model.extract_features_batch(decoded())):
+                embeddings[rows[key]] = features
+
+            for key in keys:
+                row = rows[key]
+                entry = entries[key]
+                if key in stale:
+                    entry['mean'] = float(grays[row].mean())
+                    entry['var'] = float(grays[row].var())
+                else:
+                    embeddings[row] = self.embeddings[entry['row']]
+                    grays[row] = self.grays[entry['row']]
+                entry['row'] = row
+            self._write_index(model.version, entries, embeddings, grays)
+            self._dir_mtimes = dirs
+            return len(stale)
+
+    def _write_index(self, version, entries, embeddings, grays):
+        """写入新的索引文件，旧文件在切换后删除"""
+        os.makedirs(self.index_dir, exist_ok=True)
+        token = uuid.uuid4().hex[:8]
+        files = {'embeddings': f'embeddings.{token}.npy', 'grays': f'grays.{token}.npy'}
+        np.save(os.path.join(self.index_dir, files['embeddings']), np.ascontiguousarray(embeddings))
+        np.save(os.path.join(self.index_dir, files['grays']), np.ascontiguousarray(grays))
+        self._write_manifest(version, entries, files)
+
+        self.entries = entries
+        self._files = files
+        self._paths = None
+        self.embeddings = self._load_matrix(files['embeddings'])
+        self.grays = self._load_matrix(files['grays'])
+        # 清理旧的矩阵文件；Windows下仍被映射的文件删除失败时留到下次写入再清理
+        for name in os.listdir(self.index_dir):
+            if name.endswith('.npy') and name not in files.values():
+                try:
+                    os.remove(os.path.join(self.index_dir, name))
+                except OSError:
+                    pass
+
+    def _write_manifest(self, version, entries, files):
+        """原子地写入manifest"""
+        manifest = {'model_version': version, 'entries': entries}
+        manifest.update(files)
+        manifest_path = os.path.join(self.index_dir, MANIFEST_NAME)
+        tmp_path = manifest_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp_path, manifest_path)
+
+    def index(self):
+        """返回按行排列的(参照图路径列表, 特征矩阵, 灰度图矩阵)，矩阵为内存映射
+
+        目录未变化时直接返回已加载的索引，不重新扫描参照图。
+        """
+        with self.lock:
+            if self._dirs_changed():
+                self.refresh()
+            if self._paths is None:
+                paths = [None] * len(self.entries)
+                for key, entry in self.entries.items():
+                    paths[entry['row']] = os.path.join(self.base_dir, *key.split('/'))
+                self._paths = paths
+            return self._paths, self.embeddings, self.grays
+
+    def contains_path(self, path):
+        """判断图片是否位于参照图目录中"""
+        path = os.path.abspath(path)
+        for root in self.roots:
+            try:
+                if os.path.commonpath([root, path]) == root:
+                    return True
+            except ValueError:
+                # Windows下不同盘符的路径无法比较
+                continue
+        return False
+
+    def lookup(self, path):
+        """查询参照图的缓存特征，不在参照目录中的图片返回None"""
+        if not self.contains_path(path):
+            return None
+        key = self._key(path)
+        with self.lock:
+            if not self._loaded:
+                self.refresh()
+            entry = self.entries.get(key)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return None
+            if entry is None or entry['mtime'] != stat.st_mtime or entry['size'] != stat.st_size:
+                # 新增或修改过的文件，增量更新索引
+                self.refresh()
+                entry = self.entries.get(key)
+                if entry is None:
+                    return None
+            row = entry['row']
+            return ReferenceFeatures(path=path,
+                                     embedding=np.array(self.embeddings[row]),
+                                     gray=np.array(self.grays[row]),
+                                     mean=entry['mean'],
+                                     var=entry['var'])
+
+
+def get_reference_store(device='cpu', backend='eager'):
+    """获取进程内共享的参照图特征库，每个设备与推理后端各一个"""
+    with _stores_lock:
+        store = _stores.get((device, backend))
+        if store is None:
+            store = ReferenceFeatureStore(device=device, backend=backend)
+            _stores[(device, backend)] = store
+    return store
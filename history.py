@@ -0,0 +1,63 @@
+from collections import deque
+
+
+class Command:
+    """一次用户操作：一笔铅笔、一次橡皮擦、一个形状、一段文本或一次导入图片
+
+    count为该操作追加到操作记录末尾的条目数；橡皮擦就地替换的条目记录在edits中，
+    每项为[位置, 被替换的条目, 新条目]。撤销后entries保存从操作记录中取出的条目，供重做时恢复。
+    """
+
+    __slots__ = ('kind', 'count', 'edits', 'entries', 'photo')
+
+    def __init__(self, kind, count, photo=None, edits=None):
+        self.kind = kind
+        self.count = count
+        self.edits = edits
+        self.entries = None
+        self.photo = photo  # 导入图片的PhotoImage，需要保持引用
+
+
+class History:
+    """撤销/重做历史
+
+    每个用户操作是一个Command，撤销与重做都只处理栈顶的一个操作。
+    可撤销的操作最多保留max_depth个，更早的操作并入基础状态，不再可撤销；
+    base为已并入基础状态的操作记录条目数。
+    """
+
+    def __init__(self, max_depth=100):
+        self.max_depth = max_depth
+        self.undo_stack = deque()
+        self.redo_stack = []
+        self.base = 0
+
+    def record(self, command):
+        """记录新操作并清空重做栈，超出深度时把最早的操作并入基础状态"""
+        self.undo_stack.append(command)
+        self.redo_stack.clear()
+        while len(self.undo_stack) > self.max_depth:
+            self.base += self.undo_stack.popleft().count
+
+    def can_undo(self):
+        return bool(self.undo_stack)
+
+    def can_redo(self):
+        return bool(self.redo_stack)
+
+    def pop_undo(self):
+        """取出最近的操作并移入重做栈"""
+        command = self.undo_stack.pop()
+        self.redo_stack.append(command)
+        return command
+
+    def pop_redo(self):
+        """取出最近撤销的操作并移回撤销栈"""
+        command = self.redo_stack.pop()
+        self.undo_stack.append(command)
+        return command
+
+    def clear(self):
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+        self.base = 0
@@ -0,0 +1,104 @@
+"""导入图片的快速解码与共享缓存
+
+每张导入的图片只解码一次：JPEG用Image.draft()在解码时按2的幂缩小，
+其他格式先用reduce()整数倍缩小，最后用LANCZOS缩放到画布大小，与画布上显示的一致。
+解码结果放入进程内共享的LRU缓存，总字节数超过上限时淘汰最久未使用的图片。
+操作记录中的图片条目只保存图片id，id与文件路径的对应关系一直保留，被淘汰的图片可以重新解码。
+缓存可以在后台线程中使用。
+"""
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+
+def decode_image(path, size):
+    """把图片解码并缩放为size大小；带透明通道的图片保留为RGBA，其余为RGB"""
+    width, height = size
+    img = Image.open(path)
+    if img.format == 'JPEG':
+        # 解码时直接缩小到不小于目标大小的最小尺寸
+        img.draft('RGB', size)
+    if img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGBA' if 'transparency' in img.info or img.mode in ('LA', 'PA') else 'RGB')
+    factor = min(img.width // width, img.height // height)
+    if factor >= 2:
+        img = img.reduce(factor)
+    if img.size != size:
+        img = img.resize(size, Image.Resampling.LANCZOS)
+    img.load()  # 在调用的线程中完成解码
+    return img
+
+
+class ImageCache:
+    """图片id到文件路径的登记表，以及按(图片id, 大小)缓存的解码结果"""
+
+    def __init__(self, max_bytes=256 << 20):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.paths = {}  # 图片id -> 文件路径
+        self.ids = {}  # (绝对路径, 修改时间, 文件大小) -> 图片id
+        self.images = OrderedDict()  # (图片id, 大小) -> 解码后的图像，按使用先后排列
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def register(self, path):
+        """登记图片文件并返回其id，同一文件未修改时返回同一个id"""
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+            key = (path, stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            key = (path, None, None)
+        with self.lock:
+            image_id = self.ids.get(key)
+            if image_id is None:
+                image_id = f"img{len(self.paths) + 1}"
+                self.ids[key] = image_id
+                self.paths[image_id] = path
+            return image_id
+
+    def path(self, image_id):
+        return self.paths[image_id]
+
+    def get(self, image_id, size):
+        """返回图片按size大小解码的结果，不在缓存中时解码并放入缓存；返回的图像不可修改"""
+        key = (image_id, tuple(size))
+        with self.lock:
+            img = self.images.get(key)
+            if img is not None:
+                self.images.move_to_end(key)
+                self.hits += 1
+                return img
+            self.misses += 1
+            path = self.paths[image_id]
+        img = decode_image(path, size)
+        self.put(image_id, img)
+        return img
+
+    def put(self, image_id, img):
+        """放入已解码的图像，超过上限时淘汰最久未使用的图像"""
+        key = (image_id, img.size)
+        with self.lock:
+            if key in self.images:
+                return
+            self.images[key] = img
+            self.nbytes += img.width * img.height * len(img.getbands())
+            while self.nbytes > self.max_bytes and len(self.images) > 1:
+                _, old = self.images.popitem(last=False)
+                self.nbytes -= old.width * old.height * len(old.getbands())
+
+    def clear(self):
+        with self.lock:
+            self.images.clear()
+            self.nbytes = 0
+
+
+_cache = ImageCache()
+
+
+def get_image_cache():
+    """获取进程内共享的图片缓存"""
+    return _cache
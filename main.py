@@ -1,6 +1,8 @@
+from startup import startup_timer, BackgroundPreloader
+import argparse
 import tkinter as tk
+import tracing
 from draw import DrawBoard
-import torch
 
 def center_window(w, h):
     screen_width = app.winfo_screenwidth()
@@ -11,6 +13,22 @@ def center_window(w, h):
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='画图板工具')
+    parser.add_argument('--startup-report', metavar='FILE', help='将启动计时报告保存为JSON文件')
+    parser.add_argument('--trace', action='store_true', help='记录每次比对的分阶段耗时，并在结果窗口中显示')
+    parser.add_argument('--trace-log', metavar='FILE', help='将每次比对的分阶段耗时以JSON行追加到文件（隐含--trace）')
+    parser.add_argument('--frame-rate', type=int, default=60, help='拖动事件每秒合并处理的次数，0表示每个事件立即处理')
+    parser.add_argument('--input-report', action='store_true', help='退出时打印拖动输入的延迟与每帧事件数')
+    parser.add_argument('--png-compress-level', type=int, default=6, choices=range(10), metavar='0-9',
+                        help='保存PNG时的压缩级别，越大文件越小、编码越慢')
+    parser.add_argument('--optimize', action='store_true', help='保存PNG/JPEG时额外优化以减小文件')
+    parser.add_argument('--autosave', metavar='FILE', help='画布有变化时定时在后台保存为图片文件')
+    parser.add_argument('--autosave-interval', type=float, default=60, metavar='SECONDS', help='自动保存的间隔秒数')
+    args = parser.parse_args()
+    if args.trace or args.trace_log:
+        tracing.enable(log_path=args.trace_log)
+    startup_timer.mark("gui modules imported")
+
     app = tk.Tk()
     app.resizable(False, False)
     app.title('画图板工具')
@@ -24,11 +42,9 @@ if __name__ == "__main__":
     # 居中窗口
     center_window(x, y)
 
-    # 检测设备
-    device = 'cuda' if torch.cuda.is_available() else 'cpu'
-    print(f"使用设备: {device}")
-
-    draw_board = DrawBoard(app, x, y)
+    draw_board = DrawBoard(app, x, y, frame_rate=args.frame_rate)
+    draw_board.png_compress_level = args.png_compress_level
+    draw_board.save_optimize = args.optimize
 
     # 创建菜单
     menu = tk.Menu(app)
@@ -38,6 +54,9 @@ if __name__ == "__main__":
     file_menu = tk.Menu(menu, tearoff=0)
     file_menu.add_command(label='导入', command=draw_board.Open)
     file_menu.add_command(label='保存', command=draw_board.save_by_pil)
+    file_menu.add_command(label='导出矢量图', command=draw_board.save_vector)
+    file_menu.add_command(label='打开会话', command=draw_board.open_session)
+    file_menu.add_command(label='保存会话', command=draw_board.save_session)
     file_menu.add_command(label='退出', command=app.quit)
     menu.add_cascade(label='文件', menu=file_menu)
 
@@ -52,11 +71,14 @@ if __name__ == "__main__":
     tool_menu.add_separator()
     tool_menu.add_command(label='设置画笔大小', command=draw_board.setPenSize)
     tool_menu.add_separator()
-    tool_menu.add_command(label='撤销', command=draw_board.Back)
+    tool_menu.add_command(label='撤销', command=draw_board.Back, accelerator='Ctrl+Z')
+    tool_menu.add_command(label='重做', command=draw_board.Redo, accelerator='Ctrl+Y')
     tool_menu.add_command(label='清屏', command=draw_board.Clear)
     tool_menu.add_command(label='选择前景色', command=draw_board.chooseForeColor)
     tool_menu.add_command(label='选择背景色', command=draw_board.chooseBackColor)
     menu.add_cascade(label='工具', menu=tool_menu)
+    app.bind('<Control-z>', lambda event: draw_board.Back())
+    app.bind('<Control-y>', lambda event: draw_board.Redo())
 
     # 选题菜单
     t_menu = tk.Menu(menu, tearoff=0)
@@ -114,12 +136,65 @@ if __name__ == "__main__":
     t_menu.add_cascade(label='低难度', menu=low_difficulty_menu)
     t_menu.add_cascade(label='高难度', menu=high_difficulty_menu)
     t_menu.add_separator()
+    t_menu.add_command(label='查找最相似的参照图', command=draw_board.find_best_match)
     menu.add_cascade(label='选题(参照)', menu=t_menu)
 
     # 添加状态栏
-    status_bar = tk.Label(app,
+    status_frame = tk.Frame(app, bd=1, relief=tk.SUNKEN)
+    status_frame.pack(side=tk.BOTTOM, fill=tk.X)
+
+    status_bar = tk.Label(status_frame,
                           text=f"画笔大小: {draw_board.size}  |  橡皮擦大小: {draw_board.erase_size}  |  颜色: {draw_board.foreColor}",
-                          bd=1, relief=tk.SUNKEN, anchor=tk.W)
-    status_bar.pack(side=tk.BOTTOM, fill=tk.X)
+                          anchor=tk.W)
+    status_bar.pack(side=tk.LEFT, fill=tk.X, expand=True)
+
+    # 实时相似度开关与显示
+    live_label = tk.Label(status_frame, text="", width=24, anchor=tk.E)
+    live_label.pack(side=tk.RIGHT)
+
+    def show_live_score(score, message=""):
+        if score is not None:
+            live_label.config(text=f"实时相似度: {score * 100:.1f}%", fg="#008000")
+        else:
+            live_label.config(text=message, fg="#666666")
+
+    live_var = tk.BooleanVar(value=False)
+
+    def toggle_live():
+        enabled = live_var.get()
+        draw_board.set_live_scoring(enabled, show_live_score)
+        if not enabled:
+            live_label.config(text="")
+
+    tk.Checkbutton(status_frame, text="实时相似度", variable=live_var,
+                   command=toggle_live).pack(side=tk.RIGHT)
+
+    # 自动保存状态
+    if args.autosave:
+        autosave_label = tk.Label(status_frame, text="", anchor=tk.E, fg="#666666")
+        autosave_label.pack(side=tk.RIGHT)
+        draw_board.set_autosave(args.autosave, args.autosave_interval,
+                                lambda message: autosave_label.config(text=message))
+
+    # 窗口显示后在后台导入torch、预热模型并计算参照图特征，不阻塞绘画
+    def on_preload_ready(device):
+        print(f"使用设备: {device}")
+        draw_board.device = device
+        startup_timer.print_report()
+        if args.startup_report:
+            startup_timer.save_report(args.startup_report)
+
+    def on_preload_error(e):
+        print(f"预加载失败: {e}")
+        startup_timer.print_report()
+
+    preloader = BackgroundPreloader(app, on_ready=on_preload_ready, on_error=on_preload_error)
+    app.after_idle(lambda: (startup_timer.mark("window shown"), preloader.start()))
 
-    app.mainloop()
\ No newline at end of file
+    app.mainloop()
+    if args.input_report:
+        draw_board.motion.print_report()
+    draw_board.scorer.shutdown()
+    draw_board.loader.shutdown()
+    draw_board.writer.shutdown(wait=True)  # 等待尚未写完的图片
+    preloader.shutdown()
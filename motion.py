@@ -0,0 +1,87 @@
+"""按帧合并鼠标拖动事件
+
+高回报率的鼠标每帧会产生多个<B1-Motion>事件，逐个处理时每个事件都要修改一次画布。
+MotionBuffer先把采样点放入缓冲区，每帧通过after()统一交给回调处理一次，
+并统计输入延迟（缓冲区中最早的事件到达到回调处理完成的毫秒数，不含Tk随后重绘窗口的时间）
+与每次处理的事件数。frame_rate为0时不缓冲，每个事件立即处理。
+"""
+import statistics
+import time
+from collections import deque
+
+
+class MotionBuffer:
+    """鼠标拖动采样的帧缓冲，callback(samples)每次收到[(x, y), ...]"""
+
+    def __init__(self, widget, callback, frame_rate=60, history=1000):
+        self.widget = widget
+        self.callback = callback
+        self.frame_rate = frame_rate
+        self.samples = []
+        self.first = None  # 缓冲区中最早的事件到达的时间
+        self._after = None
+        self.latencies = deque(maxlen=history)  # 最近各次处理的输入延迟（毫秒）
+        self.batch_sizes = deque(maxlen=history)  # 最近各次处理的事件数
+
+    @property
+    def interval(self):
+        """每帧的毫秒数"""
+        return max(1, round(1000 / self.frame_rate))
+
+    def add(self, x, y):
+        """加入一个采样点，本帧内第一个采样点到达时预约处理"""
+        if not self.samples:
+            self.first = time.perf_counter()
+        self.samples.append((x, y))
+        if not self.frame_rate:
+            self.flush()
+        elif self._after is None:
+            self._after = self.widget.after(self.interval, self._tick)
+
+    def _tick(self):
+        self._after = None
+        self.flush()
+
+    def flush(self):
+        """立即处理缓冲区中的全部采样点，例如松开鼠标时"""
+        if self._after is not None:
+            self.widget.after_cancel(self._after)
+            self._after = None
+        if not self.samples:
+            return
+        samples, self.samples = self.samples, []
+        self.callback(samples)
+        self.latencies.append((time.perf_counter() - self.first) * 1000)
+        self.batch_sizes.append(len(samples))
+
+    def cancel(self):
+        """丢弃尚未处理的采样点"""
+        if self._after is not None:
+            self.widget.after_cancel(self._after)
+            self._after = None
+        self.samples = []
+
+    def report(self):
+        """最近各次处理的输入延迟分位数与每次处理的事件数"""
+        latencies = sorted(self.latencies)
+        if not latencies:
+            return {'frame_rate': self.frame_rate, 'flushes': 0}
+
+        def percentile(q):
+            return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+        return {'frame_rate': self.frame_rate, 'flushes': len(latencies),
+                'latency_p50_ms': percentile(0.5), 'latency_p95_ms': percentile(0.95),
+                'latency_max_ms': latencies[-1], 'events_per_flush': statistics.mean(self.batch_sizes),
+                'max_events_per_flush': max(self.batch_sizes)}
+
+    def print_report(self):
+        """打印输入延迟统计"""
+        report = self.report()
+        if not report['flushes']:
+            print("输入延迟: 没有拖动事件")
+            return
+        print(f"输入延迟 ({report['frame_rate']} Hz, {report['flushes']}次处理): "
+              f"p50 {report['latency_p50_ms']:.1f} ms, p95 {report['latency_p95_ms']:.1f} ms, "
+              f"最大 {report['latency_max_ms']:.1f} ms; 每次处理 {report['events_per_flush']:.1f} 个事件"
+              f"（最多 {report['max_events_per_flush']} 个）")
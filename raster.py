@@ -0,0 +1,278 @@
+from functools import lru_cache
+
+from PIL import Image, ImageDraw, ImageFont
+
+from imagecache import get_image_cache
+from strokes import Stroke
+
+
+# Tk字体名对应的字体文件，PIL按文件名查找字体
+_FONT_FILES = {'等线': 'Deng.ttf', 'SimHei': 'simhei.ttf', '黑体': 'simhei.ttf', '微软雅黑': 'msyh.ttc'}
+
+
+@lru_cache(maxsize=32)
+def _pil_font(font):
+    """把Tk字体(字体名, 字号)转换为PIL字体，字号为负数时表示像素；找不到字体文件时使用PIL自带字体"""
+    name, size = 'sans-serif', 12
+    if isinstance(font, (tuple, list)) and len(font) > 1:
+        name, size = str(font[0]), int(font[1])
+    pixels = -size if size < 0 else round(size * 4 / 3)
+    for filename in (_FONT_FILES.get(name), name):
+        if filename:
+            try:
+                return ImageFont.truetype(filename, pixels)
+            except OSError:
+                pass
+    return ImageFont.load_default(pixels)
+
+
+def _union(box1, box2):
+    """合并两个(x1, y1, x2, y2)矩形，None表示空"""
+    if box1 is None:
+        return box2
+    if box2 is None:
+        return box1
+    return min(box1[0], box2[0]), min(box1[1], box2[1]), max(box1[2], box2[2]), max(box1[3], box2[3])
+
+
+def render_stroke(draw, stroke, fill, start=0, end=None):
+    """绘制一笔的第start到end个点，返回受影响的矩形
+
+    铅笔与画布上的折线一致：相邻点之间画线段，每个点处画圆形端点与拐角，
+    线宽与圆的直径相同，笔迹粗细不随点的疏密变化；橡皮擦只在每个点处画圆。
+    """
+    half = stroke.size // 2
+    points = stroke.points
+    end = len(stroke) if end is None else end
+    if start >= end:
+        return None
+    if stroke.kind == 'pencil' and start > 0:
+        start -= 1  # 与已绘制部分相连的线段
+    xs = points[2 * start:2 * end:2]
+    ys = points[2 * start + 1:2 * end:2]
+    if stroke.kind == 'pencil' and len(xs) > 1:
+        draw.line(list(zip(xs, ys)), fill=fill, width=2 * half + 1)
+    for x, y in zip(xs, ys):
+        draw.ellipse([x - half, y - half, x + half, y + half], fill=fill, outline=fill)
+    return min(xs) - half, min(ys) - half, max(xs) + half + 1, max(ys) + half + 1
+
+
+def render_entry(img, draw, operations, entry, back_color):
+    """将一个操作绘制到img上，返回受影响的矩形
+
+    单个操作绘制失败时跳过并返回None，栅格的同步不会停在这个操作上。
+    """
+    try:
+        return _render_entry(img, draw, operations, entry, back_color)
+    except Exception as e:
+        print(f"绘制操作失败，已跳过: {e}")
+        return None
+
+
+def _render_entry(img, draw, operations, entry, back_color):
+    palette = operations.palette
+    shapes = operations.shapes
+    if isinstance(entry, Stroke):
+        # 铅笔画折线与圆形端点，橡皮擦在每个采样点处画背景色的圆
+        fill = palette[entry.color] if entry.kind == 'pencil' else back_color
+        return render_stroke(draw, entry, fill)
+
+    record = shapes[entry]
+    kind = shapes.kind(entry)
+    x1, y1, x2, y2 = float(record['x1']), float(record['y1']), float(record['x2']), float(record['y2'])
+    color = palette[record['color']]
+    width = int(record['width'])
+    left, top, right, bottom = min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)
+    box = (left - width, top - width, right + width + 1, bottom + width + 1)
+    if kind == 'line':
+        draw.line([x1, y1, x2, y2], fill=color, width=width)
+    elif kind == 'rectangle':
+        # 向左上方拖动时终点坐标较小，PIL要求左上角在前
+        draw.rectangle([left, top, right, bottom], outline=color, width=width)
+    elif kind == 'oval':
+        draw.ellipse([left, top, right, bottom], outline=color, width=width)
+    elif kind == 'text':
+        text, font = shapes.extra(entry)
+        # 与画布上的文本一致，以坐标为中心
+        draw.text((x1, y1), text, fill=color, font=_pil_font(font), anchor='mm')
+        box = (0, 0) + img.size  # 文本范围取决于字体，按整张画布处理
+    elif kind == 'image':
+        width, height = int(x2), int(y2)
+        try:
+            # 从共享缓存取出与画布上显示的相同的LANCZOS缩放结果
+            img_obj = get_image_cache().get(shapes.extra(entry), (width, height))
+            img.paste(img_obj, (0, 0), img_obj if img_obj.mode == 'RGBA' else None)
+        except Exception:
+            # 如果图片无法加载，绘制一个占位符
+            draw.rectangle([0, 0, width, height], fill="#CCCCCC")
+            draw.text((width // 2, height // 2), "图片加载失败", fill="red")
+        box = (0, 0, width, height)
+    return box
+
+
+def render_operations(operations, size, back_color, img=None, start=0):
+    """将操作记录(OperationLog)中第start个及之后的操作重绘到PIL图像上，未指定img时新建一张背景色图像"""
+    if img is None:
+        img = Image.new('RGB', size, back_color)
+    draw = ImageDraw.Draw(img)
+
+    # 重绘所有操作到PIL图像
+    for entry in operations.entries[start:]:
+        render_entry(img, draw, operations, entry, back_color)
+
+    return img
+
+
+class CanvasRaster:
+    """增量维护的离屏画布栅格
+
+    操作提交后只绘制新增的部分（正在绘制的笔画只绘制新增的已固定的点），并记录自上次快照以来的脏矩形；
+    导出与评分直接复制栅格，耗时与绘制历史长度无关，画布未变化时复用上一次的快照。
+    每提交checkpoint_interval个操作保存一次检查点，撤销时从最近的检查点重绘，
+    检查点最多保留max_checkpoints个；已不可撤销的部分由merge()设定，
+    其中最近的检查点作为基础快照始终保留，撤销不会退回到从空白画布重绘。
+    橡皮擦就地替换条目后，shift()调整条目数，invalidate()标记受影响的范围，下一次sync()时只重绘该范围。
+    """
+
+    def __init__(self, size, back_color, checkpoint_interval=32, max_checkpoints=8):
+        self.size = size
+        self.back_color = back_color
+        self.checkpoint_interval = checkpoint_interval
+        self.max_checkpoints = max_checkpoints
+        self.checkpoints = []  # [(已绘制的操作数, 栅格副本)]，按操作数递增
+        self.base = 0  # 操作记录中已不可撤销的条目数
+        self.stale = None  # 需要按操作记录重绘的范围
+        self.version = 0  # 栅格内容每次变化后递增
+        self._reset()
+
+    def _reset(self):
+        self.image = Image.new('RGB', self.size, self.back_color)
+        self.draw = ImageDraw.Draw(self.image)
+        self.rendered = 0  # 已完整绘制的操作数
+        self.partial = None  # (正在绘制的笔画, 已绘制的点数)，笔画最后一个点可能移动，提交前不绘制
+        self.dirty = (0, 0) + self.size
+        self._snapshot = None
+        self.version += 1
+
+    def _mark(self, box):
+        if box is None:
+            return
+        x1, y1, x2, y2 = box
+        width, height = self.size
+        box = max(0, int(x1)), max(0, int(y1)), min(width, int(x2) + 1), min(height, int(y2) + 1)
+        if box[0] < box[2] and box[1] < box[3]:
+            self.dirty = _union(self.dirty, box)
+            self._snapshot = None
+            self.version += 1
+
+    def sync(self, operations):
+        """把操作记录中尚未绘制的部分绘制到栅格上"""
+        if self.stale is not None:
+            box, self.stale = self.stale, None
+            self.repaint(operations, box)
+        entries = operations.entries
+        back_color = self.back_color
+        if self.partial is not None:
+            # 继续绘制上次未画完的笔画
+            stroke, done = self.partial
+            if self.rendered < len(entries) and entries[self.rendered] is stroke:
+                fill = operations.palette[stroke.color] if stroke.kind == 'pencil' else back_color
+                if stroke is operations.open_stroke:
+                    end = max(done, len(stroke) - 1)
+                    self._mark(render_stroke(self.draw, stroke, fill, start=done, end=end))
+                    self.partial = (stroke, end)
+                    return
+                self._mark(render_stroke(self.draw, stroke, fill, start=done))
+                self.rendered += 1
+                self._maybe_checkpoint()
+            self.partial = None
+
+        while self.rendered < len(entries):
+            entry = entries[self.rendered]
+            if entry is operations.open_stroke:
+                self.partial = (entry, 0)
+                self.sync(operations)
+                return
+            self._mark(render_entry(self.image, self.draw, operations, entry, back_color))
+            self.rendered += 1
+            self._maybe_checkpoint()
+
+    def _maybe_checkpoint(self):
+        if self.rendered % self.checkpoint_interval == 0:
+            self.checkpoints.append((self.rendered, self.image.copy()))
+            if len(self.checkpoints) > self.max_checkpoints:
+                # 最早的检查点是基础快照时保留它，改为丢弃第二个
+                del self.checkpoints[0 if self.checkpoints[1][0] <= self.base else 1]
+
+    def merge(self, base):
+        """操作记录的前base个条目已不可撤销，只保留其中最近的一个检查点作为基础快照"""
+        self.base = base
+        while len(self.checkpoints) > 1 and self.checkpoints[1][0] <= base:
+            del self.checkpoints[0]
+
+    def shift(self, index, removed, added):
+        """操作记录从index开始的removed个条目被替换为added个条目：调整已绘制数与检查点的条目数
+
+        栅格内容要等受影响的范围重绘后才与操作记录一致，见invalidate()。
+        """
+        def moved(count):
+            if count <= index:
+                return count
+            if count >= index + removed:
+                return count + added - removed
+            return index  # 检查点落在被替换的条目之间，重绘后等同于替换位置之前的状态
+
+        self.rendered = moved(self.rendered)
+        self.checkpoints = [(moved(count), image) for count, image in self.checkpoints]
+        self.base = moved(self.base)
+
+    def invalidate(self, box):
+        """标记box范围与操作记录不一致，下一次sync()时重绘"""
+        self.stale = _union(self.stale, box)
+
+    def repaint(self, operations, box):
+        """按当前操作记录重绘栅格与各检查点在box范围内的部分"""
+        width, height = self.size
+        x1, y1, x2, y2 = box
+        region = max(0, int(x1) - 1), max(0, int(y1) - 1), min(width, int(x2) + 2), min(height, int(y2) + 2)
+        if region[0] >= region[2] or region[1] >= region[3]:
+            return
+        keys = operations.query(region)
+        entries = operations.entries
+        for target, count in [(image, count) for count, image in self.checkpoints] + [(self.image, self.rendered)]:
+            scratch = Image.new('RGB', self.size, self.back_color)
+            draw = ImageDraw.Draw(scratch)
+            for entry in entries[:count]:
+                if entry in keys:
+                    render_entry(scratch, draw, operations, entry, self.back_color)
+            if target is self.image and self.partial is not None:
+                stroke, done = self.partial
+                fill = operations.palette[stroke.color] if stroke.kind == 'pencil' else self.back_color
+                render_stroke(draw, stroke, fill, end=done)
+            target.paste(scratch.crop(region), region[:2])
+        self._mark(region)
+
+    def truncate(self, operations):
+        """撤销后操作记录变短：从不超过当前操作数的最近检查点恢复，再重绘其后的操作"""
+        count = len(operations)
+        while self.checkpoints and self.checkpoints[-1][0] > count:
+            self.checkpoints.pop()
+        if self.checkpoints:
+            rendered, image = self.checkpoints[-1]
+            self.image = image.copy()
+            self.draw = ImageDraw.Draw(self.image)
+            self.rendered = rendered
+            self.partial = None
+            self.dirty = (0, 0) + self.size
+            self._snapshot = None
+            self.version += 1
+        else:
+            self._reset()
+        self.sync(operations)
+
+    def snapshot(self):
+        """返回当前栅格的只读副本；自上次快照后没有变化时直接返回上一次的副本"""
+        if self._snapshot is None:
+            self._snapshot = self.image.copy()
+        self.dirty = None
+        return self._snapshot
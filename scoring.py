@@ -0,0 +1,148 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import tracing
+
+
+class BackgroundJob:
+    """一次后台任务"""
+
+    def __init__(self, key, revision, on_done=None, on_error=None, on_cancel=None, on_progress=None, trace=None):
+        self.key = key
+        self.revision = revision
+        self.trace = trace
+        self.submitted = time.perf_counter()
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_cancel = on_cancel
+        self.on_progress = on_progress
+        self.future = None
+        self.progress = ''
+        self._reported = ''
+        self._cancelled = threading.Event()
+
+    def report(self, text):
+        """工作线程汇报当前进度，由主线程轮询后显示"""
+        self.progress = text
+
+    def cancel(self):
+        """取消任务：尚未开始的直接移出队列，已在运行的结果将被丢弃"""
+        self._cancelled.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+
+class BackgroundExecutor:
+    """Tk程序的后台任务执行器，用于相似度评分、图片解码与文件写入等
+
+    任务在工作线程中进行，主线程通过after定时轮询任务状态，
+    所有回调都在Tk主线程中执行。每个key（如参照图、图片id或文件路径）同时只保留一个任务，
+    同一key提交新版本时旧任务会被取消。
+    """
+
+    def __init__(self, app, max_workers=1, poll_interval=50, name='background'):
+        self.app = app
+        self.poll_interval = poll_interval
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self.jobs = {}
+        self._poll_id = None
+
+    def submit(self, key, revision, fn, *args, on_done=None, on_error=None, on_cancel=None, on_progress=None,
+               trace=None):
+        """提交任务fn(job, *args)
+
+        同一key已有相同版本的任务在进行中时不重复提交，返回已有任务；
+        版本不同时取消旧任务后重新提交。
+        trace为tracing.Trace时在工作线程中激活，并记录排队等待时间；任务结束后在回调前结束计时。
+        """
+        job = self.jobs.get(key)
+        if job is not None:
+            if job.revision == revision and not job.cancelled:
+                return job
+            self._cancel_job(job)
+
+        job = BackgroundJob(key, revision, on_done=on_done, on_error=on_error,
+                            on_cancel=on_cancel, on_progress=on_progress, trace=trace)
+        job.future = self.pool.submit(self._run, job, fn, args)
+        self.jobs[key] = job
+        self._schedule_poll()
+        return job
+
+    @staticmethod
+    def _run(job, fn, args):
+        """在工作线程中执行任务"""
+        if job.cancelled:
+            return None
+        if job.trace is None:
+            return fn(job, *args)
+        job.trace.add('queue wait', job.submitted, time.perf_counter())
+        with tracing.activate(job.trace):
+            return fn(job, *args)
+
+    def is_pending(self, key):
+        """判断key是否有进行中的任务"""
+        return key in self.jobs
+
+    def cancel(self, key):
+        """取消key对应的任务"""
+        job = self.jobs.get(key)
+        if job is not None:
+            self._cancel_job(job)
+
+    def cancel_stale(self, revision):
+        """取消所有基于旧版本画布的任务"""
+        for job in list(self.jobs.values()):
+            if job.revision != revision:
+                self._cancel_job(job)
+
+    def _cancel_job(self, job):
+        job.cancel()
+        if self.jobs.get(job.key) is job:
+            del self.jobs[job.key]
+        tracing.finish_trace(job.trace, status='cancelled')
+        if job.on_cancel:
+            job.on_cancel()
+
+    def _schedule_poll(self):
+        if self._poll_id is None:
+            self._poll_id = self.app.after(self.poll_interval, self._poll)
+
+    def _poll(self):
+        """在主线程中检查任务状态并分发回调"""
+        self._poll_id = None
+        for key, job in list(self.jobs.items()):
+            if job.progress != job._reported:
+                job._reported = job.progress
+                if job.on_progress:
+                    job.on_progress(job.progress)
+            if not job.future.done():
+                continue
+            del self.jobs[key]
+            error = job.future.exception()
+            tracing.finish_trace(job.trace, status='error' if error is not None else 'done')
+            if error is not None:
+                if job.on_error:
+                    job.on_error(error)
+            elif job.on_done:
+                job.on_done(job.future.result())
+        if self.jobs:
+            self._schedule_poll()
+
+    def shutdown(self, wait=False):
+        """取消所有任务并关闭工作线程；wait为True时不取消，等待已提交的任务执行完毕，例如尚未写完的文件"""
+        if not wait:
+            for job in list(self.jobs.values()):
+                job.cancel()
+        self.jobs.clear()
+        if self._poll_id is not None:
+            try:
+                self.app.after_cancel(self._poll_id)
+            except Exception:
+                pass
+            self._poll_id = None
+        self.pool.shutdown(wait=wait, cancel_futures=not wait)
@@ -0,0 +1,257 @@
+"""画板会话文件（.sks）
+
+文件以MAGIC开头，其后是一条zlib压缩流，流中依次存放带类型与长度的记录：
+    H  画布宽高与背景色         B  背景色变化
+    P  颜色表新增的颜色         T  操作记录截断到指定条目数（撤销）
+    S  一笔铅笔或橡皮擦：首点绝对坐标，其余为相邻点的整数差值（按范围选用int8、int16或int32）
+    G  直线、矩形、圆形、文本或导入图片：坐标、颜色下标与线宽，文本为[内容, 字体]，图片为文件路径
+    R  橡皮擦就地替换：位置、被替换的条目数与新条目数，其后是新条目的S/G记录
+绘制时每提交一个操作就追加记录并以Z_SYNC_FLUSH刷新，程序崩溃时最多丢失正在绘制的一笔；
+加载时忽略末尾不完整的记录，笔画点序列用NumPy整体还原。
+"""
+import json
+import os
+import struct
+import zlib
+from array import array
+
+from imagecache import get_image_cache
+from strokes import OperationLog, Stroke, SHAPE_KINDS, STROKE_KINDS
+
+
+MAGIC = b'SKSESS\x01'
+EXTENSION = '.sks'
+
+_RECORD = struct.Struct('<BI')
+_HEADER = struct.Struct('<HH')
+_STROKE = struct.Struct('<BHHBI')
+_SHAPE = struct.Struct('<B4fHH')
+_TRUNCATE = struct.Struct('<I')
+_REPLACE = struct.Struct('<III')
+_DELTA_TYPES = {1: '<i1', 2: '<i2', 4: '<i4'}
+
+
+def _encode_stroke(stroke):
+    """笔画记录：类型、颜色下标、大小、差值字节宽度、点数、首点与差值序列"""
+    import numpy as np
+
+    xy = np.rint(np.frombuffer(stroke.points, dtype=np.float32)).astype(np.int32)
+    deltas = np.diff(xy.reshape(-1, 2), axis=0, prepend=np.zeros((1, 2), dtype=np.int32))
+    low, high = (int(deltas[1:].min()), int(deltas[1:].max())) if len(deltas) > 1 else (0, 0)
+    # 首点单独存放，其余差值按范围选用最窄的整数类型
+    first = deltas[:1].astype('<i4').tobytes()
+    if -128 <= low and high <= 127:
+        width = 1
+    elif -32768 <= low and high <= 32767:
+        width = 2
+    else:
+        width = 4
+    return (_STROKE.pack(STROKE_KINDS.index(stroke.kind), stroke.color, int(stroke.size), width, len(stroke))
+            + first + deltas[1:].astype(_DELTA_TYPES[width]).tobytes())
+
+
+def _decode_stroke(body):
+    import numpy as np
+
+    kind, color, size, width, count = _STROKE.unpack_from(body)
+    xy = np.empty((count, 2), dtype=np.int32)
+    if count:
+        xy[0] = np.frombuffer(body, dtype='<i4', count=2, offset=_STROKE.size)
+        xy[1:] = np.frombuffer(body, dtype=_DELTA_TYPES[width], count=(count - 1) * 2,
+                               offset=_STROKE.size + 8).reshape(-1, 2)
+    points = array('f')
+    points.frombytes(xy.cumsum(axis=0).astype(np.float32).tobytes())
+    return Stroke(STROKE_KINDS[kind], color, size, points)
+
+
+def _encode_shape(shapes, row):
+    record = shapes[row]
+    kind = shapes.kind(row)
+    extra = shapes.extra(row)
+    if kind == 'text':
+        extra = json.dumps(extra, ensure_ascii=False).encode('utf-8')
+    elif kind == 'image':
+        extra = get_image_cache().path(extra).encode('utf-8')
+    else:
+        extra = b''
+    return _SHAPE.pack(record['kind'], record['x1'], record['y1'], record['x2'], record['y2'],
+                       record['color'], record['width']) + extra
+
+
+def _decode_shape(shapes, body):
+    kind, x1, y1, x2, y2, color, width = _SHAPE.unpack_from(body)
+    kind = SHAPE_KINDS[kind]
+    extra = body[_SHAPE.size:].decode('utf-8')
+    if kind == 'text':
+        text, font = json.loads(extra)
+        extra = (text, tuple(font) if isinstance(font, list) else font)
+    elif kind == 'image':
+        extra = get_image_cache().register(extra)
+    else:
+        extra = None
+    return shapes.add(kind, x1, y1, x2, y2, color, width, extra)
+
+
+def _encode_entry(operations, entry):
+    """条目的(记录类型, 记录内容)"""
+    if isinstance(entry, Stroke):
+        return b'S', _encode_stroke(entry)
+    return b'G', _encode_shape(operations.shapes, entry)
+
+
+def _record(kind, body):
+    return _RECORD.pack(kind[0], len(body)) + body
+
+
+class SessionWriter:
+    """把操作记录以追加方式写入会话文件
+
+    创建时先把当前操作记录完整写入临时文件再替换目标文件，之后每次sync()只追加新提交的操作；
+    撤销写入截断记录，清屏时调用reset()重写文件。
+    """
+
+    def __init__(self, path, size, back_color, operations=None, level=6):
+        self.path = path
+        self.level = level
+        self.file = None
+        self.reset(size, back_color, operations)
+
+    def reset(self, size, back_color, operations=None):
+        """重写会话文件，内容为当前画布状态"""
+        self.close()
+        self.size = size
+        self.back_color = back_color
+        self.written = 0  # 已写入的操作条目数
+        self.colors = 0  # 已写入的颜色数
+        self.pending = False  # 是否有尚未刷新的记录
+        self.compressor = zlib.compressobj(self.level)
+        tmp_path = self.path + '.tmp'
+        self.file = open(tmp_path, 'wb')
+        self.file.write(MAGIC)
+        self._write(b'H', _HEADER.pack(*size) + back_color.encode('utf-8'))
+        if operations is not None:
+            self.sync(operations)
+        self.file.close()
+        os.replace(tmp_path, self.path)
+        self.file = open(self.path, 'ab')
+
+    def _write(self, kind, body, flush=True):
+        data = self.compressor.compress(_record(kind, body))
+        if flush:
+            data += self.compressor.flush(zlib.Z_SYNC_FLUSH)
+            self.pending = False
+        else:
+            self.pending = True
+        self.file.write(data)
+        if flush:
+            self.file.flush()
+
+    def _write_palette(self, operations):
+        palette = operations.palette
+        for color in palette.colors[self.colors:]:
+            self._write(b'P', color.encode('utf-8'), flush=False)
+        self.colors = len(palette)
+
+    def sync(self, operations):
+        """追加自上次同步以来提交的操作；正在绘制的笔画等到提交后再写入"""
+        entries = operations.entries
+        committed = len(entries)
+        if committed and entries[-1] is operations.open_stroke:
+            committed -= 1
+        if committed < self.written:
+            self._write(b'T', _TRUNCATE.pack(committed))
+            self.written = committed
+        if committed > self.written:
+            self._write_palette(operations)
+            for entry in entries[self.written:committed]:
+                self._write(*_encode_entry(operations, entry), flush=False)
+            self.written = committed
+        if self.pending:
+            self.file.write(self.compressor.flush(zlib.Z_SYNC_FLUSH))
+            self.file.flush()
+            self.pending = False
+
+    def replace(self, operations, index, removed, entries):
+        """记录橡皮擦把从index开始的removed个已写入条目替换为entries，下一次sync()时刷新"""
+        self._write_palette(operations)
+        body = _REPLACE.pack(index, removed, len(entries))
+        body += b''.join(_record(*_encode_entry(operations, entry)) for entry in entries)
+        self._write(b'R', body, flush=False)
+        self.written += len(entries) - removed
+
+    def set_back_color(self, back_color):
+        self.back_color = back_color
+        self._write(b'B', back_color.encode('utf-8'))
+
+    def close(self):
+        if self.file is not None:
+            self.file.write(self.compressor.flush(zlib.Z_FINISH))
+            self.file.close()
+            self.file = None
+
+
+def save_session(path, operations, size, back_color, level=6):
+    """把操作记录一次性保存为会话文件"""
+    SessionWriter(path, size, back_color, operations, level=level).close()
+
+
+def load_session(path):
+    """读取会话文件，返回(操作记录, 画布宽高, 背景色)
+
+    文件末尾因写入中断而不完整的记录会被忽略。
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise ValueError(f"不是画板会话文件: {path}")
+    decompressor = zlib.decompressobj()
+    try:
+        data = decompressor.decompress(data[len(MAGIC):])
+    except zlib.error:
+        raise ValueError(f"会话文件已损坏: {path}")
+
+    operations = OperationLog()
+    operations.index = None  # 直接修改entries，读完后由reindex()统一重建索引与排序键
+    palette = operations.palette
+    size, back_color = None, '#FFFFFF'
+    for kind, body in _records(memoryview(data)):
+        if kind == ord('S'):
+            operations.entries.append(_decode_stroke(body))
+        elif kind == ord('G'):
+            operations.entries.append(_decode_shape(operations.shapes, bytes(body)))
+        elif kind == ord('R'):
+            index, removed, count = _REPLACE.unpack_from(body)
+            entries = []
+            for inner_kind, inner in _records(body[_REPLACE.size:]):
+                if inner_kind == ord('S'):
+                    entries.append(_decode_stroke(inner))
+                else:
+                    entries.append(_decode_shape(operations.shapes, bytes(inner)))
+            operations.entries[index:index + removed] = entries
+        elif kind == ord('P'):
+            palette.index(bytes(body).decode('utf-8'))
+        elif kind == ord('T'):
+            (count,) = _TRUNCATE.unpack_from(body)
+            while len(operations) > count:
+                operations.pop()
+        elif kind == ord('B'):
+            back_color = bytes(body).decode('utf-8')
+        elif kind == ord('H'):
+            size = _HEADER.unpack_from(body)
+            back_color = bytes(body[_HEADER.size:]).decode('utf-8')
+    if size is None:
+        raise ValueError(f"会话文件已损坏: {path}")
+    operations.reindex()
+    return operations, size, back_color
+
+
+def _records(data):
+    """依次产出(记录类型, 记录内容)，末尾不完整的记录被忽略"""
+    offset = 0
+    while offset + _RECORD.size <= len(data):
+        kind, length = _RECORD.unpack_from(data, offset)
+        start = offset + _RECORD.size
+        if start + length > len(data):
+            break
+        offset = start + length
+        yield kind, data[start:offset]
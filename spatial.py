@@ -0,0 +1,61 @@
+"""操作记录的均匀网格空间索引
+
+画布按cell像素划分为网格，每个条目登记到其包围盒覆盖的格子中；
+长笔画按点分段登记，只占用笔迹经过的格子。查询时只检查矩形覆盖的格子，
+与条目总数无关。范围无法确定的条目（文本、导入的图片）登记为全局条目，每次查询都会返回。
+"""
+
+
+class GridIndex:
+    """均匀网格索引，条目可以是任意可哈希对象"""
+
+    def __init__(self, cell=64):
+        self.cell = cell
+        self.cells = {}  # (列, 行) -> 条目集合
+        self.keys = {}  # 条目 -> 登记的格子集合
+        self.everywhere = set()  # 全局条目
+
+    def _cells(self, box):
+        x1, y1, x2, y2 = box
+        cell = self.cell
+        for i in range(int(x1 // cell), int(x2 // cell) + 1):
+            for j in range(int(y1 // cell), int(y2 // cell) + 1):
+                yield i, j
+
+    def insert(self, key, boxes):
+        """登记条目，boxes为覆盖该条目的若干矩形，None表示全局条目"""
+        if boxes is None:
+            self.everywhere.add(key)
+            return
+        cells = set()
+        for box in boxes:
+            cells.update(self._cells(box))
+        for cell in cells:
+            self.cells.setdefault(cell, set()).add(key)
+        self.keys[key] = cells
+
+    def remove(self, key):
+        self.everywhere.discard(key)
+        for cell in self.keys.pop(key, ()):
+            keys = self.cells[cell]
+            keys.discard(key)
+            if not keys:
+                del self.cells[cell]
+
+    def query(self, box):
+        """返回可能与矩形相交的条目集合"""
+        result = set(self.everywhere)
+        cells = self.cells
+        for cell in self._cells(box):
+            keys = cells.get(cell)
+            if keys:
+                result |= keys
+        return result
+
+    def clear(self):
+        self.cells.clear()
+        self.keys.clear()
+        self.everywhere.clear()
+
+    def __len__(self):
+        return len(self.keys) + len(self.everywhere)
@@ -0,0 +1,117 @@
+import importlib
+import json
+import sys
+import threading
+import time
+
+# 启动计时的起点：main.py在导入其他模块前最先导入本模块
+_process_start = time.perf_counter()
+
+# 后台预加载的重量级模块，按顺序导入以便分别计时
+HEAVY_MODULES = ('numpy', 'cv2', 'torch', 'torchvision', 'sklearn.metrics', 'compare', 'feature_store')
+
+
+class StartupTimer:
+    """记录启动过程中各阶段相对进程启动的时间点"""
+
+    def __init__(self, start=None):
+        self.start = _process_start if start is None else start
+        self.marks = []
+        self.lock = threading.Lock()
+
+    def mark(self, name):
+        """记录一个时间点，返回距启动的毫秒数"""
+        elapsed = (time.perf_counter() - self.start) * 1000
+        with self.lock:
+            self.marks.append((name, elapsed, threading.current_thread().name))
+        return elapsed
+
+    def report(self):
+        """返回启动计时报告：每个时间点距启动的毫秒数及与上一时间点的间隔"""
+        with self.lock:
+            marks = sorted(self.marks, key=lambda mark: mark[1])
+        rows = []
+        previous = 0.0
+        for name, elapsed, thread in marks:
+            rows.append({'name': name, 'ms': round(elapsed, 1), 'delta_ms': round(elapsed - previous, 1),
+                         'thread': thread})
+            previous = elapsed
+        return {'python': sys.version.split()[0], 'marks': rows}
+
+    def print_report(self):
+        """打印启动计时报告"""
+        print("启动耗时:")
+        for row in self.report()['marks']:
+            print(f"  {row['name']:<28}{row['ms']:>10.1f} ms  (+{row['delta_ms']:.1f}, {row['thread']})")
+
+    def save_report(self, path):
+        """将启动计时报告保存为JSON"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=2)
+
+
+startup_timer = StartupTimer()
+
+
+class BackgroundPreloader:
+    """后台预加载器
+
+    窗口显示后在后台线程中导入torch等重量级模块、预热模型并计算参照图特征，
+    用户可以同时开始绘画；完成后在Tk主线程中调用on_ready(device)。
+    """
+
+    def __init__(self, app, device=None, on_ready=None, on_error=None, timer=startup_timer, poll_interval=100):
+        self.app = app
+        self.device = device
+        self.on_ready = on_ready
+        self.on_error = on_error
+        self.timer = timer
+        self.poll_interval = poll_interval
+        self.ready = threading.Event()
+        self.error = None
+        self.thread = None
+
+    def start(self):
+        """启动后台线程，并在主线程中轮询完成状态"""
+        self.thread = threading.Thread(target=self._run, name='preloader', daemon=True)
+        self.thread.start()
+        self.app.after(self.poll_interval, self._poll)
+
+    def _run(self):
+        try:
+            for name in HEAVY_MODULES:
+                importlib.import_module(name)
+                self.timer.mark(f"import {name}")
+
+            import compare
+            import feature_store
+            if self.device is None:
+                self.device = compare.default_device()
+            compare.preload_model(self.device)
+            self.timer.mark("model ready")
+            feature_store.get_reference_store(self.device).refresh()
+            self.timer.mark("reference features ready")
+        except Exception as e:
+            self.error = e
+        finally:
+            self.ready.set()
+
+    def _poll(self):
+        if not self.ready.is_set():
+            self.app.after(self.poll_interval, self._poll)
+            return
+        if self.error is not None:
+            if self.on_error:
+                self.on_error(self.error)
+        elif self.on_ready:
+            self.on_ready(self.device)
+
+    def wait(self, timeout=None):
+        """等待预加载完成"""
+        return self.ready.wait(timeout)
+
+    def shutdown(self):
+        """释放已加载的模型；未导入过compare时无需处理"""
+        compare = sys.modules.get('compare')
+        if compare is not None:
+            compare.shutdown_models()
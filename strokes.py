@@ -0,0 +1,443 @@
+import sys
+from array import array
+from bisect import bisect_left
+
+from spatial import GridIndex
+
+
+STROKE_KINDS = ('pencil', 'erase')
+SHAPE_KINDS = ('line', 'rectangle', 'oval', 'text', 'image')
+ORDER_SPACING = 65536.0  # 重新编号时相邻条目排序键的间隔
+
+# 形状记录表的字段：类型、两个端点（文本为位置，图片为宽高）、颜色下标、线宽、附加数据下标
+# 画板启动时不导入NumPy，由后台预加载，记录表在第一次添加形状时才创建
+SHAPE_FIELDS = [
+    ('kind', 'u1'),
+    ('x1', 'f4'), ('y1', 'f4'),
+    ('x2', 'f4'), ('y2', 'f4'),
+    ('color', 'u2'),
+    ('width', 'u2'),
+    ('extra', 'i4'),
+]
+
+
+class Palette:
+    """颜色表：每种颜色字符串只保存一次，笔画与形状中只记录其下标"""
+
+    def __init__(self):
+        self.colors = []
+        self._index = {}
+
+    def index(self, color):
+        """返回颜色的下标，新颜色加入颜色表"""
+        i = self._index.get(color)
+        if i is None:
+            i = len(self.colors)
+            self.colors.append(color)
+            self._index[color] = i
+        return i
+
+    def __getitem__(self, i):
+        return self.colors[i]
+
+    def __len__(self):
+        return len(self.colors)
+
+
+class Stroke:
+    """一笔铅笔或橡皮擦轨迹，点坐标按x, y交替存放在array('f')中"""
+
+    __slots__ = ('kind', 'color', 'size', 'points')
+
+    def __init__(self, kind, color, size, points=None):
+        self.kind = kind
+        self.color = color  # 颜色表下标
+        self.size = size
+        self.points = array('f') if points is None else points
+
+    def append(self, x, y):
+        self.points.append(x)
+        self.points.append(y)
+
+    def __len__(self):
+        return len(self.points) // 2
+
+    def xy(self):
+        """按顺序产出(x, y)"""
+        it = iter(self.points)
+        return zip(it, it)
+
+    def copy(self):
+        return Stroke(self.kind, self.color, self.size, array('f', self.points))
+
+    def boxes(self, chunk=16):
+        """按每chunk个点分段的包围盒（包含笔迹宽度），相邻两段共用端点"""
+        import numpy as np
+
+        xy = np.frombuffer(self.points, dtype=np.float32).reshape(-1, 2)
+        pad = self.size / 2 + 1
+        if not len(xy):
+            return
+        for start in range(0, max(len(xy) - 1, 1), chunk):
+            part = xy[start:start + chunk + 1]
+            (x1, y1), (x2, y2) = part.min(axis=0), part.max(axis=0)
+            yield float(x1) - pad, float(y1) - pad, float(x2) + pad, float(y2) + pad
+
+    def bounds(self):
+        """整笔的包围盒（包含笔迹宽度）"""
+        import numpy as np
+
+        xy = np.frombuffer(self.points, dtype=np.float32).reshape(-1, 2)
+        pad = self.size / 2 + 1
+        if not len(xy):
+            return None
+        (x1, y1), (x2, y2) = xy.min(axis=0), xy.max(axis=0)
+        return float(x1) - pad, float(y1) - pad, float(x2) + pad, float(y2) + pad
+
+    @property
+    def nbytes(self):
+        """对象本身与点缓冲区占用的字节数"""
+        return sys.getsizeof(self) + sys.getsizeof(self.points)
+
+
+def simplify_tolerance(pen_size, ratio=0.1, limit=0.4):
+    """笔画简化的容差：画笔大小的ratio倍，最多limit像素，使重绘后笔迹边缘的偏移不超过一个像素
+
+    PIL绘制宽线段时边缘本身有约半个像素的取整误差，上限取0.4像素以留出余量。
+    """
+    return min(pen_size * ratio, limit)
+
+
+class StrokeSimplifier:
+    """铅笔笔画的在线简化
+
+    先做径向距离过滤：与上一个保存的点距离小于tolerance的输入点不保存，但仍计入经过的输入点；
+    再做流式的Douglas-Peucker判断：笔画最后一个点是可移动的末端，新点到来时，
+    若上一个固定顶点与新点之间经过的输入点到该线段的距离都不超过tolerance，
+    就把末端移到新点，否则末端固定为顶点并追加新点。
+    已固定的顶点不再改变，离屏栅格只增量绘制到最后一个固定顶点。
+    """
+
+    def __init__(self, stroke, tolerance, window=64):
+        self.stroke = stroke
+        self.tolerance = tolerance
+        self.window = window  # 一条线段最多合并的输入点数，限制每次判断的开销
+        self.passed = []  # 上一个固定顶点之后经过的输入点，最后一个即为末端
+        self.skipped = None  # 被径向过滤掉的最后一个输入点，结束时补上
+
+    def add(self, x, y):
+        points = self.stroke.points
+        if len(points) >= 2:
+            dx, dy = x - points[-2], y - points[-1]
+            if dx * dx + dy * dy < self.tolerance * self.tolerance:
+                self.skipped = (x, y)
+                # 末端之后移动时，这些点到新线段的距离同样不能超过tolerance
+                self.passed.append((x, y))
+                return
+        self.skipped = None
+        self._push(x, y)
+
+    def _push(self, x, y):
+        stroke = self.stroke
+        points = stroke.points
+        count = len(stroke)
+        if count < 2:
+            stroke.append(x, y)
+            self.passed = [(x, y)] if count == 1 else []
+            return
+        ax, ay = points[-4], points[-3]
+        if len(self.passed) < self.window and self._within(ax, ay, x, y):
+            points[-2] = x
+            points[-1] = y
+            self.passed.append((x, y))
+        else:
+            stroke.append(x, y)
+            self.passed = [(x, y)]
+
+    def _within(self, ax, ay, bx, by):
+        """经过的输入点到线段(ax, ay)-(bx, by)的距离是否都不超过tolerance"""
+        dx, dy = bx - ax, by - ay
+        length2 = dx * dx + dy * dy
+        limit = self.tolerance * self.tolerance
+        for px, py in self.passed:
+            if length2 == 0:
+                t = 0.0
+            else:
+                t = min(1.0, max(0.0, ((px - ax) * dx + (py - ay) * dy) / length2))
+            ex, ey = ax + t * dx - px, ay + t * dy - py
+            if ex * ex + ey * ey > limit:
+                return False
+        return True
+
+    def finish(self):
+        """笔画结束：补上被径向过滤掉的终点"""
+        if self.skipped is not None:
+            self._push(*self.skipped)
+            self.skipped = None
+        self.passed = []
+
+
+class ShapeTable:
+    """直线、矩形、圆形、文本与图片的记录表
+
+    定长字段存入按需倍增的NumPy结构化数组，文本内容、字体与图片id存入附加列表。
+    """
+
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self.records = None  # 第一次添加时创建
+        self.extras = []
+        self.count = 0
+
+    def add(self, kind, x1, y1, x2, y2, color=0, width=0, extra=None):
+        """追加一条记录，返回行号"""
+        import numpy as np
+
+        if self.records is None:
+            self.records = np.zeros(self.capacity, dtype=SHAPE_FIELDS)
+        elif self.count == len(self.records):
+            records = np.zeros(len(self.records) * 2, dtype=SHAPE_FIELDS)
+            records[:self.count] = self.records[:self.count]
+            self.records = records
+        extra_index = -1
+        if extra is not None:
+            extra_index = len(self.extras)
+            self.extras.append(extra)
+        self.records[self.count] = (SHAPE_KINDS.index(kind), x1, y1, x2, y2, color, width, extra_index)
+        self.count += 1
+        return self.count - 1
+
+    def add_record(self, record, extra=None):
+        """追加一条由detach()取出的记录，返回行号"""
+        kind = SHAPE_KINDS[record['kind']]
+        return self.add(kind, record['x1'], record['y1'], record['x2'], record['y2'],
+                        record['color'], record['width'], extra)
+
+    def detach(self, row):
+        """取出一行记录的副本及其附加数据"""
+        return self.records[row].copy(), self.extra(row)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, row):
+        return self.records[row]
+
+    def kind(self, row):
+        return SHAPE_KINDS[self.records[row]['kind']]
+
+    def bounds(self, row):
+        """直线、矩形与圆形的包围盒（包含线宽），文本与图片的范围取决于字体或画布，返回None"""
+        record = self.records[row]
+        if SHAPE_KINDS[record['kind']] in ('text', 'image'):
+            return None
+        x1, y1, x2, y2 = float(record['x1']), float(record['y1']), float(record['x2']), float(record['y2'])
+        width = int(record['width'])
+        return min(x1, x2) - width, min(y1, y2) - width, max(x1, x2) + width + 1, max(y1, y2) + width + 1
+
+    def extra(self, row):
+        index = self.records[row]['extra']
+        return self.extras[index] if index >= 0 else None
+
+    def truncate(self, count):
+        """只保留前count行"""
+        if count < self.count:
+            extra_count = len(self.extras)
+            for index in self.records[count:self.count]['extra']:
+                if index >= 0:
+                    extra_count = min(extra_count, int(index))
+            del self.extras[extra_count:]
+            self.count = count
+
+    def copy(self):
+        table = ShapeTable.__new__(ShapeTable)
+        table.capacity = self.capacity
+        table.records = self.records[:max(self.count, 1)].copy() if self.records is not None else None
+        table.extras = list(self.extras)
+        table.count = self.count
+        return table
+
+    @property
+    def nbytes(self):
+        records = self.records.nbytes if self.records is not None else 0
+        return records + sum(sys.getsizeof(extra) for extra in self.extras)
+
+
+class OperationLog:
+    """画布操作记录
+
+    entries按绘制顺序保存：铅笔与橡皮擦的每一笔是一个Stroke对象，
+    直线、矩形、圆形、文本与导入的图片是形状表中的行号。
+    已提交的条目登记在网格索引index中，供橡皮擦按位置查找；
+    橡皮擦通过splice()就地替换条目，被替换的形状行留在形状表中，撤销时可以原样放回。
+    每个条目还有一个随entries递增的排序键，position()用二分查找得到条目的下标，不必扫描entries。
+    """
+
+    def __init__(self):
+        self.palette = Palette()
+        self.shapes = ShapeTable()
+        self.entries = []
+        self.open_stroke = None  # 正在绘制、仍会追加点的笔画
+        self.index = GridIndex()
+        self.order = {}  # 条目 -> 排序键
+        self.order_keys = []  # 与entries一一对应的排序键，严格递增
+
+    def _insert_order(self, index, entries):
+        """为插入到index处的条目分配介于前后条目之间的排序键"""
+        if self.index is None:
+            return
+        keys = self.order_keys
+        low = keys[index - 1] if index > 0 else 0.0
+        high = keys[index] if index < len(keys) else low + ORDER_SPACING * (len(entries) + 1)
+        step = (high - low) / (len(entries) + 1)
+        if step < 1.0:
+            # 同一处反复插入后间隔用尽，整体重新编号
+            self._renumber()
+            return
+        new_keys = [low + step * (i + 1) for i in range(len(entries))]
+        keys[index:index] = new_keys
+        self.order.update(zip(entries, new_keys))
+
+    def _renumber(self):
+        """按entries的当前顺序重新分配全部排序键"""
+        self.order_keys = [ORDER_SPACING * (i + 1) for i in range(len(self.entries))]
+        self.order = dict(zip(self.entries, self.order_keys))
+
+    def position(self, entry):
+        """条目在entries中的下标"""
+        return bisect_left(self.order_keys, self.order[entry])
+
+    def begin_stroke(self, kind, color, size):
+        """开始新的一笔，返回可追加点的Stroke"""
+        stroke = Stroke(kind, self.palette.index(color), size)
+        self.entries.append(stroke)
+        self._insert_order(len(self.entries) - 1, [stroke])
+        self.open_stroke = stroke
+        return stroke
+
+    def end_stroke(self):
+        if self.open_stroke is not None:
+            self._index(self.open_stroke)
+        self.open_stroke = None
+
+    def _append_row(self, row):
+        self.entries.append(row)
+        self._insert_order(len(self.entries) - 1, [row])
+        self._index(row)
+
+    def add_shape(self, kind, x1, y1, x2, y2, color, width):
+        self._append_row(self.shapes.add(kind, x1, y1, x2, y2, self.palette.index(color), width))
+
+    def add_text(self, x, y, text, font, color):
+        self._append_row(self.shapes.add('text', x, y, x, y, self.palette.index(color), extra=(text, font)))
+
+    def add_image(self, image_id, width, height):
+        """导入的图片，image_id为imagecache中登记的图片id"""
+        self._append_row(self.shapes.add('image', 0, 0, width, height, extra=image_id))
+
+    def _index(self, entry):
+        if self.index is not None:
+            if isinstance(entry, Stroke):
+                self.index.insert(entry, list(entry.boxes()))
+            else:
+                box = self.shapes.bounds(entry)
+                self.index.insert(entry, None if box is None else [box])
+
+    def bounds(self, entry):
+        """条目的包围盒，范围不确定时返回None"""
+        if isinstance(entry, Stroke):
+            return entry.bounds()
+        return self.shapes.bounds(entry)
+
+    def query(self, box):
+        """返回可能与矩形相交的已提交条目"""
+        return self.index.query(box)
+
+    def reindex(self):
+        """重建网格索引与排序键"""
+        self.index = GridIndex()
+        for entry in self.entries:
+            if entry is not self.open_stroke:
+                self._index(entry)
+        self._renumber()
+
+    def splice(self, index, count, entries):
+        """把从index开始的count个条目替换为entries，返回被替换的条目"""
+        removed = self.entries[index:index + count]
+        self.entries[index:index + count] = entries
+        if self.index is not None:
+            for entry in removed:
+                self.index.remove(entry)
+                del self.order[entry]
+            del self.order_keys[index:index + count]
+            self._insert_order(index, entries)
+            for entry in entries:
+                self._index(entry)
+        return removed
+
+    def pop(self):
+        """移除最后一个操作，返回可交给push()恢复的笔画或(形状记录, 附加数据)
+
+        最后一个形状是形状表的最后一行时同时回收该行。
+        """
+        entry = self.entries.pop()
+        if entry is self.open_stroke:
+            self.open_stroke = None
+        if self.index is not None:
+            self.index.remove(entry)
+            del self.order[entry]
+            self.order_keys.pop()
+        if isinstance(entry, Stroke):
+            return entry
+        detached = self.shapes.detach(entry)
+        if entry == len(self.shapes) - 1:
+            self.shapes.truncate(entry)
+        return detached
+
+    def push(self, detached):
+        """重新追加pop()取出的操作"""
+        if isinstance(detached, Stroke):
+            self.entries.append(detached)
+            self._insert_order(len(self.entries) - 1, [detached])
+            self._index(detached)
+        else:
+            self._append_row(self.shapes.add_record(*detached))
+
+    def clear(self):
+        self.shapes = ShapeTable()
+        self.entries = []
+        self.open_stroke = None
+        self.index = GridIndex()
+        self.order = {}
+        self.order_keys = []
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def snapshot(self):
+        """供后台线程使用的副本：已完成的笔画只读共享，正在绘制的笔画与形状表复制"""
+        log = OperationLog.__new__(OperationLog)
+        log.palette = Palette()
+        log.palette.colors = list(self.palette.colors)
+        log.palette._index = dict(self.palette._index)
+        log.shapes = self.shapes.copy()
+        log.entries = [entry.copy() if entry is self.open_stroke else entry for entry in self.entries]
+        log.open_stroke = None
+        log.index = None
+        log.order = None
+        log.order_keys = None
+        return log
+
+    def point_count(self):
+        """所有笔画的点数"""
+        return sum(len(entry) for entry in self.entries if isinstance(entry, Stroke))
+
+    @property
+    def nbytes(self):
+        """操作记录占用的字节数（笔画对象与点缓冲区、形状表、颜色表与entries列表）"""
+        strokes = sum(entry.nbytes for entry in self.entries if isinstance(entry, Stroke))
+        palette = sum(sys.getsizeof(color) for color in self.palette.colors)
+        return strokes + self.shapes.nbytes + palette + sys.getsizeof(self.entries)
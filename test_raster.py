@@ -0,0 +1,68 @@
+"""离屏栅格的回归测试"""
+import unittest
+
+from raster import CanvasRaster, render_operations
+from strokes import OperationLog
+
+
+SIZE = (200, 150)
+
+
+def _shape_log(kind, x1, y1, x2, y2):
+    operations = OperationLog()
+    operations.add_shape(kind, x1, y1, x2, y2, '#000000', 3)
+    return operations
+
+
+class ShapeDirectionTest(unittest.TestCase):
+    """向左上方拖动的矩形与圆形应与向右下方拖动的结果相同"""
+
+    def test_render_up_left(self):
+        for kind in ('rectangle', 'oval'):
+            with self.subTest(kind=kind):
+                up_left = render_operations(_shape_log(kind, 150, 120, 30, 20), SIZE, '#FFFFFF')
+                down_right = render_operations(_shape_log(kind, 30, 20, 150, 120), SIZE, '#FFFFFF')
+                self.assertEqual(up_left.tobytes(), down_right.tobytes())
+
+    def test_raster_keeps_syncing(self):
+        # 绘制出错曾使rendered停止前进，之后的每次同步都会失败
+        operations = _shape_log('rectangle', 150, 120, 30, 20)
+        raster = CanvasRaster(SIZE, '#FFFFFF')
+        raster.sync(operations)
+        operations.add_shape('oval', 100, 100, 10, 10, '#FF0000', 2)
+        raster.sync(operations)
+        expected = render_operations(operations, SIZE, '#FFFFFF')
+        self.assertEqual(raster.snapshot().tobytes(), expected.tobytes())
+
+
+class TextEntryTest(unittest.TestCase):
+    """文本条目使用Tk的字体元组，栅格需要转换为PIL字体"""
+
+    def test_text_rendered(self):
+        operations = OperationLog()
+        operations.add_text(100, 75, "abc", ("等线", 16), '#000000')
+        img = render_operations(operations, SIZE, '#FFFFFF')
+        self.assertIsNotNone(img.convert('L').point(lambda v: v < 128).getbbox())
+
+    def test_raster_keeps_syncing_after_text(self):
+        operations = OperationLog()
+        operations.add_text(100, 75, "abc", ("等线", 16), '#000000')
+        raster = CanvasRaster(SIZE, '#FFFFFF')
+        raster.sync(operations)
+        operations.add_shape('line', 0, 0, 199, 149, '#FF0000', 2)
+        raster.sync(operations)
+        self.assertEqual(raster.rendered, len(operations.entries))
+        self.assertEqual(raster.snapshot().tobytes(), render_operations(operations, SIZE, '#FFFFFF').tobytes())
+
+    def test_bad_entry_skipped(self):
+        # 无法识别的字体参数也不能让同步停在这个条目上
+        operations = OperationLog()
+        operations.add_text(100, 75, "abc", ("等线", "large"), '#000000')
+        operations.add_shape('line', 0, 0, 199, 149, '#FF0000', 2)
+        raster = CanvasRaster(SIZE, '#FFFFFF')
+        raster.sync(operations)
+        self.assertEqual(raster.rendered, len(operations.entries))
+
+
+if __name__ == '__main__':
+    unittest.main()
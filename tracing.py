@@ -0,0 +1,203 @@
+"""相似度比对的分阶段计时
+
+默认关闭：关闭时span()直接返回同一个空操作对象，不计时、不分配内存。
+开启后每次比对对应一个Trace，各阶段用span记录基于perf_counter的单调计时；
+Trace可以在Tk主线程创建，再通过activate()交给后台线程继续记录。
+比对完成后调用finish_trace()，依次通知通过add_hook()注册的回调，
+并在设置了日志文件时追加一行JSON记录。
+
+    import tracing
+    tracing.enable(log_path='traces.jsonl')
+    tracing.add_hook(lambda trace: print(trace.to_dict()))
+"""
+import json
+import threading
+import time
+import traceback
+from collections import namedtuple
+
+
+# 一个已结束的阶段：相对Trace开始的起止毫秒数、嵌套深度、所在线程与附加属性
+Span = namedtuple('Span', ['name', 'start_ms', 'duration_ms', 'depth', 'thread', 'attrs'])
+
+_enabled = False
+_log_path = None
+_log_lock = threading.Lock()
+_hooks = []
+_local = threading.local()
+
+
+class _NoopSpan:
+    """关闭计时时使用的空操作span"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+class _ActiveSpan:
+    """正在计时的span，退出时记录到所属Trace"""
+
+    __slots__ = ('trace', 'name', 'attrs', 'start', 'depth')
+
+    def __init__(self, trace, name, attrs):
+        self.trace = trace
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.depth = getattr(_local, 'depth', 0)
+        _local.depth = self.depth + 1
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        _local.depth = self.depth
+        if exc_type is not None:
+            self.attrs['error'] = exc_type.__name__
+        self.trace.add(self.name, self.start, end, depth=self.depth, **self.attrs)
+        return False
+
+    def set(self, **attrs):
+        """在span结束前补充属性"""
+        self.attrs.update(attrs)
+
+
+class Trace:
+    """一次比对的计时记录"""
+
+    def __init__(self, name, **attrs):
+        self.name = name
+        self.attrs = attrs
+        self.spans = []
+        self.start = time.perf_counter()
+        self.timestamp = time.time()
+        self.duration_ms = None
+        self._lock = threading.Lock()
+
+    def span(self, name, **attrs):
+        """在当前线程中记录一个阶段"""
+        return _ActiveSpan(self, name, attrs)
+
+    def add(self, name, start, end, depth=0, **attrs):
+        """记录一个由perf_counter起止时间给出的阶段"""
+        span = Span(name=name,
+                    start_ms=(start - self.start) * 1000,
+                    duration_ms=(end - start) * 1000,
+                    depth=depth,
+                    thread=threading.current_thread().name,
+                    attrs=attrs)
+        with self._lock:
+            self.spans.append(span)
+
+    def to_dict(self):
+        """转换为可序列化的字典，阶段按开始时间排序"""
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span.start_ms)
+        return {
+            'name': self.name,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.timestamp)),
+            'duration_ms': self.duration_ms,
+            'attrs': self.attrs,
+            'spans': [dict(span._asdict(), start_ms=round(span.start_ms, 3), duration_ms=round(span.duration_ms, 3))
+                      for span in spans],
+        }
+
+
+def enable(enabled=True, log_path=None):
+    """开启或关闭计时，log_path为每次比对追加一行JSON记录的文件"""
+    global _enabled, _log_path
+    _enabled = enabled
+    _log_path = log_path
+
+
+def is_enabled():
+    return _enabled
+
+
+def add_hook(fn):
+    """注册回调fn(trace)，每次比对结束时在调用finish_trace()的线程中执行"""
+    _hooks.append(fn)
+
+
+def remove_hook(fn):
+    if fn in _hooks:
+        _hooks.remove(fn)
+
+
+def start_trace(name, **attrs):
+    """开始一次比对的计时，关闭计时时返回None"""
+    if not _enabled:
+        return None
+    return Trace(name, **attrs)
+
+
+def current_trace():
+    """当前线程正在记录的Trace"""
+    return getattr(_local, 'trace', None)
+
+
+class activate:
+    """在当前线程中激活trace，with块中的span()都记录到该trace；trace为None时不做任何事"""
+
+    __slots__ = ('trace', 'previous')
+
+    def __init__(self, trace):
+        self.trace = trace
+
+    def __enter__(self):
+        self.previous = getattr(_local, 'trace', None)
+        if self.trace is not None:
+            _local.trace = self.trace
+        return self.trace
+
+    def __exit__(self, *exc):
+        _local.trace = self.previous
+        return False
+
+
+def span(name, **attrs):
+    """记录当前线程中Trace的一个阶段，未开启计时或没有激活的Trace时不做任何事"""
+    if not _enabled:
+        return _NOOP
+    trace = getattr(_local, 'trace', None)
+    if trace is None:
+        return _NOOP
+    return _ActiveSpan(trace, name, attrs)
+
+
+def finish_trace(trace, **attrs):
+    """结束计时：记录总耗时、通知回调并写入日志"""
+    if trace is None:
+        return
+    trace.duration_ms = (time.perf_counter() - trace.start) * 1000
+    trace.attrs.update(attrs)
+    for hook in list(_hooks):
+        try:
+            hook(trace)
+        except Exception:
+            traceback.print_exc()
+    if _log_path:
+        line = json.dumps(trace.to_dict(), ensure_ascii=False, default=str)
+        with _log_lock:
+            with open(_log_path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+
+
+def format_spans(trace):
+    """将各阶段耗时格式化为按嵌套缩进的多行文本"""
+    lines = [f"总耗时 {trace.duration_ms:.1f} ms" if trace.duration_ms is not None else "进行中"]
+    for span in trace.to_dict()['spans']:
+        lines.append(f"{'  ' * span['depth']}{span['name']:<{24 - 2 * span['depth']}}{span['duration_ms']:>9.1f} ms")
+    return '\n'.join(lines)
@@ -0,0 +1,331 @@
+"""把操作记录导出为SVG或PDF矢量图
+
+不经过屏幕截图，也不需要图形界面：直接遍历操作记录，每写出一个条目就写入文件，
+内存占用与记录长度无关。铅笔的每一笔是一条路径；SVG中相同的颜色与线宽只在样式表中出现一次，
+PDF中颜色与线宽只在变化时设置，内容流用Flate压缩。
+画面与画布一致：橡皮擦轨迹画成背景色的圆点，文本以坐标为中心，导入的图片铺满画布。
+
+    export_svg('drawing.svg', board.draw_operations, (1200, 800), '#FFFFFF')
+    export_pdf('drawing.pdf', board.draw_operations, (1200, 800), '#FFFFFF')
+"""
+import base64
+import os
+import zlib
+from xml.sax.saxutils import escape, quoteattr
+
+from PIL import Image
+
+from imagecache import get_image_cache
+from strokes import Stroke
+
+
+def _xy(stroke):
+    """笔画的整数坐标，形状为(点数, 2)"""
+    import numpy as np
+
+    return np.rint(np.frombuffer(stroke.points, dtype=np.float32)).astype(np.int64).reshape(-1, 2)
+
+
+def _num(value):
+    value = round(float(value), 2)
+    return str(int(value)) if value == int(value) else str(value)
+
+
+def _font(font):
+    """(字体名, 字号)，字号为负数时表示像素"""
+    if isinstance(font, (tuple, list)) and len(font) > 1:
+        size = int(font[1])
+        return str(font[0]), (-size if size < 0 else size * 4 / 3)
+    return 'sans-serif', 16
+
+
+def _style_key(operations, entry, back_color):
+    """条目的样式：(类型, 颜色, 线宽)"""
+    if isinstance(entry, Stroke):
+        color = operations.palette[entry.color] if entry.kind == 'pencil' else back_color
+        return entry.kind, color, int(entry.size)
+    record = operations.shapes[entry]
+    kind = operations.shapes.kind(entry)
+    if kind == 'image':
+        return None
+    return ('line' if kind == 'line' else 'outline' if kind != 'text' else 'text',
+            operations.palette[record['color']], 0 if kind == 'text' else int(record['width']))
+
+
+def _svg_style(kind, color, width):
+    if kind == 'text':
+        return f"fill:{color}"
+    cap = 'butt' if kind in ('line', 'outline') else 'round'
+    style = f"fill:none;stroke:{color};stroke-width:{width}"
+    if cap == 'round':
+        style += ';stroke-linecap:round;stroke-linejoin:round'
+    return style
+
+
+def export_svg(path, operations, size, back_color, embed_images=True):
+    """把操作记录写成SVG；embed_images为False时导入的图片只引用原文件路径"""
+    width, height = size
+    # 先收集样式，文件开头的样式表之后逐个条目写出
+    classes = {}
+    for entry in operations.entries:
+        key = _style_key(operations, entry, back_color)
+        if key is not None and key not in classes:
+            classes[key] = f"s{len(classes)}"
+
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f'<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" '
+                f'width="{width}" height="{height}" viewBox="0 0 {width} {height}">\n<style>\n')
+        for key, name in classes.items():
+            f.write(f".{name}{{{_svg_style(*key)}}}\n")
+        f.write(f'</style>\n<rect width="100%" height="100%" fill="{back_color}"/>\n')
+
+        shapes = operations.shapes
+        for entry in operations.entries:
+            if isinstance(entry, Stroke):
+                if not len(entry):
+                    continue
+                xy = _xy(entry)
+                name = classes[_style_key(operations, entry, back_color)]
+                if entry.kind == 'pencil':
+                    # 首点绝对坐标，其余为相对位移；只有一个点时画成圆点
+                    deltas = (xy[1:] - xy[:-1]).ravel() if len(xy) > 1 else (0, 0)
+                    d = f"M{xy[0, 0]} {xy[0, 1]}l" + ' '.join(map(str, deltas))
+                else:
+                    d = ''.join(f"M{x} {y}h0" for x, y in xy.tolist())
+                f.write(f'<path class="{name}" d="{d}"/>\n')
+                continue
+
+            record = shapes[entry]
+            kind = shapes.kind(entry)
+            x1, y1, x2, y2 = (_num(record[key]) for key in ('x1', 'y1', 'x2', 'y2'))
+            if kind == 'image':
+                f.write(f'<image x="0" y="0" width="{x2}" height="{y2}" preserveAspectRatio="none" xlink:href="')
+                _write_image_href(f, get_image_cache().path(shapes.extra(entry)), embed_images)
+                f.write('"/>\n')
+                continue
+            name = classes[_style_key(operations, entry, back_color)]
+            if kind == 'line':
+                f.write(f'<path class="{name}" d="M{x1} {y1}L{x2} {y2}"/>\n')
+            elif kind == 'rectangle':
+                left, right = sorted((float(record['x1']), float(record['x2'])))
+                top, bottom = sorted((float(record['y1']), float(record['y2'])))
+                f.write(f'<rect class="{name}" x="{_num(left)}" y="{_num(top)}" '
+                        f'width="{_num(right - left)}" height="{_num(bottom - top)}"/>\n')
+            elif kind == 'oval':
+                left, right = sorted((float(record['x1']), float(record['x2'])))
+                top, bottom = sorted((float(record['y1']), float(record['y2'])))
+                f.write(f'<ellipse class="{name}" cx="{_num((left + right) / 2)}" cy="{_num((top + bottom) / 2)}" '
+                        f'rx="{_num((right - left) / 2)}" ry="{_num((bottom - top) / 2)}"/>\n')
+            elif kind == 'text':
+                text, font = shapes.extra(entry)
+                family, font_size = _font(font)
+                f.write(f'<text class="{name}" x="{x1}" y="{y1}" font-family={quoteattr(family)} '
+                        f'font-size="{_num(font_size)}" text-anchor="middle" dominant-baseline="central">'
+                        f'{escape(text)}</text>\n')
+        f.write('</svg>\n')
+
+
+def _write_image_href(f, path, embed):
+    """写出图片的链接，嵌入时分块进行base64编码"""
+    if not embed:
+        f.write(escape('file://' + os.path.abspath(path), {'"': '&quot;'}))
+        return
+    try:
+        with open(path, 'rb') as image:
+            mime = Image.MIME.get(Image.open(image).format, 'image/png')
+            image.seek(0)
+            f.write(f"data:{mime};base64,")
+            while True:
+                chunk = image.read(3 * 65536)
+                if not chunk:
+                    break
+                f.write(base64.b64encode(chunk).decode('ascii'))
+    except OSError:
+        pass  # 图片无法读取时链接留空
+
+
+def _rgb(color):
+    """'#RRGGBB'转为PDF的0~1颜色分量"""
+    color = color.lstrip('#')
+    if len(color) == 3:
+        color = ''.join(c * 2 for c in color)
+    return ' '.join(_num(int(color[i:i + 2], 16) / 255) for i in (0, 2, 4))
+
+
+class _PdfWriter:
+    """按顺序写出PDF对象并记录偏移量，最后写出交叉引用表"""
+
+    def __init__(self, f):
+        self.f = f
+        self.offsets = {}
+        self.f.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+    def begin(self, number):
+        self.offsets[number] = self.f.tell()
+        self.f.write(f"{number} 0 obj\n".encode('ascii'))
+
+    def object(self, number, body):
+        self.begin(number)
+        self.f.write(body.encode('latin-1') + b'\nendobj\n')
+
+    def stream(self, number, header, chunks, compress=True):
+        """写出流对象，流的长度写在紧随其后的第number + 1个对象中"""
+        length_number = number + 1
+        self.begin(number)
+        flate = ' /Filter /FlateDecode' if compress else ''
+        self.f.write(f"<< /Length {length_number} 0 R{flate} {header}>>\nstream\n".encode('latin-1'))
+        start = self.f.tell()
+        compressor = zlib.compressobj(6) if compress else None
+        for chunk in chunks:
+            self.f.write(compressor.compress(chunk) if compress else chunk)
+        if compress:
+            self.f.write(compressor.flush())
+        length = self.f.tell() - start
+        self.f.write(b'\nendstream\nendobj\n')
+        self.object(length_number, str(length))
+
+    def finish(self, root):
+        xref = self.f.tell()
+        count = max(self.offsets) + 1
+        self.f.write(f"xref\n0 {count}\n0000000000 65535 f \n".encode('ascii'))
+        for number in range(1, count):
+            self.f.write(f"{self.offsets.get(number, 0):010d} 00000 n \n".encode('ascii'))
+        self.f.write(f"trailer\n<< /Size {count} /Root {root} 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode('ascii'))
+
+
+# 对象编号：1目录 2页面树 3页面 4字体 5字体描述 6、7内容流及其长度，之后是图片
+_CATALOG, _PAGES, _PAGE, _FONT, _FONT_DESCRIPTOR, _CONTENT = 1, 2, 3, 4, 5, 6
+_KAPPA = 0.5522847498  # 用四段三次贝塞尔曲线近似椭圆的控制点系数
+
+
+def _pdf_content(operations, size, back_color, images):
+    """逐个条目产出内容流的字节；导入的图片登记到images中，在内容流之后写出"""
+    width, height = size
+    # 翻转y轴，使用与画布相同的左上角原点坐标
+    yield f"1 0 0 -1 0 {height} cm\n{_rgb(back_color)} rg 0 0 {width} {height} re f\n".encode('ascii')
+    state = {}
+
+    def set_state(**values):
+        ops = []
+        for key, value in values.items():
+            if state.get(key) != value:
+                state[key] = value
+                ops.append({'stroke': f"{value} RG", 'fill': f"{value} rg", 'width': f"{value} w",
+                            'cap': f"{value} J {value} j"}[key])
+        return '\n'.join(ops) + '\n' if ops else ''
+
+    shapes = operations.shapes
+    palette = operations.palette
+    for entry in operations.entries:
+        if isinstance(entry, Stroke):
+            if not len(entry):
+                continue
+            xy = _xy(entry).tolist()
+            color = _rgb(palette[entry.color] if entry.kind == 'pencil' else back_color)
+            out = set_state(stroke=color, width=int(entry.size), cap=1)
+            if entry.kind == 'pencil':
+                points = [f"{x} {y}" for x, y in xy]
+                if len(points) == 1:
+                    points.append(points[0])
+                out += points[0] + ' m ' + ' l '.join(points[1:]) + ' l S\n'
+            else:
+                # 零长度线段加圆端点即为圆点
+                out += ''.join(f"{x} {y} m {x} {y} l " for x, y in xy) + 'S\n'
+            yield out.encode('ascii')
+            continue
+
+        record = shapes[entry]
+        kind = shapes.kind(entry)
+        x1, y1, x2, y2 = (float(record[key]) for key in ('x1', 'y1', 'x2', 'y2'))
+        if kind == 'image':
+            name = f"Im{len(images)}"
+            images.append((name, get_image_cache().path(shapes.extra(entry))))
+            yield f"q {_num(x2)} 0 0 {_num(-y2)} 0 {_num(y2)} cm /{name} Do Q\n".encode('ascii')
+            continue
+        color = _rgb(palette[record['color']])
+        if kind == 'text':
+            text, font = shapes.extra(entry)
+            _, font_size = _font(font)
+            # 按每个字符一个字号宽估计文本宽度，使文本以坐标为中心
+            left = x1 - len(text) * font_size / 2
+            baseline = y1 + font_size * 0.35
+            hex_text = text.encode('utf-16-be', 'replace').hex()
+            yield (set_state(fill=color) + f"BT /F1 {_num(font_size)} Tf 1 0 0 -1 {_num(left)} {_num(baseline)} Tm "
+                   f"<{hex_text}> Tj ET\n").encode('ascii')
+            continue
+        out = set_state(stroke=color, width=int(record['width']), cap=0)
+        if kind == 'line':
+            out += f"{_num(x1)} {_num(y1)} m {_num(x2)} {_num(y2)} l S\n"
+        elif kind == 'rectangle':
+            out += f"{_num(min(x1, x2))} {_num(min(y1, y2))} {_num(abs(x2 - x1))} {_num(abs(y2 - y1))} re S\n"
+        elif kind == 'oval':
+            cx, cy, rx, ry = (x1 + x2) / 2, (y1 + y2) / 2, abs(x2 - x1) / 2, abs(y2 - y1) / 2
+            kx, ky = rx * _KAPPA, ry * _KAPPA
+            n = _num
+            out += (f"{n(cx + rx)} {n(cy)} m "
+                    f"{n(cx + rx)} {n(cy + ky)} {n(cx + kx)} {n(cy + ry)} {n(cx)} {n(cy + ry)} c "
+                    f"{n(cx - kx)} {n(cy + ry)} {n(cx - rx)} {n(cy + ky)} {n(cx - rx)} {n(cy)} c "
+                    f"{n(cx - rx)} {n(cy - ky)} {n(cx - kx)} {n(cy - ry)} {n(cx)} {n(cy - ry)} c "
+                    f"{n(cx + kx)} {n(cy - ry)} {n(cx + rx)} {n(cy - ky)} {n(cx + rx)} {n(cy)} c S\n")
+        yield out.encode('ascii')
+
+
+def _pdf_image(writer, number, path):
+    """写出一张导入的图片；RGB或灰度JPEG直接嵌入原文件，其余解码后压缩存储"""
+    try:
+        img = Image.open(path)
+        if img.format == 'JPEG' and img.mode in ('RGB', 'L'):
+            space = '/DeviceRGB' if img.mode == 'RGB' else '/DeviceGray'
+            header = (f"/Type /XObject /Subtype /Image /Width {img.width} /Height {img.height} "
+                      f"/ColorSpace {space} /BitsPerComponent 8 /Filter /DCTDecode ")
+            with open(path, 'rb') as f:
+                writer.stream(number, header, iter(lambda: f.read(65536), b''), compress=False)
+            return
+        img = img.convert('RGB')
+    except OSError:
+        img = Image.new('RGB', (1, 1), '#CCCCCC')
+    header = (f"/Type /XObject /Subtype /Image /Width {img.width} /Height {img.height} "
+              f"/ColorSpace /DeviceRGB /BitsPerComponent 8 ")
+    rows = max(1, 65536 // (img.width * 3))
+    chunks = (img.crop((0, top, img.width, min(img.height, top + rows))).tobytes()
+              for top in range(0, img.height, rows))
+    writer.stream(number, header, chunks)
+
+
+def export_pdf(path, operations, size, back_color):
+    """把操作记录写成单页PDF，页面大小与画布相同（1像素为1点）"""
+    width, height = size
+    images = []
+    with open(path, 'wb') as f:
+        writer = _PdfWriter(f)
+        writer.stream(_CONTENT, '', _pdf_content(operations, size, back_color, images))
+        xobjects = []
+        for i, (name, image_path) in enumerate(images):
+            number = _CONTENT + 2 + 2 * i
+            _pdf_image(writer, number, image_path)
+            xobjects.append(f"/{name} {number} 0 R")
+        # 文本使用阅读器内置的中文字体，不嵌入字体文件
+        writer.object(_FONT, "<< /Type /Font /Subtype /Type0 /BaseFont /STSong-Light-UniGB-UCS2-H "
+                             "/Encoding /UniGB-UCS2-H /DescendantFonts [<< /Type /Font /Subtype /CIDFontType0 "
+                             "/BaseFont /STSong-Light /CIDSystemInfo << /Registry (Adobe) /Ordering (GB1) "
+                             f"/Supplement 2 >> /FontDescriptor {_FONT_DESCRIPTOR} 0 R /DW 1000 >>] >>")
+        writer.object(_FONT_DESCRIPTOR, "<< /Type /FontDescriptor /FontName /STSong-Light /Flags 6 "
+                                        "/FontBBox [-25 -254 1000 880] /ItalicAngle 0 /Ascent 880 /Descent -120 "
+                                        "/CapHeight 880 /StemV 93 >>")
+        writer.object(_PAGE, f"<< /Type /Page /Parent {_PAGES} 0 R /MediaBox [0 0 {width} {height}] "
+                             f"/Resources << /Font << /F1 {_FONT} 0 R >> /XObject << {' '.join(xobjects)} >> >> "
+                             f"/Contents {_CONTENT} 0 R >>")
+        writer.object(_PAGES, f"<< /Type /Pages /Kids [{_PAGE} 0 R] /Count 1 >>")
+        writer.object(_CATALOG, f"<< /Type /Catalog /Pages {_PAGES} 0 R >>")
+        writer.finish(_CATALOG)
+
+
+def export_vector(path, operations, size, back_color):
+    """按扩展名导出为SVG或PDF"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.svg':
+        export_svg(path, operations, size, back_color)
+    elif extension == '.pdf':
+        export_pdf(path, operations, size, back_color)
+    else:
+        raise ValueError(f"不支持的矢量格式: {extension}")